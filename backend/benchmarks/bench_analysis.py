@@ -0,0 +1,117 @@
+"""
+Бенчмарк базового анализа: прежняя поколоночная реализация против векторной.
+
+Запуск из каталога backend:
+    python -m benchmarks.bench_analysis [--rows 5000000]
+"""
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from processing.analysis import perform_basic_analysis
+
+ROOT = Path(__file__).resolve().parents[2]
+
+
+def legacy_basic_analysis(df: pd.DataFrame) -> dict:
+    """Прежняя реализация perform_basic_analysis (без логирования) для сравнения."""
+    analysis = {'numeric_columns': {}, 'string_columns': {}}
+    for column in df.columns:
+        if pd.api.types.is_numeric_dtype(df[column]):
+            column_data = df[column].dropna()
+            if len(column_data) > 0:
+                analysis['numeric_columns'][column] = {
+                    'sum': float(column_data.sum()),
+                    'mean': float(column_data.mean()),
+                    'min': float(column_data.min()),
+                    'max': float(column_data.max())
+                }
+            else:
+                analysis['numeric_columns'][column] = {'sum': 0.0, 'mean': 0.0, 'min': 0.0, 'max': 0.0}
+        else:
+            analysis['string_columns'][column] = {
+                'unique_values_count': int(df[column].nunique()),
+                'unique_values': df[column].dropna().unique().tolist()[:10]
+            }
+    return analysis
+
+
+def per_column_analysis(df: pd.DataFrame) -> dict:
+    """Те же расширенные статистики, что и в новой реализации, но по колонкам и отдельными редукциями."""
+    analysis = {'numeric_columns': {}, 'string_columns': {}}
+    for column in df.columns:
+        if pd.api.types.is_numeric_dtype(df[column]):
+            column_data = df[column].dropna()
+            analysis['numeric_columns'][column] = {
+                'sum': float(column_data.sum()),
+                'mean': float(column_data.mean()),
+                'min': float(column_data.min()),
+                'max': float(column_data.max()),
+                'std': float(column_data.std()),
+                'q25': float(column_data.quantile(0.25)),
+                'median': float(column_data.median()),
+                'q75': float(column_data.quantile(0.75)),
+                'null_count': int(df[column].isna().sum()),
+            }
+        else:
+            analysis['string_columns'][column] = {
+                'unique_values_count': int(df[column].nunique()),
+                'unique_values': df[column].dropna().unique().tolist()[:10],
+                'top_values': df[column].value_counts().head(10).to_dict(),
+                'null_count': int(df[column].isna().sum()),
+            }
+    return analysis
+
+
+def synthetic_frame(rows: int, seed: int = 42) -> pd.DataFrame:
+    """Синтетический датасет в духе test_cars: числа с пропусками и строковые колонки."""
+    rng = np.random.default_rng(seed)
+    makes = np.array(['Kia', 'BMW', 'Volvo', 'Ford', 'Nissan', 'Toyota', 'Audi', 'Lexus'])
+    df = pd.DataFrame({
+        'year': rng.integers(1990, 2016, rows),
+        'condition': rng.uniform(1, 50, rows),
+        'odometer': rng.integers(0, 300000, rows).astype('float64'),
+        'mmr': rng.integers(500, 90000, rows),
+        'sellingprice': rng.integers(500, 90000, rows),
+        'make': makes[rng.integers(0, len(makes), rows)],
+        'state': rng.choice(['ca', 'tx', 'fl', 'ny'], rows),
+        'vin': pd.util.hash_array(np.arange(rows)).astype(str),
+    })
+    df.loc[rng.random(rows) < 0.05, 'condition'] = np.nan
+    df.loc[rng.random(rows) < 0.05, 'make'] = None
+    return df
+
+
+def best_of(func, df: pd.DataFrame, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(df)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def compare(name: str, df: pd.DataFrame, repeat: int) -> None:
+    legacy = best_of(legacy_basic_analysis, df, repeat)
+    per_column = best_of(per_column_analysis, df, repeat)
+    current = best_of(perform_basic_analysis, df, repeat)
+    print(f"{name:<20} rows={len(df):>9}  legacy(4 stats)={legacy * 1000:9.1f} ms  "
+          f"per-column(same stats)={per_column * 1000:9.1f} ms  vectorized={current * 1000:9.1f} ms  "
+          f"speedup={legacy / current:4.1f}x / {per_column / current:4.1f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=5_000_000, help='размер синтетического датасета')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    compare('test_cars-1000.csv', pd.read_csv(ROOT / 'test_cars-1000.csv'), args.repeat)
+    compare('synthetic', synthetic_frame(args.rows), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Бенчмарк чтения Excel: прежний pd.read_excel против построчного read_excel_chunked.
+
+Книга собирается из test_cars-1000.csv, размноженного --copies раз (генерация
+большой книги сама занимает время). Запуск из каталога backend:
+    python -m benchmarks.bench_excel [--copies 20]
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows: пик RSS не измеряется
+    resource = None
+
+import pandas as pd
+
+from processing import excel
+from processing.stats import DatasetStats
+
+ROOT = Path(__file__).resolve().parents[2]
+
+
+def build_workbook(path: str, copies: int) -> None:
+    df = pd.read_csv(ROOT / 'test_cars-1000.csv')
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        pd.concat([df] * copies, ignore_index=True).to_excel(writer, sheet_name='Data', index=False)
+        df.head(50).to_excel(writer, sheet_name='Sheet2', index=False)
+
+
+def timed(name: str, func) -> pd.DataFrame:
+    start = time.perf_counter()
+    df = func()
+    elapsed = time.perf_counter() - start
+    rss = ''
+    if resource is not None:
+        # Linux отдаёт килобайты, macOS — байты
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 * 1024 if sys.platform == 'darwin' else 1024)
+        rss = f", пик RSS процесса {peak_mb} МБ"
+    print(f"  {name}: {elapsed:.2f} с, {df.shape[0]} строк{rss}")
+    return df
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--copies', type=int, default=20, help='во сколько раз размножить test_cars-1000.csv')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / 'bench.xlsx')
+        build_workbook(path, args.copies)
+        print(f"Книга: {args.copies * 1000} строк, движок {excel.excel_engine()}")
+
+        # Новый путь меряем первым: пик RSS процесса только растёт
+        stats = DatasetStats()
+        chunked = timed('read_excel_chunked + статистика',
+                        lambda: excel.read_excel_chunked(path, consumers=[stats.update]))
+        legacy = timed('pd.read_excel (openpyxl, без статистики)', lambda: pd.read_excel(path))
+        print(f"  колонки совпадают: {list(chunked.columns) == list(legacy.columns)}, "
+              f"строк совпадает: {len(chunked) == len(legacy)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Бенчмарк подсказок для пропусков: прежний перебор строк через iterrows против группировок.
+
+Запуск из каталога backend:
+    python -m benchmarks.bench_imputation [--null-share 0.05]
+"""
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from processing.imputation import suggest_fill_values
+
+ROOT = Path(__file__).resolve().parents[2]
+
+
+def legacy_fill_missing(df: pd.DataFrame, columns, missing_info) -> dict:
+    """Прежний цикл из /api/fill-missing-ai для сравнения."""
+    recommendations = {}
+    for col in missing_info:
+        recs = []
+        for idx, row in df[df[col].isna() | (df[col] == '')].iterrows():
+            mask = pd.Series([True] * len(df))
+            matched_fields = []
+            for c in columns:
+                if c != col and pd.notna(row[c]) and row[c] != '':
+                    mask = mask & (df[c] == row[c])
+                    matched_fields.append(c)
+            candidates = df[mask & df[col].notna() & (df[col] != '')]
+            if not candidates.empty:
+                value = candidates[col].mode().iloc[0]
+                recs.append({'row_idx': int(idx), 'suggested': value, 'confidence': 1.0})
+            else:
+                value = df[col].mode().iloc[0] if not df[col].mode().empty else None
+                recs.append({'row_idx': int(idx), 'suggested': value, 'confidence': 0.5})
+        recommendations[col] = recs
+    return recommendations
+
+
+def table_with_nulls(null_share: float, copies: int = 1, seed: int = 42) -> pd.DataFrame:
+    """test_cars-1000.csv в виде, в каком его присылает фронтенд (JSON-записи), с пропусками."""
+    df = pd.read_csv(ROOT / 'test_cars-1000.csv')
+    df = pd.concat([df] * copies, ignore_index=True)
+    rng = np.random.default_rng(seed)
+    for column in ['make', 'model', 'trim', 'body', 'color', 'interior', 'condition', 'odometer']:
+        df.loc[rng.random(len(df)) < null_share, column] = np.nan
+    records = df.astype(object).where(df.notna(), None).to_dict('records')
+    return pd.DataFrame(records)
+
+
+def timed(func, *args) -> tuple:
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def compare(name: str, df: pd.DataFrame, columns) -> None:
+    missing_info = [c for c in columns if df[c].isna().any()]
+    cells = int(sum(df[c].isna().sum() for c in missing_info))
+
+    legacy_time, legacy = timed(legacy_fill_missing, df, columns, missing_info)
+    grouped_time, grouped = timed(suggest_fill_values, df, columns, missing_info)
+
+    full_matches = sum(1 for recs in legacy.values() for r in recs if r['confidence'] == 1.0)
+    same = sum(
+        1 for col in missing_info for old, new in zip(legacy[col], grouped[col])
+        if old['confidence'] == 1.0 and new['confidence'] == 1.0 and old['suggested'] == new['suggested']
+    )
+    print(f"{name}: rows={len(df)} key columns={len(columns)} missing cells={cells}")
+    print(f"  legacy iterrows: {legacy_time * 1000:10.1f} ms")
+    print(f"  grouped:         {grouped_time * 1000:10.1f} ms  speedup={legacy_time / grouped_time:.0f}x")
+    print(f"  full-key matches identical: {same}/{full_matches}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--null-share', type=float, default=0.05, help='доля пропусков в колонках')
+    parser.add_argument('--copies', type=int, default=1, help='во сколько раз размножить test_cars-1000.csv')
+    args = parser.parse_args()
+
+    df = table_with_nulls(args.null_share, args.copies)
+    compare('all columns', df, df.columns.tolist())
+    compare('categorical keys', df, ['make', 'model', 'trim', 'body', 'transmission', 'state', 'color', 'interior'])
+
+
+if __name__ == '__main__':
+    main()
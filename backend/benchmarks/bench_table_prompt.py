@@ -0,0 +1,55 @@
+"""
+Бенчмарк промпта таблицы: прежний df.to_string(max_rows=100) против сводки в бюджете токенов.
+
+Сравнивает оценку числа токенов, долю строк таблицы, попавших в промпт,
+и время построения. Запуск из каталога backend:
+    python -m benchmarks.bench_table_prompt [--copies 20] [--model gpt-4]
+"""
+import argparse
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from llm.table_prompt import build_table_prompt, estimate_tokens, token_budget
+from processing.analysis import perform_basic_analysis
+
+ROOT = Path(__file__).resolve().parents[2]
+
+
+def legacy_table_string(df: pd.DataFrame) -> str:
+    """Прежнее представление таблицы в /api/analyze."""
+    return df.to_string(index=False, max_rows=100)
+
+
+def compare(name: str, df: pd.DataFrame, model: str) -> None:
+    start = time.perf_counter()
+    legacy = legacy_table_string(df)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    prompt = build_table_prompt(df, perform_basic_analysis(df), token_budget(model))
+    prompt_time = time.perf_counter() - start
+
+    legacy_rows = min(len(df), 100)
+    sampled_rows = sum(1 for line in prompt.splitlines() if line[:1].isdigit())
+    print(f"{name}: {len(df)} строк, модель {model} (бюджет {token_budget(model)})")
+    print(f"  to_string: ~{estimate_tokens(legacy)} токенов, {len(legacy)} символов, "
+          f"строк {legacy_rows} (только начало и конец), {legacy_time * 1000:.1f} мс")
+    print(f"  сводка:    ~{estimate_tokens(prompt)} токенов, {len(prompt)} символов, "
+          f"строк {sampled_rows} по всей таблице + статистика по всем {len(df)}, {prompt_time * 1000:.1f} мс")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--copies', type=int, default=20, help='во сколько раз размножить test_cars-1000.csv')
+    parser.add_argument('--model', default='gpt-4')
+    args = parser.parse_args()
+
+    df = pd.read_csv(ROOT / 'test_cars-1000.csv')
+    compare('test_cars-1000.csv', df, args.model)
+    compare(f'test_cars-1000.csv x{args.copies}', pd.concat([df] * args.copies, ignore_index=True), args.model)
+
+
+if __name__ == '__main__':
+    main()
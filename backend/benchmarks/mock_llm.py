@@ -0,0 +1,83 @@
+"""
+Локальный mock всех трёх провайдеров LLM для бенчмарков: HTTP-сервер, отвечающий
+в форматах OpenAI Chat Completions, YandexGPT и GigaChat (OAuth + chat) с заданной
+задержкой. Хелперы провайдеров направляются на него переменными *_BASE_URL / *_API_URL,
+так что в замер попадает весь путь: промпт, HTTP-клиент, разбор ответа, кэш.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+MOCK_ANSWER = 'Синтетический ответ модели: тенденции, аномалии и выводы по таблице.'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'MockProvider'
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path.endswith('/oauth'):
+            payload = {'access_token': 'mock-token', 'expires_at': int(time.time() * 1000) + 30 * 60 * 1000}
+        else:
+            time.sleep(self.server.latency)
+            prompt_tokens = max(len(body) // 4, 1)
+            completion_tokens = len(MOCK_ANSWER) // 4
+            if self.path.endswith('/completion'):
+                payload = {'result': {
+                    'alternatives': [{'message': {'role': 'assistant', 'text': MOCK_ANSWER}, 'status': 'ALTERNATIVE_STATUS_FINAL'}],
+                    'usage': {'inputTextTokens': str(prompt_tokens), 'completionTokens': str(completion_tokens)},
+                }}
+            else:
+                request = json.loads(body or b'{}')
+                payload = {
+                    'id': 'mock', 'object': 'chat.completion', 'created': int(time.time()),
+                    'model': request.get('model', 'mock'),
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': MOCK_ANSWER}}],
+                    'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                              'total_tokens': prompt_tokens + completion_tokens},
+                }
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MockProvider(ThreadingHTTPServer):
+    """Mock-сервер на свободном порту localhost; latency — искусственная задержка ответа, секунды."""
+
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.05):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.latency = latency
+        self._thread = threading.Thread(target=self.serve_forever, name='mock-llm', daemon=True)
+
+    def __enter__(self) -> 'MockProvider':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def env(self) -> Dict[str, str]:
+        """Переменные окружения, направляющие хелперы провайдеров на mock."""
+        base = f'http://127.0.0.1:{self.server_port}'
+        return {
+            'TEST_MODE': 'false',
+            'OPENAI_API_KEY': 'mock', 'OPENAI_BASE_URL': f'{base}/v1',
+            'YANDEX_FOLDER_ID': 'mock', 'YANDEX_API_KEY': 'mock',
+            'YANDEX_API_URL': f'{base}/foundationModels/v1/completion',
+            # base64 от «mock:mock» — библиотека GigaChat проверяет формат учётных данных
+            'GIGACHAT_CREDENTIALS': 'bW9jazptb2Nr',
+            'GIGACHAT_BASE_URL': f'{base}/api/v1', 'GIGACHAT_AUTH_URL': f'{base}/api/v2/oauth',
+        }
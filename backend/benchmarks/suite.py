@@ -0,0 +1,513 @@
+"""
+Набор бенчмарков бэкенда с сохранённым baseline.
+
+Случаи: разбор CSV/Excel/PDF (process_csv, process_excel, process_pdf), базовый анализ,
+/api/fill-missing-ai, /api/upload целиком (сохранение, разбор, анализ, сериализация
+страницы) и загрузка частями через /api/uploads, отдача страницы /api/datasets/<id>/rows в разных форматах, запросы
+/api/datasets/<id>/query (фильтр с top-N и группировка), временные ряды
+/api/datasets/<id>/timeseries, /api/analyze (в том числе
+map-reduce по всем строкам) против локального mock провайдеров LLM. Данные —
+синтетические (benchmarks/synthetic.py), от 1K до 10M строк, формы narrow и wide.
+
+Каждый случай выполняется в отдельном процессе, поэтому пик RSS относится только к
+нему. Результаты (время, пик RSS, пропускная способность) пишутся в JSON и сравниваются
+с baseline; при регрессии код выхода 1. Запуск из каталога backend:
+    python -m benchmarks.suite [--sizes 1k,10k,100k] [--shapes narrow,wide] [--cases ingest_csv,upload]
+    python -m benchmarks.suite --sizes 1k,10k,100k,1m,10m --output results.json
+    python -m benchmarks.suite --update-baseline
+Синтетические файлы кэшируются в --data-dir. Для ingest_pdf нужен fpdf2.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows: пик RSS не измеряется
+    resource = None
+
+from . import synthetic
+
+BENCH_DIR = Path(__file__).resolve().parent
+BASELINE_PATH = BENCH_DIR / 'baseline.json'
+DEFAULT_DATA_DIR = Path(tempfile.gettempdir()) / 'multi-llm-analyzer' / 'bench-data'
+
+# Страница, которую фронтенд присылает в /api/analyze и /api/fill-missing-ai, не больше 5000 строк
+PAGE_ROWS = 5000
+MOCK_LATENCY = 0.05
+LLM_TARGETS = [('openai', 'gpt-4'), ('yandex', 'yandexgpt'), ('giga', 'GigaChat')]
+
+
+class Skip(Exception):
+    """Случай неприменим к этому размеру или окружению."""
+
+
+def _peak_rss_mb() -> Optional[float]:
+    # VmHWM — пик именно этого процесса: ru_maxrss в Linux переживает exec и
+    # показал бы пик родителя на момент запуска случая
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _server():
+    import pdf_server
+
+    return pdf_server
+
+
+def _records_json(path: Path, rows: int) -> list:
+    import pandas as pd
+
+    df = pd.read_csv(path, nrows=rows)
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+# --- случаи: setup готовит состояние (не замеряется), run — замеряемая часть ---
+
+def _setup_file(path: Path, rows: int) -> Any:
+    return _server(), str(path)
+
+
+def _run_csv(state) -> dict:
+    server, path = state
+    return {'rows_out': len(server.process_csv(path))}
+
+
+def _run_excel(state) -> dict:
+    server, path = state
+    return {'rows_out': len(server.process_excel(path))}
+
+
+def _setup_pdf(path: Path, rows: int) -> Any:
+    from processing.pdf import PageCache
+
+    server = _server()
+    # Без кэша страниц: каждый повтор разбирает PDF заново
+    server.pdf_extractor.page_cache = PageCache(max_pages=0)
+    return server, str(path)
+
+
+def _run_pdf(state) -> dict:
+    server, path = state
+    return {'rows_out': len(server.process_pdf(path))}
+
+
+def _setup_frame(path: Path, rows: int) -> Any:
+    from processing.ingest import read_csv_chunked
+
+    return read_csv_chunked(str(path))
+
+
+def _run_analysis(df) -> dict:
+    from processing.analysis import perform_basic_analysis
+
+    analysis = perform_basic_analysis(df)
+    return {'columns': len(analysis['numeric_columns']) + len(analysis['string_columns'])}
+
+
+def _setup_fill_missing(path: Path, rows: int) -> Any:
+    records = _records_json(path, rows)
+    columns = list(records[0].keys())
+    missing = [c for c in columns if any(record[c] is None for record in records)]
+    body = json.dumps({'table_data': records, 'columns': columns, 'missing_info': missing})
+    return _server().create_app().test_client(), body
+
+
+def _run_fill_missing(state) -> dict:
+    client, body = state
+    response = client.post('/api/fill-missing-ai', data=body, content_type='application/json')
+    if response.status_code != 200:
+        raise RuntimeError(response.get_data(as_text=True)[:200])
+    return {'suggestions': sum(len(recs) for recs in response.get_json()['recommendations'].values())}
+
+
+def _setup_upload(path: Path, rows: int) -> Any:
+    server = _server()
+    app = server.create_app()
+    if path.stat().st_size > app.config['MAX_CONTENT_LENGTH']:
+        raise Skip('file exceeds MAX_CONTENT_LENGTH')
+    return server, app.test_client(), path
+
+
+def _run_upload(state) -> dict:
+    server, client, path = state
+    with open(path, 'rb') as f:
+        response = client.post('/api/upload?page_size=1000', data={'file': (f, 'bench.csv')},
+                               content_type='multipart/form-data')
+    if response.status_code != 200:
+        raise RuntimeError(response.get_data(as_text=True)[:200])
+    # Следующий повтор должен разобрать файл заново, а не взять из кэша датасетов
+    server.dataset_cache.remove(response.get_json()['dataset_id'])
+    return {'response_bytes': len(response.data)}
+
+
+def _setup_chunked_upload(path: Path, rows: int) -> Any:
+    server = _server()
+    return server, server.create_app().test_client(), path
+
+
+def _run_chunked_upload(state) -> dict:
+    server, client, path = state
+    size = path.stat().st_size
+    status = client.post('/api/uploads', json={'filename': 'bench.csv', 'size': size}).get_json()
+    with open(path, 'rb') as f:
+        for index in range(status['chunks']):
+            response = client.put(f"/api/uploads/{status['upload_id']}/chunks/{index}",
+                                  data=f.read(status['chunk_size']))
+            if response.status_code != 200:
+                raise RuntimeError(response.get_data(as_text=True)[:200])
+    response = client.post(f"/api/uploads/{status['upload_id']}/complete?page_size=1000")
+    if response.status_code != 200:
+        raise RuntimeError(response.get_data(as_text=True)[:200])
+    server.dataset_cache.remove(response.get_json()['dataset_id'])
+    return {'chunks': status['chunks'], 'response_bytes': len(response.data)}
+
+
+def _setup_serialize(path: Path, rows: int) -> Any:
+    from processing.ingest import read_csv_chunked
+    from processing.stats import DatasetStats
+
+    server = _server()
+    stats = DatasetStats()
+    df = read_csv_chunked(str(path), consumers=[stats.update])
+    server.dataset_cache.put('bench', df, stats.to_analysis(df), 'bench.csv', stats)
+    return server.create_app().test_client()
+
+
+def _run_serialize(client) -> dict:
+    sizes = {}
+    for name, query, headers in (('records', '', {}), ('columnar', '&format=columnar', {}),
+                                 ('records_gzip', '', {'Accept-Encoding': 'gzip'}),
+                                 ('arrow', '', {'Accept': 'application/vnd.apache.arrow.stream'})):
+        response = client.get(f'/api/datasets/bench/rows?page_size={PAGE_ROWS}{query}', headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(response.get_data(as_text=True)[:200])
+        sizes[f'{name}_bytes'] = len(response.data)
+    return sizes
+
+
+def _setup_query(path: Path, rows: int) -> Any:
+    return _setup_serialize(path, rows), []
+
+
+def _run_query(state) -> dict:
+    client, runs = state
+    # Порог меняется от повтора к повтору: замеряются индексы колонок, а не кэш результатов
+    runs.append(len(runs))
+    year = 1990 + len(runs) % 20
+    queries = [
+        {'filters': [{'column': 'make', 'op': 'in', 'value': ['Kia', 'BMW']}, {'column': 'year', 'op': 'ge', 'value': year}],
+         'sort': [{'column': 'sellingprice', 'descending': True}], 'limit': 100},
+        {'filters': [{'column': 'year', 'op': 'ge', 'value': year}],
+         'group_by': ['make', 'state'], 'aggregates': [{'column': 'sellingprice', 'func': 'mean'}, {'func': 'size'}]},
+    ]
+    matched = 0
+    for query in queries:
+        response = client.post('/api/datasets/bench/query?page_size=1000', json=query)
+        if response.status_code != 200:
+            raise RuntimeError(response.get_data(as_text=True)[:200])
+        matched += response.get_json()['total_rows']
+    return {'result_rows': matched}
+
+
+def _setup_timeseries(path: Path, rows: int) -> Any:
+    return _setup_serialize(path, rows), _server().dataset_cache.get('bench')
+
+
+def _run_timeseries(state) -> dict:
+    client, entry = state
+    # Индекс по времени сбрасывается: в замер входят разбор дат и сортировка, а не только агрегаты
+    entry.timeseries_index.clear()
+    entry.time_column = None
+    points = 0
+    for body in ({'columns': ['sellingprice']},
+                 {'columns': ['sellingprice', 'mmr'], 'resample': 'week', 'rolling': 4}):
+        response = client.post('/api/datasets/bench/timeseries', json=body)
+        if response.status_code != 200:
+            raise RuntimeError(response.get_data(as_text=True)[:200])
+        points += sum(len(series['time']) for series in response.get_json()['series'])
+    return {'chart_points': points}
+
+
+def _setup_llm(path: Path, rows: int) -> Any:
+    from .mock_llm import MockProvider
+
+    mock = MockProvider(MOCK_LATENCY).__enter__()
+    os.environ.update(mock.env())
+    client = _server().create_app().test_client()
+    records = _records_json(path, rows)
+    bodies = [json.dumps({'provider': provider, 'model': model, 'table_data': records, 'bypass_cache': True})
+              for provider, model in LLM_TARGETS]
+    return client, bodies
+
+
+def _run_llm(state) -> dict:
+    from .mock_llm import MOCK_ANSWER
+
+    client, bodies = state
+    started = time.perf_counter()
+    for body in bodies:
+        response = client.post('/api/analyze', data=body, content_type='application/json')
+        if response.status_code != 200 or response.get_json()['analysis'] != MOCK_ANSWER:
+            raise RuntimeError(response.get_data(as_text=True)[:200])
+    per_call = (time.perf_counter() - started) / len(bodies)
+    return {'calls': len(bodies), 'per_call_ms': round(per_call * 1000, 1),
+            'overhead_ms': round((per_call - MOCK_LATENCY) * 1000, 1)}
+
+
+def _setup_map_reduce(path: Path, rows: int) -> Any:
+    from .mock_llm import MockProvider
+
+    mock = MockProvider(MOCK_LATENCY).__enter__()
+    os.environ.update(mock.env())
+    body = json.dumps({'provider': 'openai', 'model': 'gpt-4o', 'dataset_id': 'bench', 'mode': 'map_reduce',
+                       'bypass_cache': True})
+    return _setup_serialize(path, rows), body
+
+
+def _run_map_reduce(state) -> dict:
+    from .mock_llm import MOCK_ANSWER
+
+    client, body = state
+    response = client.post('/api/analyze', data=body, content_type='application/json')
+    if response.status_code != 200 or response.get_json()['analysis'] != MOCK_ANSWER:
+        raise RuntimeError(response.get_data(as_text=True)[:200])
+    return {key: value for key, value in response.get_json()['map_reduce'].items() if key != 'cached_chunks'}
+
+
+@dataclass(frozen=True)
+class Case:
+    input_format: str
+    setup: Callable[[Path, int], Any]
+    run: Callable[[Any], dict]
+    # Больше строк случай не принимает (Excel и PDF генерируются долго, страница фронтенда ограничена)
+    max_rows: int = 10_000_000
+    # Сколько строк реально обрабатывается (для пропускной способности)
+    page_rows: Optional[int] = None
+    shapes: tuple = synthetic.SHAPES
+
+
+CASES: Dict[str, Case] = {
+    'ingest_csv': Case('csv', _setup_file, _run_csv),
+    'ingest_excel': Case('xlsx', _setup_file, _run_excel, max_rows=100_000),
+    # В PDF пишутся только PDF_COLUMNS, поэтому форма wide совпала бы с narrow
+    'ingest_pdf': Case('pdf', _setup_pdf, _run_pdf, max_rows=10_000, shapes=('narrow',)),
+    'basic_analysis': Case('csv', _setup_frame, _run_analysis),
+    'fill_missing_ai': Case('csv', _setup_fill_missing, _run_fill_missing, max_rows=100_000, page_rows=PAGE_ROWS),
+    'upload': Case('csv', _setup_upload, _run_upload),
+    # Загрузка частями по UPLOAD_CHUNK_MB без лимита MAX_CONTENT_LENGTH на весь файл
+    'upload_chunked': Case('csv', _setup_chunked_upload, _run_chunked_upload),
+    'serialize_page': Case('csv', _setup_serialize, _run_serialize, max_rows=1_000_000, page_rows=PAGE_ROWS),
+    'dataset_query': Case('csv', _setup_query, _run_query),
+    # Разбор saledate, сортировка по времени, resample по неделям и прореживание LTTB
+    'timeseries': Case('csv', _setup_timeseries, _run_timeseries),
+    'llm_analyze': Case('csv', _setup_llm, _run_llm, max_rows=100_000, page_rows=PAGE_ROWS),
+    # Все строки через фрагменты; bypass_cache — каждый повтор заново опрашивает mock
+    'llm_map_reduce': Case('csv', _setup_map_reduce, _run_map_reduce, max_rows=100_000),
+}
+
+
+def _child(case_name: str, path: str, rows: int, repeat: int, queue) -> None:
+    """Выполняется в отдельном процессе: setup, затем repeat замеров run."""
+    os.environ.setdefault('TEST_MODE', 'true')
+    os.environ['LOG_LEVEL'] = 'WARNING'
+    os.environ['LLM_CACHE_PATH'] = 'off'
+    try:
+        case = CASES[case_name]
+        state = case.setup(Path(path), min(rows, case.page_rows or rows))
+        setup_rss = _peak_rss_mb()
+        timings = []
+        extra: dict = {}
+        for _ in range(repeat):
+            started = time.perf_counter()
+            extra = case.run(state) or {}
+            timings.append(time.perf_counter() - started)
+        queue.put({'wall_s': round(min(timings), 6), 'wall_s_all': [round(t, 6) for t in timings],
+                   'setup_peak_rss_mb': setup_rss, 'peak_rss_mb': _peak_rss_mb(), **extra})
+    except Skip as e:
+        queue.put({'skipped': str(e)})
+    except Exception as e:
+        queue.put({'error': f'{type(e).__name__}: {e}'})
+
+
+def run_case(case_name: str, rows: int, shape: str, data_dir: Path, repeat: int, timeout: float) -> dict:
+    case = CASES[case_name]
+    result: dict = {'case': case_name, 'shape': shape, 'rows': rows}
+    if rows > case.max_rows:
+        return {**result, 'skipped': f'rows > {case.max_rows}'}
+    if shape not in case.shapes:
+        return {**result, 'skipped': f'shape {shape} not applicable'}
+    try:
+        path = synthetic.dataset_path(data_dir, case.input_format, rows, shape)
+    except ImportError as e:
+        return {**result, 'skipped': f'generator unavailable: {e}'}
+
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_child, args=(case_name, str(path), rows, repeat, queue))
+    process.start()
+    process.join(timeout)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+        return {**result, 'error': f'timeout after {timeout:g} s'}
+    if queue.empty():
+        return {**result, 'error': f'process exited with code {process.exitcode}'}
+    result.update(queue.get())
+
+    if 'wall_s' in result and result['wall_s'] > 0:
+        processed = min(rows, case.page_rows or rows)
+        if 'calls' in result:
+            result['calls_per_s'] = round(result['calls'] / result['wall_s'], 2)
+        else:
+            result['rows_per_s'] = round(processed / result['wall_s'])
+        if case.page_rows is None:
+            result['mb_per_s'] = round(path.stat().st_size / (1024 * 1024) / result['wall_s'], 2)
+    return result
+
+
+def _key(result: dict) -> str:
+    return f"{result['case']}/{result['shape']}/{result['rows']}"
+
+
+def _parse_size(value: str) -> int:
+    value = value.strip().lower()
+    multiplier = {'k': 1_000, 'm': 1_000_000}.get(value[-1:], 1)
+    return int(float(value.rstrip('km')) * multiplier)
+
+
+def _meta(args) -> dict:
+    import numpy
+    import pandas
+
+    from processing.excel import excel_engine
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=BENCH_DIR, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'pandas': pandas.__version__,
+        'numpy': numpy.__version__,
+        'excel_engine': excel_engine(),
+        'repeat': args.repeat,
+    }
+
+
+def compare(results: List[dict], baseline: dict, tolerance: float, rss_tolerance: float,
+            min_delta: float) -> List[str]:
+    """
+    Сравнивает с baseline. Регрессия — время больше baseline на tolerance (доля) и
+    при этом хотя бы на min_delta секунд (шум коротких замеров), или пик RSS больше на rss_tolerance.
+    """
+    previous = {_key(result): result for result in baseline.get('results', [])}
+    regressions = []
+    print(f"\n{'case/shape/rows':<40} {'time':>10} {'baseline':>10} {'change':>8} {'rss MB':>8} {'base MB':>8}")
+    for result in results:
+        old = previous.get(_key(result))
+        if 'wall_s' not in result or old is None or 'wall_s' not in old:
+            continue
+        change = result['wall_s'] / old['wall_s'] - 1 if old['wall_s'] else 0.0
+        flags = []
+        if change > tolerance and result['wall_s'] - old['wall_s'] > min_delta:
+            flags.append('time')
+        rss, old_rss = result.get('peak_rss_mb'), old.get('peak_rss_mb')
+        if rss and old_rss and rss > old_rss * (1 + rss_tolerance):
+            flags.append('rss')
+        print(f"{_key(result):<40} {result['wall_s']:>10.4f} {old['wall_s']:>10.4f} {change:>+8.0%} "
+              f"{rss or 0:>8.0f} {old_rss or 0:>8.0f} {'REGRESSION ' + ','.join(flags) if flags else ''}")
+        if flags:
+            regressions.append(f"{_key(result)}: {', '.join(flags)}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1k,10k,100k', help='размеры датасетов: 1k,10k,100k,1m,10m')
+    parser.add_argument('--shapes', default='narrow,wide', help=f"формы: {','.join(synthetic.SHAPES)}")
+    parser.add_argument('--cases', default=','.join(CASES), help=f"случаи: {','.join(CASES)}")
+    parser.add_argument('--repeat', type=int, default=3, help='повторов на случай (берётся лучшее время)')
+    parser.add_argument('--timeout', type=float, default=1800, help='предел на случай, секунды')
+    parser.add_argument('--data-dir', type=Path, default=DEFAULT_DATA_DIR, help='кэш синтетических файлов')
+    parser.add_argument('--output', type=Path, help='куда записать результаты JSON')
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true', help='записать результаты как новый baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='допустимый рост времени (доля)')
+    parser.add_argument('--rss-tolerance', type=float, default=0.25, help='допустимый рост пика RSS (доля)')
+    parser.add_argument('--min-delta', type=float, default=0.025, help='игнорировать рост времени меньше, секунды')
+    args = parser.parse_args()
+
+    cases = [name.strip() for name in args.cases.split(',') if name.strip()]
+    unknown = [name for name in cases if name not in CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+    shapes = [shape.strip() for shape in args.shapes.split(',') if shape.strip()]
+
+    results = []
+    for rows in [_parse_size(size) for size in args.sizes.split(',')]:
+        for shape in shapes:
+            for case_name in cases:
+                result = run_case(case_name, rows, shape, args.data_dir, args.repeat, args.timeout)
+                results.append(result)
+                if 'wall_s' in result:
+                    rate = (f"{result['rows_per_s']:>12,} rows/s" if 'rows_per_s' in result
+                            else f"{result['calls_per_s']:>12} calls/s")
+                    print(f"{_key(result):<40} {result['wall_s'] * 1000:>10.1f} ms {rate}  "
+                          f"peak RSS {result['peak_rss_mb']} MB", flush=True)
+                else:
+                    print(f"{_key(result):<40} {result.get('skipped') or 'ERROR ' + result.get('error', '')}",
+                          flush=True)
+
+    report = {'meta': _meta(args), 'results': results}
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding='utf-8')
+        print(f"\nResults: {args.output}")
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding='utf-8')
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+
+    errors = [f"{_key(result)}: {result['error']}" for result in results if 'error' in result]
+    if not args.baseline.exists():
+        print(f"\nNo baseline at {args.baseline}; run with --update-baseline to store one")
+        return 1 if errors else 0
+    baseline = json.loads(args.baseline.read_text(encoding='utf-8'))
+    base_meta = baseline.get('meta', {})
+    if (base_meta.get('cpu_count'), base_meta.get('machine')) != (report['meta']['cpu_count'], report['meta']['machine']):
+        print(f"\nWarning: baseline was recorded on a different machine "
+              f"({base_meta.get('machine')}, {base_meta.get('cpu_count')} CPU); compare with care")
+    regressions = compare(results, baseline, args.tolerance, args.rss_tolerance, args.min_delta)
+    for line in errors + regressions:
+        print(f"FAIL {line}")
+    return 1 if errors or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Синтетические датасеты для бенчмарков: от тысяч до десятков миллионов строк.
+
+Данные в духе test_cars (числа, категории, уникальные строки, даты, флаги) с
+пропусками; форма narrow — 10 колонок, wide — ещё 50 числовых и категориальных.
+Генерация детерминирована (seed), файлы пишутся чанками и переиспользуются между
+запусками: повторный запуск бенчмарка не генерирует данные заново.
+"""
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+SHAPES = ('narrow', 'wide')
+WIDE_EXTRA_COLUMNS = 50
+GENERATE_CHUNK_ROWS = 500_000
+# Таблица в PDF должна помещаться по ширине страницы
+PDF_COLUMNS = ['year', 'make', 'model', 'state', 'odometer', 'sellingprice']
+PDF_ROWS_PER_PAGE = 40
+
+MAKES = np.array(['Kia', 'BMW', 'Volvo', 'Ford', 'Nissan', 'Toyota', 'Audi', 'Lexus', 'Honda', 'Mazda'])
+STATES = np.array(['ca', 'tx', 'fl', 'ny', 'pa', 'ga', 'il', 'oh', 'nj', 'mi'])
+
+
+def frame(rows: int, shape: str = 'narrow', null_share: float = 0.05, seed: int = 42, offset: int = 0) -> pd.DataFrame:
+    """Синтетический DataFrame; offset — номер первой строки (чанки большого файла не повторяются)."""
+    rng = np.random.default_rng([seed, offset])
+    index = np.arange(offset, offset + rows)
+    models = np.array([f"{make} M{i}" for make in MAKES for i in range(20)])
+    df = pd.DataFrame({
+        'year': rng.integers(1990, 2016, rows),
+        'make': MAKES[rng.integers(0, len(MAKES), rows)],
+        'model': models[rng.integers(0, len(models), rows)],
+        'state': STATES[rng.integers(0, len(STATES), rows)],
+        'condition': rng.uniform(1, 50, rows).round(1),
+        'odometer': rng.integers(0, 300_000, rows).astype('float64'),
+        'mmr': rng.integers(500, 90_000, rows),
+        'sellingprice': rng.integers(500, 90_000, rows),
+        'vin': pd.util.hash_array(index).astype(str),
+        'saledate': (np.datetime64('2014-01-01') + rng.integers(0, 730, rows).astype('timedelta64[D]')).astype(str),
+    })
+    if shape == 'wide':
+        extra = {}
+        for i in range(WIDE_EXTRA_COLUMNS):
+            if i % 2:
+                extra[f'cat_{i}'] = STATES[rng.integers(0, len(STATES), rows)]
+            else:
+                extra[f'num_{i}'] = rng.normal(1000, 250, rows).round(2)
+        df = pd.concat([df, pd.DataFrame(extra)], axis=1)
+    elif shape != 'narrow':
+        raise ValueError(f'Unknown shape: {shape}')
+
+    for column in ['make', 'model', 'condition', 'odometer'] + [c for c in df.columns if c.startswith('cat_')][:5]:
+        df[column] = df[column].where(rng.random(rows) >= null_share)
+    return df
+
+
+def _chunks(rows: int, shape: str, seed: int) -> Iterator[pd.DataFrame]:
+    for offset in range(0, rows, GENERATE_CHUNK_ROWS):
+        yield frame(min(GENERATE_CHUNK_ROWS, rows - offset), shape, seed=seed, offset=offset)
+
+
+def write_csv(path: Path, rows: int, shape: str, seed: int = 42) -> None:
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        for i, chunk in enumerate(_chunks(rows, shape, seed)):
+            chunk.to_csv(f, index=False, header=i == 0)
+
+
+def write_xlsx(path: Path, rows: int, shape: str, seed: int = 42) -> None:
+    from openpyxl import Workbook
+
+    # write_only: строки пишутся в XML потоком, книга не держится в памяти
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Data')
+    for i, chunk in enumerate(_chunks(rows, shape, seed)):
+        if i == 0:
+            sheet.append(list(chunk.columns))
+        for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False):
+            sheet.append(list(row))
+    workbook.save(path)
+
+
+def write_pdf(path: Path, rows: int, shape: str, seed: int = 42) -> None:
+    """Таблица на нескольких страницах с повтором заголовка; только колонки PDF_COLUMNS. Нужен fpdf2."""
+    from fpdf import FPDF
+
+    df = frame(rows, shape, seed=seed)[PDF_COLUMNS].astype(object).fillna('')
+    pdf = FPDF()
+    pdf.set_font('Helvetica', size=8)
+    for start in range(0, rows, PDF_ROWS_PER_PAGE):
+        pdf.add_page()
+        with pdf.table() as table:
+            header = table.row()
+            for column in PDF_COLUMNS:
+                header.cell(column)
+            for record in df.iloc[start:start + PDF_ROWS_PER_PAGE].itertuples(index=False):
+                row = table.row()
+                for value in record:
+                    row.cell(str(value))
+    pdf.output(str(path))
+
+
+WRITERS = {'csv': write_csv, 'xlsx': write_xlsx, 'pdf': write_pdf}
+
+
+def dataset_path(data_dir: Path, file_format: str, rows: int, shape: str, seed: int = 42) -> Path:
+    """Путь к файлу датасета; файл генерируется, если его ещё нет."""
+    data_dir.mkdir(parents=True, exist_ok=True)
+    path = data_dir / f"synthetic-{shape}-{rows}-{seed}.{file_format}"
+    if not path.exists():
+        partial = path.with_name(path.name + '.part')
+        WRITERS[file_format](partial, rows, shape, seed)
+        partial.rename(path)
+    return path
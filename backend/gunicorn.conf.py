@@ -0,0 +1,44 @@
+# Конфигурация gunicorn: приложение загружается в мастере, воркеры создаются fork (copy-on-write)
+import os
+import tempfile
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# .env читается до значений по умолчанию ниже, иначе они перекрыли бы заданные в нём
+load_dotenv(dotenv_path=Path(__file__).resolve().parents[1] / '.env')
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+wsgi_app = "wsgi:app"
+preload_app = True
+
+workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+# Потоки в воркере: потоковый анализ (SSE) и ожидание ответа LLM держат поток, а не процесс
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "8"))
+# Анализ больших файлов и синхронные запросы к LLM идут десятки секунд
+timeout = int(os.getenv("WEB_TIMEOUT", "300"))
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+loglevel = os.getenv("LOG_LEVEL", "info").lower()
+accesslog = os.getenv("ACCESS_LOG") or None
+
+if workers > 1:
+    # Запросы одного клиента попадают в разные воркеры: датасеты сразу пишутся на общий диск,
+    # чтобы страница или анализ, пришедшие в соседний воркер, не требовали повторной загрузки
+    os.environ.setdefault("DATASET_CACHE_SPILL_DIR", os.path.join(tempfile.gettempdir(), 'multi-llm-analyzer', 'datasets'))
+    os.environ.setdefault("DATASET_CACHE_WRITE_THROUGH", "true")
+
+
+def post_fork(server, worker):
+    # Потоки, соединения SQLite и пулы процессов не переживают fork — запускаем их в каждом воркере
+    import pdf_server
+
+    pdf_server.start_worker()
+
+
+def worker_exit(server, worker):
+    import pdf_server
+
+    pdf_server.stop_worker()
@@ -0,0 +1,3 @@
+from .queue import FileResult, JobCancelled, JobContext, JobQueue, concurrency_from_env, create_job_queue_from_env
+
+__all__ = ['FileResult', 'JobCancelled', 'JobContext', 'JobQueue', 'concurrency_from_env', 'create_job_queue_from_env']
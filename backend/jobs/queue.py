@@ -0,0 +1,481 @@
+# Фоновые задачи: очередь в процессе сервера с пулом потоков, состояние задач в SQLite
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    owner TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0
+)
+"""
+# Колонки, добавленные после первой версии схемы: старые базы дополняются при открытии
+_MIGRATIONS = {
+    'owner': "ALTER TABLE jobs ADD COLUMN owner TEXT",
+    'cancel_requested': "ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0",
+}
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _iso(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp is not None else None
+
+
+class JobCancelled(Exception):
+    """Задача отменена: обработчик прерывает работу при следующей проверке."""
+
+
+@dataclass
+class FileResult:
+    """Результат-файл (например, PDF отчёта): хранится на диске и отдаётся отдельным запросом."""
+    data: bytes
+    mimetype: str
+    filename: str
+
+
+class JobContext:
+    """Передаётся обработчику: сообщает прогресс и проверяет, не отменена ли задача."""
+
+    def __init__(self, queue: 'JobQueue', job_id: str):
+        self.job_id = job_id
+        self._queue = queue
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self) -> None:
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def progress(self, fraction: Optional[float] = None, message: Optional[str] = None) -> None:
+        """Обновляет прогресс (0..1) и/или сообщение; заодно точка отмены."""
+        self.check_cancelled()
+        self._queue._set_progress(self.job_id, fraction, message)
+
+
+# Обработчик получает контекст и payload задачи; результат — JSON-сериализуемое значение или FileResult
+Handler = Callable[[JobContext, dict], Any]
+# Освобождает то, на что ссылается payload (например, файл загрузки), если обработчик так и не довёл задачу до конца
+Cleanup = Callable[[dict], None]
+
+
+@dataclass
+class _JobType:
+    handler: Handler
+    concurrency: int
+    cleanup: Optional[Cleanup] = None
+    running: int = 0
+    pending: Deque[str] = field(default_factory=deque)
+
+
+class JobQueue:
+    """
+    Очередь фоновых задач без внешнего брокера.
+
+    Задачи выполняются общим пулом потоков; для каждого типа задач свой лимит
+    одновременно выполняемых, остальные ждут в очереди типа и не занимают поток
+    пула. Состояние, прогресс и результаты хранятся в SQLite (файлы-результаты —
+    рядом на диске) и удаляются через result_ttl после завершения.
+
+    Несколько воркеров сервера, созданных fork после импорта приложения, делят одно
+    хранилище: задачу выполняет принявший её процесс (колонка owner), статус читается
+    из любого, отмена передаётся через базу. Соединение с SQLite у каждого процесса своё.
+    """
+
+    def __init__(self, max_workers: int, store_dir: str, result_ttl: float):
+        self.max_workers = max(max_workers, 1)
+        self.result_ttl = result_ttl
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+        self._types: Dict[str, _JobType] = {}
+        self._active: Dict[str, JobContext] = {}
+        self._lock = threading.Lock()
+        # Запуск сервера: процессы одного запуска (воркеры после fork) получают тот же идентификатор
+        self._boot_id = uuid.uuid4().hex[:12]
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_pid: Optional[int] = None
+        # Ставится recover(): процесс принимает и выполняет задачи
+        self.running = False
+
+    @property
+    def owner(self) -> str:
+        """Идентификатор текущего процесса-исполнителя: запуск сервера и pid."""
+        return f"{self._boot_id}:{os.getpid()}"
+
+    def _connection(self) -> sqlite3.Connection:
+        # Вызывается под self._lock. Соединение SQLite нельзя переносить через fork —
+        # процесс, унаследовавший чужое, открывает своё
+        if self._db is None or self._db_pid != os.getpid():
+            db = sqlite3.connect(str(self.store_dir / 'jobs.sqlite3'), timeout=30, check_same_thread=False)
+            # WAL: воркеры читают статусы, не дожидаясь записи соседей
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(_SCHEMA)
+            columns = {row[1] for row in db.execute("PRAGMA table_info(jobs)")}
+            for column, statement in _MIGRATIONS.items():
+                if column not in columns:
+                    db.execute(statement)
+            db.commit()
+            self._db, self._db_pid = db, os.getpid()
+        return self._db
+
+    def _owner_alive(self, owner: Optional[str]) -> bool:
+        """Жив ли процесс-исполнитель: из текущего запуска сервера и ещё не завершился."""
+        if not owner or ':' not in owner:
+            return False
+        boot_id, pid = owner.split(':', 1)
+        if boot_id != self._boot_id:
+            return False
+        if int(pid) == os.getpid():
+            return True
+        if os.name == 'nt':
+            # Без fork воркеры одного запуска не появляются, а os.kill в Windows завершает процесс
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def register(self, job_type: str, handler: Handler, concurrency: int, cleanup: Optional[Cleanup] = None) -> None:
+        """
+        Регистрирует тип задач и лимит одновременно выполняемых задач этого типа.
+        cleanup вызывается с payload задачи, которая завершилась без обработчика:
+        отменена в очереди или прервана гибелью процесса.
+        """
+        self._types[job_type] = _JobType(handler, max(concurrency, 1), cleanup)
+
+    def submit(self, job_type: str, payload: dict) -> str:
+        """Ставит задачу в очередь и сразу возвращает её идентификатор."""
+        if job_type not in self._types:
+            raise ValueError(f'Unknown job type: {job_type}')
+        self.purge_expired()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            db = self._connection()
+            db.execute(
+                "INSERT INTO jobs (id, type, status, payload, created_at, owner) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, job_type, QUEUED, json.dumps(payload, ensure_ascii=False, default=str), time.time(), self.owner)
+            )
+            db.commit()
+            self._enqueue(job_type, job_id)
+        logger.debug("Job %s (%s) queued", job_id, job_type)
+        return job_id
+
+    def recover(self) -> None:
+        """
+        Запускает выполнение задач в текущем процессе. Задачи процессов, которых больше
+        нет (перезапуск сервера, упавший воркер), подбираются: прерванные на середине
+        помечаются неудачными, а ждавшие в их очереди переходят к текущему процессу.
+        Вызывается после регистрации типов, в каждом воркере — после fork.
+        """
+        with self._lock:
+            db = self._connection()
+            now = time.time()
+            owners = [row[0] for row in db.execute(
+                "SELECT DISTINCT owner FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            )]
+            for owner in owners:
+                if self._owner_alive(owner):
+                    continue
+                for job_type, payload in db.execute(
+                    "SELECT type, payload FROM jobs WHERE status = ? AND owner IS ?", (RUNNING, owner)
+                ).fetchall():
+                    self._cleanup(job_type, payload)
+                db.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ?, payload = '{}' WHERE status = ? AND owner IS ?",
+                    (FAILED, 'Сервер перезапущен во время выполнения задачи', now, RUNNING, owner)
+                )
+                db.execute("UPDATE jobs SET owner = ? WHERE status = ? AND owner IS ?", (self.owner, QUEUED, owner))
+            rows = db.execute(
+                "SELECT id, type FROM jobs WHERE status = ? AND owner = ? ORDER BY created_at", (QUEUED, self.owner)
+            ).fetchall()
+            recovered = 0
+            for job_id, job_type in rows:
+                if job_id in self._active:
+                    continue
+                if job_type in self._types:
+                    self._enqueue(job_type, job_id)
+                    recovered += 1
+                else:
+                    db.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                               (FAILED, f'Unknown job type: {job_type}', now, job_id))
+            db.commit()
+            self.running = True
+        if recovered:
+            logger.info("Recovered %s queued jobs", recovered)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Состояние задачи для клиента или None, если её нет или результат уже удалён."""
+        self.purge_expired()
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT id, type, status, progress, message, result, error, created_at, started_at, finished_at, "
+                "cancel_requested FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            (job_id, job_type, status, progress, message, result, error,
+             created_at, started_at, finished_at, cancel_requested) = row
+            job = {
+                'job_id': job_id,
+                'type': job_type,
+                'status': status,
+                'progress': progress,
+                'message': message,
+                'created_at': _iso(created_at),
+                'started_at': _iso(started_at),
+                'finished_at': _iso(finished_at),
+            }
+            if status == QUEUED and job_type in self._types:
+                pending = self._types[job_type].pending
+                job['queue_position'] = pending.index(job_id) + 1 if job_id in pending else 0
+            context = self._active.get(job_id)
+            if status not in FINISHED and (cancel_requested or (context is not None and context.cancelled)):
+                job['cancel_requested'] = True
+            if status in FINISHED:
+                job['expires_at'] = _iso(finished_at + self.result_ttl)
+            if result is not None:
+                job['result'] = json.loads(result)
+            if error is not None:
+                job['error'] = error
+            return job
+
+    def result_file(self, job_id: str) -> Optional[Tuple[str, str, str]]:
+        """Путь, MIME-тип и имя файла результата или None, если результат задачи не файл."""
+        job = self.get(job_id)
+        if job is None or job['status'] != SUCCEEDED or not isinstance(job.get('result'), dict):
+            return None
+        file_info = job['result'].get('file')
+        path = self._result_path(job_id)
+        if not file_info or not path.exists():
+            return None
+        return str(path), file_info['mimetype'], file_info['filename']
+
+    def cancel(self, job_id: str) -> Optional[dict]:
+        """
+        Отменяет задачу. Ждущая в очереди отменяется сразу; выполняющаяся получает
+        флаг отмены и завершается при следующей проверке, её результат отбрасывается.
+        Задачу другого воркера отменяет запись в базе: ждущую — сразу, выполняющуюся —
+        когда её процесс в следующий раз сообщит прогресс.
+        """
+        with self._lock:
+            db = self._connection()
+            row = db.execute("SELECT type, status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job_type, status = row
+            context = self._active.get(job_id)
+            if status == QUEUED and context is None:
+                self._cleanup(job_type, db.execute("SELECT payload FROM jobs WHERE id = ?", (job_id,)).fetchone()[0])
+                db.execute("UPDATE jobs SET status = ?, finished_at = ?, payload = '{}' WHERE id = ? AND status = ?",
+                           (CANCELLED, time.time(), job_id, QUEUED))
+                db.commit()
+            elif status == RUNNING and context is None:
+                db.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+                db.commit()
+            elif status not in FINISHED and context is not None:
+                context._cancel.set()
+                job_type_state = self._types.get(job_type)
+                if status == QUEUED and job_type_state is not None and job_id in job_type_state.pending:
+                    job_type_state.pending.remove(job_id)
+                    del self._active[job_id]
+                    self._cleanup(job_type, db.execute("SELECT payload FROM jobs WHERE id = ?", (job_id,)).fetchone()[0])
+                    self._finish(job_id, CANCELLED)
+        return self.get(job_id)
+
+    def purge_expired(self) -> int:
+        """Удаляет завершённые задачи старше result_ttl вместе с файлами результатов."""
+        with self._lock:
+            db = self._connection()
+            deadline = time.time() - self.result_ttl
+            expired = [row[0] for row in db.execute(
+                "SELECT id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (deadline,)
+            )]
+            if not expired:
+                return 0
+            db.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in expired])
+            db.commit()
+        for job_id in expired:
+            try:
+                self._result_path(job_id).unlink(missing_ok=True)
+            except OSError as e:
+                logger.error("Error removing job result %s: %s", job_id, e)
+        logger.debug("Purged %s expired jobs", len(expired))
+        return len(expired)
+
+    def stats(self) -> dict:
+        """Загрузка очереди по типам задач."""
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'types': {
+                    name: {'concurrency': state.concurrency, 'running': state.running, 'queued': len(state.pending)}
+                    for name, state in self._types.items()
+                }
+            }
+
+    def ping(self) -> bool:
+        """Доступно ли хранилище задач (для проверки готовности)."""
+        try:
+            with self._lock:
+                self._connection().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error as e:
+            logger.warning("Job store is unavailable: %s", e)
+            return False
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self.running = False
+            for context in self._active.values():
+                context._cancel.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _cleanup(self, job_type: str, payload: str) -> None:
+        # Вызывается под self._lock, до того как payload задачи будет стёрт
+        state = self._types.get(job_type)
+        if state is None or state.cleanup is None:
+            return
+        try:
+            state.cleanup(json.loads(payload))
+        except Exception:
+            logger.exception("Error cleaning up %s job payload", job_type)
+
+    def _result_path(self, job_id: str) -> Path:
+        return self.store_dir / f"{job_id}.result"
+
+    def _enqueue(self, job_type: str, job_id: str) -> None:
+        # Вызывается под self._lock
+        self._active[job_id] = JobContext(self, job_id)
+        self._types[job_type].pending.append(job_id)
+        self._dispatch(job_type)
+
+    def _dispatch(self, job_type: str) -> None:
+        # Вызывается под self._lock: запускает ждущие задачи, пока не исчерпан лимит типа
+        state = self._types[job_type]
+        while state.pending and state.running < state.concurrency:
+            job_id = state.pending.popleft()
+            state.running += 1
+            self._executor.submit(self._run, job_type, job_id)
+
+    def _run(self, job_type: str, job_id: str) -> None:
+        context = self._active[job_id]
+        status, result, error = CANCELLED, None, None
+        try:
+            with self._lock:
+                db = self._connection()
+                payload, stored_status = db.execute("SELECT payload, status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                # Задачу могли отменить из другого воркера, пока она ждала очереди
+                if stored_status != QUEUED:
+                    context._cancel.set()
+                if not context.cancelled:
+                    db.execute("UPDATE jobs SET status = ?, started_at = ? WHERE id = ?",
+                               (RUNNING, time.time(), job_id))
+                    db.commit()
+            if not context.cancelled:
+                logger.debug("Job %s (%s) started", job_id, job_type)
+                value = self._types[job_type].handler(context, json.loads(payload))
+                if not context.cancelled:
+                    status, result = SUCCEEDED, self._store_result(job_id, value)
+            else:
+                with self._lock:
+                    self._cleanup(job_type, payload)
+        except JobCancelled:
+            pass
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job_id, job_type)
+            status, error = FAILED, str(e)
+        finally:
+            with self._lock:
+                self._finish(job_id, status, result, error)
+                self._active.pop(job_id, None)
+                self._types[job_type].running -= 1
+                self._dispatch(job_type)
+        logger.debug("Job %s (%s) %s", job_id, job_type, status)
+
+    def _store_result(self, job_id: str, value: Any) -> str:
+        if isinstance(value, FileResult):
+            self._result_path(job_id).write_bytes(value.data)
+            value = {'file': {'mimetype': value.mimetype, 'filename': value.filename, 'size': len(value.data)}}
+        return json.dumps(value, ensure_ascii=False, default=str)
+
+    def _finish(self, job_id: str, status: str, result: Optional[str] = None, error: Optional[str] = None) -> None:
+        # Вызывается под self._lock
+        db = self._connection()
+        db.execute(
+            "UPDATE jobs SET status = ?, progress = COALESCE(?, progress), result = ?, error = ?, finished_at = ?, payload = '{}' "
+            "WHERE id = ?",
+            (status, 1.0 if status == SUCCEEDED else None, result, error, time.time(), job_id)
+        )
+        db.commit()
+
+    def _set_progress(self, job_id: str, fraction: Optional[float], message: Optional[str]) -> None:
+        with self._lock:
+            db = self._connection()
+            if fraction is not None:
+                db.execute("UPDATE jobs SET progress = ? WHERE id = ?", (min(max(fraction, 0.0), 1.0), job_id))
+            if message is not None:
+                db.execute("UPDATE jobs SET message = ? WHERE id = ?", (message, job_id))
+            db.commit()
+            # Отмена из другого воркера: флаг в базе подхватывается при отчёте о прогрессе
+            cancel_requested = db.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            context = self._active.get(job_id)
+            if cancel_requested and cancel_requested[0] and context is not None:
+                context._cancel.set()
+
+
+def concurrency_from_env(job_type: str, default: int) -> int:
+    """Лимит одновременно выполняемых задач типа: JOB_CONCURRENCY_<TYPE> или default."""
+    return _env_int(f"JOB_CONCURRENCY_{job_type.upper()}", default)
+
+
+def create_job_queue_from_env() -> JobQueue:
+    """Создаёт очередь задач по переменным окружения JOB_*."""
+    default_dir = os.path.join(tempfile.gettempdir(), 'multi-llm-analyzer', 'jobs')
+    return JobQueue(
+        max_workers=_env_int("JOB_WORKERS", 4),
+        store_dir=os.getenv("JOB_STORE_DIR") or default_dir,
+        result_ttl=float(os.getenv("JOB_RESULT_TTL", "3600")),
+    )
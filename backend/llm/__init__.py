@@ -1,3 +1,3 @@
-from .main_processor import get_analysis
+from .main_processor import get_analysis, get_completion, stream_analysis
 
-__all__ = ['get_analysis']
+__all__ = ['get_analysis', 'get_completion', 'stream_analysis']
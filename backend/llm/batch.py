@@ -0,0 +1,148 @@
+# Параллельный запуск анализа сразу на нескольких провайдерах/моделях
+import os
+import time
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+
+from .main_processor import get_analysis
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = ('yandex', 'giga', 'openai')
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+class BatchAnalyzer:
+    """
+    Пул потоков для вызовов LLM с ограничением параллельности на каждого провайдера.
+
+    Вызовы провайдеров блокирующие (HTTP), поэтому потоки, а не процессы: пока один
+    ждёт ответа, остальные работают. Общая длительность батча — время самого
+    медленного провайдера, а не сумма.
+
+    Цель отдаётся в пул, только когда у её провайдера есть свободный слот (лимиты общие
+    для всех батчей процесса): цели загруженного провайдера ждут в run(), а не занимают
+    потоки пула, и не задерживают цели других провайдеров. Цель, не дождавшаяся слота
+    до дедлайна батча, провайдера не вызывает.
+    """
+
+    def __init__(self, max_workers: int, provider_limits: Dict[str, int], timeout: float):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm-batch')
+        self._limits = {provider: max(limit, 1) for provider, limit in provider_limits.items()}
+        self._running: Dict[str, int] = {provider: 0 for provider in provider_limits}
+        # Освобождение слота или завершение вызова будит батчи, ждущие в run()
+        self._changed = threading.Condition()
+
+    def _acquire(self, provider: str) -> bool:
+        # Вызывается под self._changed
+        limit = self._limits.get(provider)
+        if limit is None:
+            return True
+        if self._running[provider] >= limit:
+            return False
+        self._running[provider] += 1
+        return True
+
+    def _release(self, provider: str, future: Future) -> None:
+        # Колбэк завершения (или отмены) вызова: результат уже доступен ждущему run()
+        with self._changed:
+            if provider in self._running:
+                self._running[provider] -= 1
+            self._changed.notify_all()
+
+    def _call(self, provider: str, model: str, table_data: str, use_cache: bool) -> dict:
+        started = time.perf_counter()
+        analysis = get_analysis(provider, model, table_data, use_cache)
+        return {
+            'model': f"{provider}:{model}",
+            'analysis': analysis,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000),
+            'timestamp': pd.Timestamp.now().isoformat()
+        }
+
+    def _submit_ready(self, waiting: List[dict], futures: Dict[Future, dict], table_data: str,
+                      use_cache: bool) -> List[dict]:
+        # Вызывается под self._changed: отдаёт в пул цели провайдеров со свободным слотом
+        still_waiting = []
+        for target in waiting:
+            provider = target['provider']
+            if not self._acquire(provider):
+                still_waiting.append(target)
+                continue
+            future = self._executor.submit(self._call, provider, target['model'], table_data, use_cache)
+            futures[future] = target
+            future.add_done_callback(partial(self._release, provider))
+        return still_waiting
+
+    def run(self, table_data: str, targets: List[dict], timeout: Optional[float] = None,
+            use_cache: bool = True) -> Iterator[dict]:
+        """Запускает анализ по всем целям и отдаёт результаты по мере готовности."""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        futures: Dict[Future, dict] = {}
+        waiting = list(targets)
+        reported = set()
+        while waiting or len(reported) < len(futures):
+            with self._changed:
+                waiting = self._submit_ready(waiting, futures, table_data, use_cache)
+                done = [future for future in futures if future.done() and future not in reported]
+                if not done:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._changed.wait(remaining)
+                    continue
+            for future in done:
+                reported.add(future)
+                target = futures[future]
+                try:
+                    yield future.result()
+                except Exception as e:
+                    logger.exception("Batch analysis failed for %s:%s", target['provider'], target['model'])
+                    yield {'model': f"{target['provider']}:{target['model']}", 'error': str(e)}
+
+        for future, target in futures.items():
+            if future in reported:
+                continue
+            # Уже начатый HTTP-вызов прервать нельзя: поток доработает в фоне, результат отбрасывается
+            future.cancel()
+            waiting.append(target)
+        for target in waiting:
+            logger.warning("Batch analysis timed out for %s:%s", target['provider'], target['model'])
+            yield {'model': f"{target['provider']}:{target['model']}",
+                   'error': f'Превышено время ожидания ответа ({timeout:g} с)'}
+
+
+def validate_targets(targets) -> Optional[str]:
+    """Проверяет список целей батча; возвращает текст ошибки или None."""
+    if not isinstance(targets, list) or not targets:
+        return 'targets must be a non-empty list'
+    for target in targets:
+        if not isinstance(target, dict) or 'provider' not in target or 'model' not in target:
+            return 'each target must have provider and model'
+        if target['provider'] not in PROVIDERS:
+            return f"Unknown provider: {target['provider']}"
+    return None
+
+
+def create_batch_analyzer_from_env() -> BatchAnalyzer:
+    """Создаёт пул по переменным окружения LLM_BATCH_*."""
+    default_limit = _env_int("LLM_PROVIDER_CONCURRENCY", 2)
+    limits = {provider: _env_int(f"LLM_CONCURRENCY_{provider.upper()}", default_limit) for provider in PROVIDERS}
+    return BatchAnalyzer(
+        max_workers=_env_int("LLM_BATCH_WORKERS", 8),
+        provider_limits=limits,
+        timeout=float(os.getenv("LLM_BATCH_TIMEOUT", "120")),
+    )
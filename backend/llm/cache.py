@@ -0,0 +1,180 @@
+# Кэш ответов LLM: повторный анализ той же таблицы той же моделью не тратит токены
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Хелперы провайдеров сообщают об ошибках текстом ответа — такие ответы не кэшируем
+ERROR_PREFIXES = ('Ошибка', 'Не удалось', 'Получен пустой ответ')
+FAILURE_PREFIXES = ERROR_PREFIXES + ('Тестовый режим',)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    response TEXT NOT NULL,
+    created_at REAL NOT NULL
+)
+"""
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Схлопывает пробелы и переводы строк: форматирование промпта не должно менять ключ."""
+    return ' '.join(prompt.split())
+
+
+def make_cache_key(provider: str, model: str, prompt: str, table_data: str) -> str:
+    """Ключ ответа: провайдер, модель, нормализованный промпт и хэш данных таблицы."""
+    table_hash = hashlib.sha256(table_data.encode('utf-8')).hexdigest()
+    payload = json.dumps([provider, model, normalize_prompt(prompt), table_hash], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def is_cacheable(response: str) -> bool:
+    """Кэшируем только содержательные ответы, а не сообщения об ошибках."""
+    return bool(response and response.strip()) and not response.startswith(FAILURE_PREFIXES)
+
+
+def is_error(response: str) -> bool:
+    """Ответ — сообщение хелпера об ошибке провайдера, а не текст модели."""
+    return not (response and response.strip()) or response.startswith(ERROR_PREFIXES)
+
+
+class ResponseCache:
+    """
+    Двухуровневый кэш ответов: LRU в памяти перед SQLite на диске.
+
+    Дисковый уровень переживает перезапуск сервера; при попадании в него
+    ответ поднимается в память. Устаревшие по TTL записи не отдаются.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self._memory: 'OrderedDict[str, Tuple[str, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        if not self.db_path:
+            return None
+        if self._db is None:
+            try:
+                Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+                self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+                self._db.execute(_SCHEMA)
+                self._db.commit()
+            except sqlite3.Error as e:
+                # Без диска кэш продолжает работать только в памяти
+                logger.warning("Не удалось открыть кэш ответов LLM %s: %s", self.db_path, e)
+                self.db_path = None
+                return None
+        return self._db
+
+    def get(self, key: str) -> Optional[str]:
+        """Возвращает сохранённый ответ или None, если его нет или он устарел."""
+        deadline = time.time() - self.ttl_seconds
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                response, created_at = cached
+                if created_at >= deadline:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return response
+                del self._memory[key]
+
+            row = None
+            db = self._connection()
+            if db is not None:
+                try:
+                    row = db.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                    if row is not None and row[1] < deadline:
+                        db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                        db.commit()
+                        row = None
+                except sqlite3.Error as e:
+                    logger.warning("Error reading LLM response cache: %s", e)
+                    row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, row[0], row[1])
+            return row[0]
+
+    def put(self, key: str, provider: str, model: str, response: str) -> None:
+        """Сохраняет ответ в обоих уровнях кэша."""
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, response, created_at)
+            self.stores += 1
+            db = self._connection()
+            if db is None:
+                return
+            try:
+                db.execute(
+                    "INSERT OR REPLACE INTO responses (key, provider, model, response, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, provider, model, response, created_at)
+                )
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning("Error writing LLM response cache: %s", e)
+
+    def purge_expired(self) -> int:
+        """Удаляет устаревшие записи с диска; возвращает их количество."""
+        with self._lock:
+            db = self._connection()
+            if db is None:
+                return 0
+            cursor = db.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            db.commit()
+            return cursor.rowcount
+
+    def stats(self) -> dict:
+        """Счётчики попаданий и промахов для мониторинга."""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_entries': len(self._memory),
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'hit_ratio': round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                'disk_enabled': bool(self.db_path),
+            }
+
+    def _remember(self, key: str, response: str, created_at: float) -> None:
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+
+def create_response_cache_from_env() -> ResponseCache:
+    """Создаёт кэш ответов по переменным окружения LLM_CACHE_*."""
+    default_path = os.path.join(tempfile.gettempdir(), 'multi-llm-analyzer', 'llm_cache.sqlite3')
+    db_path = os.getenv("LLM_CACHE_PATH") or default_path
+    if db_path.lower() in ('off', 'none'):
+        db_path = None
+    return ResponseCache(
+        max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "256")),
+        ttl_seconds=float(os.getenv("LLM_CACHE_TTL", "86400")),
+        db_path=db_path,
+    )
@@ -0,0 +1,134 @@
+# Долгоживущие клиенты провайдеров: keep-alive соединения и токены переиспользуются между запросами
+import os
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+YANDEX_COMPLETION_URL = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
+
+_lock = threading.Lock()
+# requests и SDK провайдеров импортируются при создании первого клиента: старт сервера не ждёт их загрузки
+_sessions: Dict[str, object] = {}
+_openai_clients: Dict[Tuple[str, Optional[str]], object] = {}
+_giga_clients: Dict[Tuple[str, str, str], object] = {}
+# Попытка, начатая сразу после начала вызова, идёт через общий клиент с полным таймаутом
+_TIMEOUT_SLACK = 0.1
+
+
+def _pool_size() -> int:
+    return int(os.getenv("LLM_HTTP_POOL_SIZE", "10"))
+
+
+def yandex_completion_url() -> str:
+    """Адрес API YandexGPT; переопределяется YANDEX_API_URL (например, локальной заглушкой)."""
+    return os.getenv("YANDEX_API_URL", YANDEX_COMPLETION_URL)
+
+
+def get_http_session(provider: str):
+    """HTTP-сессия провайдера (requests.Session) с пулом keep-alive соединений: TLS-рукопожатие делается один раз."""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    with _lock:
+        session = _sessions.get(provider)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=_pool_size())
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[provider] = session
+        return session
+
+
+def get_openai_client(api_key: str):
+    """Клиент OpenAI на ключ API (модель передаётся в запросе, поэтому клиент общий для всех моделей)."""
+    from openai import OpenAI
+
+    base_url = os.getenv("OPENAI_BASE_URL") or None
+    key = (api_key, base_url)
+    with _lock:
+        client = _openai_clients.get(key)
+        if client is None:
+            # Повторы делает call_with_retries: встроенные повторы SDK умножили бы число попыток
+            client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+            _openai_clients[key] = client
+        return client
+
+
+def _create_giga_client(model: str, credentials: str, cert_path: str, timeout: float,
+                        access_token: Optional[str] = None):
+    from gigachat import GigaChat
+
+    options = {}
+    if os.getenv("GIGACHAT_BASE_URL"):
+        options['base_url'] = os.getenv("GIGACHAT_BASE_URL")
+    if os.getenv("GIGACHAT_AUTH_URL"):
+        options['auth_url'] = os.getenv("GIGACHAT_AUTH_URL")
+    if access_token:
+        options['access_token'] = access_token
+    return GigaChat(
+        credentials=credentials,
+        ca_bundle_file=cert_path,
+        verify_ssl_certs=True,
+        model=model,
+        timeout=timeout,
+        max_retries=0,
+        **options
+    )
+
+
+def get_giga_client(model: str, credentials: str, cert_path: str):
+    """
+    Клиент GigaChat на модель. Клиент сам кэширует OAuth-токен и обновляет его
+    заранее, до истечения, поэтому при переиспользовании токен запрашивается редко.
+    """
+    from .resilience import RetryPolicy
+
+    key = (model, credentials, cert_path)
+    with _lock:
+        client = _giga_clients.get(key)
+        if client is None:
+            client = _create_giga_client(model, credentials, cert_path, RetryPolicy.from_env().timeout)
+            _giga_clients[key] = client
+        return client
+
+
+@contextmanager
+def giga_client_for_attempt(model: str, credentials: str, cert_path: str, timeout: float):
+    """
+    Клиент GigaChat для попытки, которой до дедлайна осталось timeout секунд. SDK не
+    принимает таймаут на запрос, а общий клиент создан с полным LLM_TIMEOUT: попытка
+    с меньшим остатком (повтор) идёт через временный клиент с этим таймаутом и
+    OAuth-токеном общего клиента.
+    """
+    from .resilience import RetryPolicy
+
+    shared = get_giga_client(model, credentials, cert_path)
+    if timeout >= RetryPolicy.from_env().timeout - _TIMEOUT_SLACK:
+        yield shared
+        return
+    client = _create_giga_client(model, credentials, cert_path, timeout, shared.token)
+    try:
+        yield client
+    finally:
+        client.close()
+
+
+def reset_clients() -> None:
+    """Закрывает все клиенты (например, после смены ключей); новые создадутся при следующем вызове."""
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        for client in list(_openai_clients.values()) + list(_giga_clients.values()):
+            close = getattr(client, 'close', None)
+            if close is not None:
+                try:
+                    close()
+                except Exception as e:
+                    logger.warning("Error closing LLM client: %s", e)
+        _sessions.clear()
+        _openai_clients.clear()
+        _giga_clients.clear()
@@ -1,22 +1,34 @@
 import os
+import time
 import logging
-from gigachat import GigaChat
-from gigachat.models import Chat, Messages, MessagesRole
+from typing import Iterator
+
+from telemetry import record_llm_call
+
+from .clients import get_giga_client, giga_client_for_attempt
+from .resilience import ProviderError, call_with_retries
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
-# Проверяем наличие необходимых переменных окружения только если не в тестовом режиме
-if os.getenv("TEST_MODE", "false").lower() != "true":
-    credentials = os.getenv("GIGACHAT_CREDENTIALS")
-    cert_path = os.getenv("GIGACHAT_CERT_PATH", "russian_trusted_root_ca.cer")
+# Учётные данные проверяются при вызове: модуль импортируется и без них (сервер
+# стартует, пока GigaChat не нужен), а SDK gigachat грузится при первом запросе
 
-    if not credentials:
-        logger.error("Не найдены учетные данные GigaChat в переменных окружения")
-        raise ValueError("GIGACHAT_CREDENTIALS не найден в переменных окружения")
 
-    if not os.path.exists(cert_path):
-        logger.warning(f"Файл сертификата {cert_path} не найден")
+def _chat(user_prompt: str) -> 'Chat':
+    """Создаёт структуру сообщения для API."""
+    from gigachat.models import Chat, Messages, MessagesRole
+
+    return Chat(messages=[
+        Messages(
+            role=MessagesRole.SYSTEM,
+            content="Ты — полезный ассистент-аналитик данных."
+        ),
+        Messages(
+            role=MessagesRole.USER,
+            content=user_prompt
+        )
+    ])
 
 def get_giga_response(user_prompt: str, model: str = "GigaChat:latest") -> str:
     """
@@ -27,6 +39,7 @@ def get_giga_response(user_prompt: str, model: str = "GigaChat:latest") -> str:
     if os.getenv("TEST_MODE", "false").lower() == "true":
         return "Тестовый режим: Здесь будет ответ от GigaChat. Для реальной работы укажите GIGACHAT_CREDENTIALS в .env"
 
+    started = time.perf_counter()
     try:
         credentials = os.getenv("GIGACHAT_CREDENTIALS")
         cert_path = os.getenv("GIGACHAT_CERT_PATH", "russian_trusted_root_ca.cer")
@@ -40,30 +53,51 @@ def get_giga_response(user_prompt: str, model: str = "GigaChat:latest") -> str:
             logger.warning(f"Сертификат {cert_path} не найден")
             return "Не удалось получить ответ от GigaChat: отсутствует сертификат"
         
-        # Создаем клиент GigaChat
-        giga = GigaChat(
-            credentials=credentials,
-            ca_bundle_file=cert_path,
-            verify_ssl_certs=True
-        )
-        
-        # Создаем структуру сообщения для API
-        messages = [
-            Messages(
-                role=MessagesRole.SYSTEM,
-                content="Ты — полезный ассистент-аналитик данных."
-            ),
-            Messages(
-                role=MessagesRole.USER,
-                content=user_prompt
-            )
-        ]
-        
-        # Отправляем запрос
-        response = giga.chat(Chat(messages=messages))
+        def attempt(timeout: float):
+            # Общий клиент GigaChat: соединение и OAuth-токен переиспользуются между запросами;
+            # повтору с меньшим остатком дедлайна — клиент с этим таймаутом
+            with giga_client_for_attempt(model, credentials, cert_path, timeout) as giga:
+                return giga.chat(_chat(user_prompt))
+
+        # Отправляем запрос; повторы и дедлайн — в call_with_retries
+        response, attempts = call_with_retries('giga', attempt)
+        usage = getattr(response, 'usage', None)
+        record_llm_call('giga', started, 'ok', attempts,
+                        getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None))
         
         return response.choices[0].message.content
 
+    except ProviderError as e:
+        record_llm_call('giga', started, 'error', e.attempts)
+        logger.error(f"Ошибка при работе с GigaChat: {str(e)}")
+        return f"Не удалось получить ответ от GigaChat: {str(e).rstrip('.')}. Попробуйте позже."
     except Exception as e:
+        record_llm_call('giga', started, 'error')
         logger.error(f"Ошибка при работе с GigaChat: {str(e)}")
-        return "Не удалось получить ответ от GigaChat. Попробуйте позже."
\ No newline at end of file
+        return "Не удалось получить ответ от GigaChat. Попробуйте позже."
+
+
+def stream_giga_response(user_prompt: str, model: str = "GigaChat:latest") -> Iterator[str]:
+    """
+    Потоково получает ответ GigaChat и отдаёт его фрагментами текста.
+    При ошибке бросает исключение; закрытие генератора закрывает HTTP-поток.
+    """
+    if os.getenv("TEST_MODE", "false").lower() == "true":
+        yield "Тестовый режим: Здесь будет ответ от GigaChat. Для реальной работы укажите GIGACHAT_CREDENTIALS в .env"
+        return
+
+    credentials = os.getenv("GIGACHAT_CREDENTIALS")
+    cert_path = os.getenv("GIGACHAT_CERT_PATH", "russian_trusted_root_ca.cer")
+    if not credentials:
+        raise RuntimeError("Не удалось получить ответ от GigaChat: отсутствуют учетные данные")
+    if not os.path.exists(cert_path):
+        raise RuntimeError("Не удалось получить ответ от GigaChat: отсутствует сертификат")
+
+    giga = get_giga_client(model, credentials, cert_path)
+    chunks = giga.stream(_chat(user_prompt))
+    try:
+        for chunk in chunks:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        chunks.close()
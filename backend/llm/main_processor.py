@@ -1,39 +1,163 @@
 # Этот файл будет центральной точкой для вызова любой LLM
 import os
+import time
+import logging
+from typing import Iterator, Tuple
+from telemetry import record_llm_call
+
 from . import yandex_gpt_helper, gigachat_helper, openai_helper
+from .cache import create_response_cache_from_env, is_cacheable, make_cache_key
+from .resilience import CircuitOpenError, create_hedged_caller_from_env, get_breaker
+
+logger = logging.getLogger(__name__)
+
+# Кэш ответов общий для всех запросов процесса
+response_cache = create_response_cache_from_env()
+# Failover на резервную модель и hedging медленных вызовов
+hedged_caller = create_hedged_caller_from_env()
+
+# Системный промпт для реального режима
+SYSTEM_PROMPT = "Ты — опытный аналитик данных. Твоя задача — кратко проанализировать предоставленные табличные данные, найти в них основные тенденции, аномалии и сделать выводы. Будь краток и точен."
+
+STREAMERS = {
+    "yandex": yandex_gpt_helper.stream_yandex_response,
+    "giga": gigachat_helper.stream_giga_response,
+    "openai": openai_helper.stream_openai_response,
+}
+
+# Переменные окружения, без которых провайдер не работает
+PROVIDER_SETTINGS = {
+    "yandex": ("YANDEX_FOLDER_ID", "YANDEX_API_KEY"),
+    "giga": ("GIGACHAT_CREDENTIALS",),
+    "openai": ("OPENAI_API_KEY",),
+}
+
+def configured_providers() -> dict:
+    """Какие провайдеры настроены; в тестовом режиме — все (ответы-заглушки)."""
+    test_mode = os.getenv("TEST_MODE", "false").lower() == "true"
+    return {provider: test_mode or all(os.getenv(name) for name in names)
+            for provider, names in PROVIDER_SETTINGS.items()}
+
+def _test_mode_report(provider: str, model: str, table_data: str) -> str:
+    return f"""Тестовый режим активен. Анализ данных:
+        
+Провайдер: {provider}
+Модель: {model}
+Размер данных: {len(table_data)} символов
+
+В тестовом режиме возвращается шаблонный ответ без реального анализа.
+Для полноценной работы необходимо:
+1. Установить TEST_MODE=false в .env
+2. Добавить соответствующие API ключи для выбранной модели"""
 
-def get_analysis(provider: str, model: str, table_data: str) -> str:
+def _user_prompt(table_data: str) -> str:
+    return f"{SYSTEM_PROMPT}\n\nВот описание таблицы: статистика по всем строкам и выборка строк:\n\n{table_data}"
+
+def get_analysis(provider: str, model: str, table_data: str, use_cache: bool = True) -> str:
     """
     Выбирает нужную модель и получает от нее аналитический отчет.
 
     :param provider: Провайдер ("yandex", "giga", "openai")
     :param model: Конкретная модель (например, "gpt-4o", "yandexgpt-lite")
     :param table_data: Строковое представление данных для анализа
+    :param use_cache: Брать ответ из кэша, если он есть (свежий ответ сохраняется в кэш в любом случае)
     :return: Текстовый отчет от LLM
     """
     # Проверяем тестовый режим
     if os.getenv("TEST_MODE", "false").lower() == "true":
-        return f"""Тестовый режим активен. Анализ данных:
-        
-Провайдер: {provider}
-Модель: {model}
-Размер данных: {len(table_data)} символов
+        return _test_mode_report(provider, model, table_data)
+    return _cached_response(provider, model, SYSTEM_PROMPT, table_data, _user_prompt(table_data), use_cache)[0]
 
-В тестовом режиме возвращается шаблонный ответ без реального анализа.
-Для полноценной работы необходимо:
-1. Установить TEST_MODE=false в .env
-2. Добавить соответствующие API ключи для выбранной модели"""
 
-    # Системный промпт для реального режима
-    system_prompt = "Ты — опытный аналитик данных. Твоя задача — кратко проанализировать предоставленные табличные данные, найти в них основные тенденции, аномалии и сделать выводы. Будь краток и точен."
-    
-    user_prompt = f"{system_prompt}\n\nВот первые строки таблицы для анализа:\n\n{table_data}"
+def get_completion(provider: str, model: str, instructions: str, content: str,
+                   use_cache: bool = True) -> Tuple[str, bool]:
+    """
+    Ответ модели на инструкцию instructions к тексту content — шаги анализа,
+    которые не укладываются в get_analysis (фрагменты таблицы, слияние выводов).
+    Кэшируется так же, как get_analysis; второе значение — ответ взят из кэша.
+    """
+    if os.getenv("TEST_MODE", "false").lower() == "true":
+        return f"Тестовый режим: выводы по тексту из {len(content)} символов от {provider}:{model}", False
+    return _cached_response(provider, model, instructions, content, f"{instructions}\n\n{content}", use_cache)
+
+
+def _cached_response(provider: str, model: str, instructions: str, content: str, user_prompt: str,
+                     use_cache: bool) -> Tuple[str, bool]:
+    cache_key = make_cache_key(provider, model, instructions, content)
+    if use_cache:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            logger.debug("LLM response cache hit for %s:%s", provider, model)
+            return cached, True
+
+    if provider not in PROVIDER_SETTINGS:
+        return f'Ошибка: неизвестный провайдер "{provider}". Доступные провайдеры: yandex, giga, openai.', False
+
+    # Failover/hedging: ответить может резервная модель — ответ кэшируется под её ключом
+    response, provider, model = hedged_caller.call(provider, model, lambda p, m: _call_provider(p, m, user_prompt))
+    if is_cacheable(response):
+        response_cache.put(make_cache_key(provider, model, instructions, content), provider, model, response)
+    return response, False
 
+
+def _call_provider(provider: str, model: str, user_prompt: str) -> str:
     if provider == "yandex":
         return yandex_gpt_helper.get_yandex_response(user_prompt, model)
-    elif provider == "giga":
+    if provider == "giga":
         return gigachat_helper.get_giga_response(user_prompt, model)
-    elif provider == "openai":
+    if provider == "openai":
         return openai_helper.get_openai_response(user_prompt, model)
-    else:
-        return f'Ошибка: неизвестный провайдер "{provider}". Доступные провайдеры: yandex, giga, openai.'
+    return f'Ошибка: неизвестный провайдер "{provider}". Доступные провайдеры: yandex, giga, openai.'
+
+
+def stream_analysis(provider: str, model: str, table_data: str, use_cache: bool = True) -> Iterator[str]:
+    """
+    Потоковый вариант get_analysis: отдаёт отчёт фрагментами текста по мере генерации.
+
+    Ответ из кэша отдаётся одним фрагментом. Полностью полученный ответ сохраняется
+    в кэш; если генератор закрыт раньше (клиент ушёл), неполный текст не кэшируется.
+    Ошибки провайдера пробрасываются исключением.
+    """
+    if provider not in STREAMERS:
+        raise ValueError(f'Неизвестный провайдер "{provider}". Доступные провайдеры: yandex, giga, openai.')
+
+    if os.getenv("TEST_MODE", "false").lower() == "true":
+        yield _test_mode_report(provider, model, table_data)
+        return
+
+    cache_key = make_cache_key(provider, model, SYSTEM_PROMPT, table_data)
+    if use_cache:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            logger.debug("LLM response cache hit for %s:%s", provider, model)
+            yield cached
+            return
+
+    # Поток не повторяется и не хеджируется (часть ответа уже отдана), но учитывается в breaker
+    breaker = get_breaker(provider)
+    if not breaker.allow():
+        raise CircuitOpenError(provider)
+    parts = []
+    started = time.perf_counter()
+    outcome = 'cancelled'
+    try:
+        chunks = STREAMERS[provider](_user_prompt(table_data), model)
+    except Exception:
+        breaker.record(time.perf_counter() - started, ok=False)
+        raise
+    try:
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        outcome = 'ok'
+    except Exception:
+        outcome = 'error'
+        raise
+    finally:
+        chunks.close()
+        breaker.record(time.perf_counter() - started, ok=outcome != 'error')
+        record_llm_call(provider, started, outcome)
+
+    response = ''.join(parts)
+    if is_cacheable(response):
+        response_cache.put(cache_key, provider, model, response)
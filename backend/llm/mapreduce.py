@@ -0,0 +1,198 @@
+# Иерархический (map-reduce) анализ таблиц, которые не помещаются в один промпт
+import os
+import math
+import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from .cache import is_error
+from .main_processor import get_analysis, get_completion
+from .table_prompt import build_table_prompt, estimate_tokens, rows_per_prompt, table_overview, token_budget
+
+logger = logging.getLogger(__name__)
+
+MAP_PROMPT = (
+    "Ты — опытный аналитик данных. Ниже фрагмент большой таблицы: строки в CSV, # — номер строки "
+    "во всей таблице. Кратко перечисли наблюдения по фрагменту: типичные значения и диапазоны, "
+    "заметные группы, аномалии и выбросы с номерами строк. Не больше 10 пунктов, без вступления."
+)
+MERGE_PROMPT = (
+    "Ниже выводы по нескольким фрагментам одной таблицы. Объедини их в один сжатый список "
+    "наблюдений: убери повторы, сохрани числа и номера строк аномалий. Не больше 15 пунктов, без вступления."
+)
+REDUCE_PROMPT = (
+    "Ты — опытный аналитик данных. Ниже общая статистика таблицы и выводы по её фрагментам. "
+    "Составь итоговый отчёт по всей таблице: основные тенденции, аномалии и выводы. Будь краток и точен."
+)
+
+# Колбэк прогресса: доля (0..1) и сообщение; исключение из него (отмена задачи) прерывает анализ
+Progress = Callable[[Optional[float], Optional[str]], None]
+
+
+@dataclass
+class _Part:
+    """Выводы по строкам first..last (с 1) исходной таблицы."""
+    first: int
+    last: int
+    text: str
+
+    @property
+    def label(self) -> str:
+        return f"строки {self.first}–{self.last}"
+
+
+def _stable_size(rows: int) -> int:
+    """
+    Округляет размер фрагмента вниз до сетки с шагом в четверть степени двойки.
+    Оценка токенов на строку немного меняется после правки таблицы; без округления
+    сдвинулись бы границы всех фрагментов и их ответы не взялись бы из кэша.
+    """
+    if rows < 4:
+        return max(rows, 1)
+    step = 2 ** (int(math.log2(rows)) - 2)
+    return rows // step * step
+
+
+def _clip(text: str, tokens: int) -> str:
+    """Обрезает текст примерно до tokens токенов."""
+    estimated = estimate_tokens(text)
+    if estimated <= tokens:
+        return text
+    return text[:int(len(text) * tokens / estimated)] + '…'
+
+
+class MapReduceAnalyzer:
+    """
+    Анализ таблицы, которая не помещается в один промпт модели.
+
+    Map: строки делятся на фрагменты по бюджету токенов модели, каждый фрагмент
+    целиком анализируется отдельным запросом; запросы идут параллельно в
+    ограниченном пуле потоков. Reduce: выводы по фрагментам сливаются группами,
+    пока не поместятся в один промпт, и последний запрос пишет итоговый отчёт.
+    Все запросы кэшируются по содержимому, поэтому после правки нескольких строк
+    заново анализируются только изменившиеся фрагменты.
+    """
+
+    def __init__(self, max_workers: int, max_chunks: int):
+        self.max_chunks = max_chunks
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm-mapreduce')
+
+    def run(self, df: pd.DataFrame, analysis: dict, provider: str, model: str, use_cache: bool = True,
+            progress: Optional[Progress] = None) -> dict:
+        """
+        Анализирует всю таблицу df; analysis — базовый анализ всей таблицы (идёт в итоговый промпт).
+        Возвращает {analysis, chunks, rows_per_chunk, cached_chunks, failed_chunks, merge_rounds}.
+        """
+        progress = progress or (lambda fraction=None, message=None: None)
+        budget = token_budget(model)
+        size = _stable_size(rows_per_prompt(df, budget))
+        if len(df) <= size:
+            # Таблица помещается целиком — обычный анализ одним запросом
+            progress(0.2, f'Запрос к {provider}:{model}')
+            report = get_analysis(provider, model, build_table_prompt(df, analysis, budget), use_cache)
+            return {'analysis': report, 'chunks': 1, 'rows_per_chunk': len(df), 'cached_chunks': 0,
+                    'failed_chunks': 0, 'merge_rounds': 0}
+
+        # Фрагментов больше лимита: фрагменты крупнее бюджета, строки в них выбираются как в обычном промпте
+        size = max(size, math.ceil(len(df) / self.max_chunks))
+        starts = list(range(0, len(df), size))
+        logger.debug("Map-reduce analysis: %s rows in %s chunks of %s for %s:%s", len(df), len(starts), size,
+                     provider, model)
+        # Во фрагмент не попадает статистика всей таблицы: иначе правка любой строки меняла бы все промпты
+        calls = [(MAP_PROMPT, build_table_prompt(df.iloc[start:start + size], {}, budget, row_offset=start))
+                 for start in starts]
+        progress(0.05, f'Анализ фрагментов: 0/{len(calls)}')
+        results = self._run_all(calls, provider, model, use_cache, progress, 0.05, 0.8, 'Анализ фрагментов')
+
+        parts, failed = [], []
+        for start, (text, _) in zip(starts, results):
+            part = _Part(start + 1, min(start + size, len(df)), text)
+            (failed if is_error(text) else parts).append(part)
+        cached = sum(1 for _, hit in results if hit)
+        summary = {'chunks': len(starts), 'rows_per_chunk': size, 'cached_chunks': cached,
+                   'failed_chunks': len(failed), 'merge_rounds': 0}
+        if not parts:
+            return {'analysis': failed[0].text, **summary}
+
+        overview = table_overview(len(df), len(df.columns), analysis, budget // 2)
+        note = ''
+        if failed:
+            note = '\n\nНет выводов (ошибка провайдера) по фрагментам: ' + ', '.join(part.label for part in failed)
+        # Каждый вывод не больше половины бюджета: любые два помещаются в один запрос слияния
+        parts = [_Part(part.first, part.last, _clip(part.text, budget // 2)) for part in parts]
+        while True:
+            texts = [f"Фрагмент, {part.label}:\n{part.text}" for part in parts]
+            content = overview + '\n\n' + '\n\n'.join(texts) + note
+            if len(parts) == 1 or estimate_tokens(content) <= budget:
+                break
+            summary['merge_rounds'] += 1
+            parts = self._merge(parts, texts, budget, provider, model, use_cache, progress, summary['merge_rounds'])
+
+        progress(0.9, 'Итоговый отчёт')
+        report, _ = get_completion(provider, model, REDUCE_PROMPT, content, use_cache)
+        return {'analysis': report, **summary}
+
+    def _merge(self, parts: List[_Part], texts: List[str], budget: int, provider: str, model: str,
+               use_cache: bool, progress: Progress, round_number: int) -> List[_Part]:
+        """Один раунд слияния: соседние выводы упаковываются в группы по бюджету; одиночные переходят дальше как есть."""
+        groups: List[List[int]] = [[]]
+        used = 0
+        for i, text in enumerate(texts):
+            cost = estimate_tokens(text)
+            # В группе не меньше двух выводов: каждый раунд уменьшает их число
+            if len(groups[-1]) > 1 and used + cost > budget:
+                groups.append([])
+                used = 0
+            groups[-1].append(i)
+            used += cost
+
+        calls = [(MERGE_PROMPT, '\n\n'.join(texts[i] for i in group)) for group in groups if len(group) > 1]
+        label = f'Слияние выводов, раунд {round_number}'
+        results = iter(self._run_all(calls, provider, model, use_cache, progress, 0.8, 0.9, label))
+        merged = []
+        for group in groups:
+            if len(group) == 1:
+                merged.append(parts[group[0]])
+                continue
+            text, _ = next(results)
+            if is_error(text):
+                raise RuntimeError(text)
+            merged.append(_Part(parts[group[0]].first, parts[group[-1]].last, _clip(text, budget // 2)))
+        return merged
+
+    def _run_all(self, calls: List[Tuple[str, str]], provider: str, model: str, use_cache: bool,
+                 progress: Progress, start: float, end: float, label: str) -> List[Tuple[str, bool]]:
+        """Выполняет запросы в пуле; результаты — в порядке calls, прогресс — по мере готовности."""
+        futures: Dict[Future, int] = {
+            self._executor.submit(get_completion, provider, model, instructions, content, use_cache): i
+            for i, (instructions, content) in enumerate(calls)
+        }
+        results: List[Tuple[str, bool]] = [('', False)] * len(calls)
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        results[futures[future]] = future.result()
+                    except Exception as e:
+                        logger.exception("Map-reduce call failed for %s:%s", provider, model)
+                        results[futures[future]] = (f'Ошибка: {e}', False)
+                finished = len(calls) - len(pending)
+                progress(start + (end - start) * finished / len(calls), f'{label}: {finished}/{len(calls)}')
+        finally:
+            # Отмена задачи: ещё не начатые запросы не отправляются
+            for future in pending:
+                future.cancel()
+        return results
+
+
+def create_map_reduce_analyzer_from_env() -> MapReduceAnalyzer:
+    """Создаёт анализатор по переменным окружения LLM_MAPREDUCE_*."""
+    return MapReduceAnalyzer(
+        max_workers=int(os.getenv("LLM_MAPREDUCE_WORKERS", "4")),
+        max_chunks=int(os.getenv("LLM_MAPREDUCE_MAX_CHUNKS", "64")),
+    )
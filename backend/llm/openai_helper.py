@@ -1,14 +1,30 @@
 import os
+import time
 import logging
-from openai import OpenAI
+from dataclasses import replace
+from typing import Iterator, Optional
+
+from telemetry import record_llm_call
+
+from .clients import get_openai_client
+from .resilience import ProviderError, RetryPolicy, call_with_retries
 
 logger = logging.getLogger(__name__)
 
 # Этот модуль инкапсулирует работу с OpenAI API.
 
-def get_openai_response(user_prompt: str, model: str = "gpt-4", retries=3) -> str:
+SYSTEM_PROMPT = "Ты — полезный ассистент-аналитик данных."
+
+def _messages(user_prompt: str) -> list:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def get_openai_response(user_prompt: str, model: str = "gpt-4", retries: Optional[int] = None) -> str:
     """
     Отправляет запрос к OpenAI и возвращает ответ.
+    Повторы, дедлайн и circuit breaker — в call_with_retries; retries переопределяет LLM_RETRIES.
     """
     # В тестовом режиме возвращаем заглушку
     if os.getenv("TEST_MODE", "false").lower() == "true":
@@ -19,29 +35,59 @@ def get_openai_response(user_prompt: str, model: str = "gpt-4", retries=3) -> st
         logger.error("Не найден API ключ OpenAI в переменных окружения")
         return "Ошибка конфигурации OpenAI. Обратитесь к администратору."
     
-    client = OpenAI(api_key=api_key)
-    
-    system_prompt = "Ты — полезный ассистент-аналитик данных."
-    
-    for attempt in range(retries):
-        try:
-            logger.debug(f"Попытка {attempt + 1} отправки запроса к OpenAI")
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ]
-            )
-            logger.debug("Успешно получен ответ от OpenAI")
-            content = response.choices[0].message.content
-            if content is None:
-                return "Получен пустой ответ от OpenAI. Попробуйте снова."
-            return content
-            
-        except Exception as e:
-            logger.error(f"Ошибка при работе с OpenAI (попытка {attempt + 1}): {str(e)}")
-            if attempt + 1 == retries:
-                return "Не удалось получить ответ от OpenAI. Попробуйте снова."
-    
-    return "Не удалось получить ответ от OpenAI после всех попыток."
\ No newline at end of file
+    client = get_openai_client(api_key)
+    policy = RetryPolicy.from_env()
+    if retries is not None:
+        policy = replace(policy, attempts=retries)
+    started = time.perf_counter()
+
+    def attempt(timeout: float):
+        logger.debug("Отправка запроса к OpenAI")
+        return client.chat.completions.create(
+            model=model,
+            messages=_messages(user_prompt),
+            timeout=timeout
+        )
+
+    try:
+        response, attempts = call_with_retries('openai', attempt, policy)
+    except ProviderError as e:
+        logger.error(f"Ошибка при работе с OpenAI: {str(e)}")
+        record_llm_call('openai', started, 'error', e.attempts)
+        return f"Не удалось получить ответ от OpenAI: {str(e).rstrip('.')}. Попробуйте снова."
+
+    logger.debug("Успешно получен ответ от OpenAI")
+    usage = getattr(response, 'usage', None)
+    record_llm_call('openai', started, 'ok', attempts,
+                    getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None))
+    content = response.choices[0].message.content
+    if content is None:
+        return "Получен пустой ответ от OpenAI. Попробуйте снова."
+    return content
+
+
+def stream_openai_response(user_prompt: str, model: str = "gpt-4") -> Iterator[str]:
+    """
+    Потоково получает ответ OpenAI и отдаёт его фрагментами текста.
+    При ошибке бросает исключение; закрытие генератора закрывает HTTP-поток.
+    """
+    if os.getenv("TEST_MODE", "false").lower() == "true":
+        yield "Тестовый режим: Здесь будет ответ от OpenAI. Для реальной работы укажите OPENAI_API_KEY в .env"
+        return
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("Ошибка конфигурации OpenAI. Обратитесь к администратору.")
+
+    stream = get_openai_client(api_key).chat.completions.create(
+        model=model,
+        messages=_messages(user_prompt),
+        stream=True,
+        timeout=RetryPolicy.from_env().timeout
+    )
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        stream.close()
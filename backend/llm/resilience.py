@@ -0,0 +1,359 @@
+# Устойчивость вызовов LLM: дедлайны, повторы с backoff, circuit breaker, hedging и резервная модель
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+from telemetry import record_llm_backup
+
+from .cache import is_error
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Кроме 5xx повтор имеет смысл после таймаута, конфликта и превышения лимита запросов
+RETRIABLE_STATUSES = frozenset({408, 409, 425, 429})
+# Сколько последних успешных вызовов модели хранится для оценки p95
+LATENCY_SAMPLES = 200
+# Меньше замеров — p95 ненадёжен, задержка hedging берётся из LLM_HEDGE_DELAY
+LATENCY_MIN_SAMPLES = 20
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+class ProviderError(Exception):
+    """Неудачный вызов провайдера; retriable — повтор может помочь."""
+
+    def __init__(self, message: str, retriable: bool = True, status: Optional[int] = None):
+        super().__init__(message)
+        self.retriable = retriable
+        self.status = status
+        self.attempts = 0
+
+
+class CircuitOpenError(ProviderError):
+    """Breaker провайдера открыт: вызов не отправляется."""
+
+    def __init__(self, provider: str):
+        super().__init__(f'провайдер {provider} временно отключён после серии ошибок', retriable=False)
+
+
+class DeadlineExceeded(ProviderError):
+    """На следующую попытку не осталось времени."""
+
+    def __init__(self, seconds: float):
+        super().__init__(f'превышено время ожидания ответа ({seconds:g} с)', retriable=False)
+
+
+def is_retriable_status(status: Optional[int]) -> bool:
+    return status is None or status in RETRIABLE_STATUSES or status >= 500
+
+
+def provider_error(error: Exception) -> ProviderError:
+    """Приводит исключение SDK или HTTP-клиента к ProviderError по его status_code, если он есть."""
+    if isinstance(error, ProviderError):
+        return error
+    status = getattr(error, 'status_code', None)
+    return ProviderError(str(error) or type(error).__name__, is_retriable_status(status), status)
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Дедлайн вызова (все попытки вместе), число попыток и экспоненциальная задержка между ними."""
+    timeout: float = 90.0
+    connect_timeout: float = 5.0
+    attempts: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 8.0
+
+    def backoff(self, attempt: int) -> float:
+        """Задержка перед попыткой attempt + 1 с полным джиттером: случайная в [0, base·2^attempt]."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    @classmethod
+    def from_env(cls) -> 'RetryPolicy':
+        return cls(
+            timeout=_env_float("LLM_TIMEOUT", cls.timeout),
+            connect_timeout=_env_float("LLM_CONNECT_TIMEOUT", cls.connect_timeout),
+            attempts=max(int(_env_float("LLM_RETRIES", cls.attempts)), 1),
+            backoff_base=_env_float("LLM_BACKOFF_BASE", cls.backoff_base),
+            backoff_max=_env_float("LLM_BACKOFF_MAX", cls.backoff_max),
+        )
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker провайдера по скользящему окну попыток за window секунд.
+
+    closed → open, если в окне не меньше min_calls попыток и доля ошибок не меньше
+    error_rate или доля медленных (дольше slow_seconds) не меньше slow_rate.
+    Через cooldown секунд — half_open: пропускается одна пробная попытка; успех
+    закрывает breaker, ошибка открывает снова. Пока breaker открыт, вызовы сразу
+    завершаются ошибкой и не занимают воркер ожиданием зависшего провайдера.
+    """
+
+    def __init__(self, provider: str, window: float = 60.0, min_calls: int = 10, error_rate: float = 0.5,
+                 slow_seconds: float = 30.0, slow_rate: float = 0.8, cooldown: float = 30.0):
+        self.provider = provider
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.cooldown = cooldown
+        self._calls: Deque[Tuple[float, float, bool]] = deque()
+        self._state = 'closed'
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == 'open' and time.monotonic() - self._opened_at >= self.cooldown:
+                return 'half_open'
+            return self._state
+
+    def allow(self) -> bool:
+        """Можно ли отправить попытку; в half_open — только одну пробную за раз."""
+        with self._lock:
+            if self._state == 'closed':
+                return True
+            if self._state == 'open':
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    return False
+                self._state = 'half_open'
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record(self, latency: float, ok: bool) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if self._state == 'half_open':
+                self._probing = False
+                if ok and latency < self.slow_seconds:
+                    self._state = 'closed'
+                    self._calls.clear()
+                    logger.info("Circuit breaker for %s closed", self.provider)
+                else:
+                    self._open(now)
+                return
+            self._calls.append((now, latency, ok))
+            while self._calls and self._calls[0][0] < now - self.window:
+                self._calls.popleft()
+            if self._state == 'closed' and len(self._calls) >= self.min_calls:
+                failures = sum(1 for _, _, success in self._calls if not success)
+                slow = sum(1 for _, seconds, _ in self._calls if seconds >= self.slow_seconds)
+                if failures >= self.error_rate * len(self._calls) or slow >= self.slow_rate * len(self._calls):
+                    self._open(now)
+
+    def _open(self, now: float) -> None:
+        self._state = 'open'
+        self._opened_at = now
+        self._calls.clear()
+        logger.warning("Circuit breaker for %s opened for %.0f s", self.provider, self.cooldown)
+
+    @classmethod
+    def from_env(cls, provider: str) -> 'CircuitBreaker':
+        return cls(
+            provider,
+            window=_env_float("LLM_BREAKER_WINDOW", 60.0),
+            min_calls=int(_env_float("LLM_BREAKER_MIN_CALLS", 10)),
+            error_rate=_env_float("LLM_BREAKER_ERROR_RATE", 0.5),
+            slow_seconds=_env_float("LLM_BREAKER_SLOW_SECONDS", 30.0),
+            slow_rate=_env_float("LLM_BREAKER_SLOW_RATE", 0.8),
+            cooldown=_env_float("LLM_BREAKER_COOLDOWN", 30.0),
+        )
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(provider)
+        if breaker is None:
+            breaker = _breakers[provider] = CircuitBreaker.from_env(provider)
+        return breaker
+
+
+def breaker_states() -> Dict[str, str]:
+    """Состояние breaker каждого провайдера, к которому уже были вызовы."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.provider: breaker.state for breaker in breakers}
+
+
+def call_with_retries(provider: str, attempt: Callable[[float], T],
+                      policy: Optional[RetryPolicy] = None) -> Tuple[T, int]:
+    """
+    Выполняет attempt(timeout) с повторами, пока не кончатся попытки или дедлайн вызова.
+    timeout — сколько секунд осталось до дедлайна (таймаут чтения для HTTP-клиента).
+    Между попытками — экспоненциальная задержка с джиттером; попытки учитываются
+    в breaker провайдера. Возвращает (результат, число попыток); ProviderError (с
+    полем attempts) — ошибка без повтора, попытки кончились или breaker открыт.
+    """
+    policy = policy or RetryPolicy.from_env()
+    breaker = get_breaker(provider)
+    deadline = time.monotonic() + policy.timeout
+    for number in range(1, policy.attempts + 1):
+        if not breaker.allow():
+            error: ProviderError = CircuitOpenError(provider)
+        elif deadline - time.monotonic() <= 0:
+            error = DeadlineExceeded(policy.timeout)
+        else:
+            started = time.monotonic()
+            try:
+                result = attempt(deadline - started)
+            except Exception as e:
+                error = provider_error(e)
+                # Ошибка запроса (4xx) — не сбой: провайдер отвечает, для breaker это успех
+                breaker.record(time.monotonic() - started, ok=not error.retriable)
+            else:
+                breaker.record(time.monotonic() - started, ok=True)
+                return result, number
+
+        error.attempts = number
+        delay = policy.backoff(number - 1)
+        if not error.retriable or number == policy.attempts or time.monotonic() + delay >= deadline:
+            raise error
+        logger.warning("%s: attempt %s failed (%s), retrying in %.2f s", provider, number, error, delay)
+        time.sleep(delay)
+    raise AssertionError('unreachable')
+
+
+class LatencyTracker:
+    """Скользящая выборка длительностей успешных вызовов по модели для оценки p95."""
+
+    def __init__(self, samples: int = LATENCY_SAMPLES):
+        self._samples: Dict[Tuple[str, str], Deque[float]] = {}
+        self._size = samples
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, model: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault((provider, model), deque(maxlen=self._size)).append(seconds)
+
+    def quantile(self, provider: str, model: str, q: float = 0.95) -> Optional[float]:
+        with self._lock:
+            values = sorted(self._samples.get((provider, model), ()))
+        if len(values) < LATENCY_MIN_SAMPLES:
+            return None
+        return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def _target(value: Optional[str]) -> Optional[Tuple[str, str]]:
+    """«provider:model» → (provider, model)."""
+    if not value or ':' not in value:
+        return None
+    provider, model = value.split(':', 1)
+    return provider.strip(), model.strip()
+
+
+class HedgedCaller:
+    """
+    Ограничивает хвост задержек вызова модели.
+
+    Failover: если у провайдера задан резерв (LLM_FALLBACK_<PROVIDER>=provider:model),
+    то при ошибке основного вызова (в том числе открытом breaker) запрос уходит резерву.
+    Hedging (LLM_HEDGING=true): если основной вызов не ответил за p95 своих последних
+    успешных вызовов (или LLM_HEDGE_DELAY, пока замеров мало), параллельно отправляется
+    запасной — резерву или, если его нет, той же модели; берётся первый успешный ответ.
+    Проигравший HTTP-вызов прервать нельзя: он доработает в пуле в пределах своего дедлайна.
+    """
+
+    def __init__(self, hedging: bool, hedge_delay: float, fallbacks: Dict[str, Tuple[str, str]], max_workers: int):
+        self.hedging = hedging
+        self.hedge_delay = hedge_delay
+        self.fallbacks = fallbacks
+        self.latency = LatencyTracker()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm-hedge')
+
+    def delay(self, provider: str, model: str) -> float:
+        p95 = self.latency.quantile(provider, model)
+        return self.hedge_delay if p95 is None else p95
+
+    def call(self, provider: str, model: str, send: Callable[[str, str], str]) -> Tuple[str, str, str]:
+        """
+        Вызывает send(provider, model) — ответ модели или текст ошибки хелпера.
+        Возвращает (ответ, провайдер, модель), где провайдер и модель — те, что ответили.
+        """
+        fallback = self.fallbacks.get(provider)
+        if fallback == (provider, model):
+            fallback = None
+        if not self.hedging:
+            response = self._timed(provider, model, send)
+            if fallback is None or not is_error(response):
+                return response, provider, model
+            logger.warning("%s:%s failed, failing over to %s:%s", provider, model, *fallback)
+            backup = self._timed(fallback[0], fallback[1], send)
+            record_llm_backup(provider, 'failover', not is_error(backup))
+            return (backup, *fallback) if not is_error(backup) else (response, provider, model)
+
+        backup_target = fallback or (provider, model)
+        calls: Dict[Future, Tuple[str, str]] = {self._executor.submit(self._timed, provider, model, send): (provider, model)}
+        done, pending = wait(calls, timeout=self.delay(provider, model))
+        first = next(iter(calls))
+        if done and not is_error(first.result()):
+            return first.result(), provider, model
+        if done and fallback is None:
+            # Ответила ошибкой та же модель, что и запасная: повторы уже были внутри вызова
+            return first.result(), provider, model
+
+        kind = 'failover' if done else 'hedge'
+        logger.info("%s:%s %s, sending backup request to %s:%s", provider, model,
+                    'failed' if done else 'exceeded p95 budget', *backup_target)
+        calls[self._executor.submit(self._timed, backup_target[0], backup_target[1], send)] = backup_target
+        pending = set(calls) - set(done)
+        failed: List[Tuple[str, str, str]] = [(first.result(), provider, model)] if done else []
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                response = future.result()
+                if not is_error(response):
+                    record_llm_backup(provider, kind, future is not first)
+                    return (response, *calls[future])
+                failed.append((response, *calls[future]))
+        record_llm_backup(provider, kind, False)
+        # Все ответы — ошибки: отдаём ошибку основного вызова
+        return next((item for item in failed if item[1:] == (provider, model)), failed[0])
+
+    def _timed(self, provider: str, model: str, send: Callable[[str, str], str]) -> str:
+        started = time.monotonic()
+        try:
+            response = send(provider, model)
+        except Exception as e:
+            logger.exception("LLM call to %s:%s failed", provider, model)
+            return f'Ошибка при обращении к {provider}:{model}: {e}'
+        if not is_error(response):
+            self.latency.record(provider, model, time.monotonic() - started)
+        return response
+
+
+def create_hedged_caller_from_env() -> HedgedCaller:
+    """Создаёт hedging/failover по переменным окружения LLM_HEDGING, LLM_HEDGE_*, LLM_FALLBACK_<PROVIDER>."""
+    fallbacks = {}
+    for provider in ('yandex', 'giga', 'openai'):
+        target = _target(os.getenv(f"LLM_FALLBACK_{provider.upper()}"))
+        if target is not None:
+            fallbacks[provider] = target
+    return HedgedCaller(
+        hedging=os.getenv("LLM_HEDGING", "false").lower() == "true",
+        hedge_delay=_env_float("LLM_HEDGE_DELAY", 20.0),
+        fallbacks=fallbacks,
+        max_workers=int(_env_float("LLM_HEDGE_WORKERS", 16)),
+    )
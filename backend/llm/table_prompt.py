@@ -0,0 +1,235 @@
+# Сводка таблицы для промпта: статистика по колонкам и репрезентативная выборка строк в бюджете токенов
+import os
+import logging
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Бюджет токенов на данные таблицы по префиксу имени модели (остальное — системный промпт и ответ)
+MODEL_TOKEN_BUDGETS = (
+    ('yandexgpt-lite', 2000),
+    ('yandexgpt', 4000),
+    ('GigaChat-Pro', 6000),
+    ('GigaChat-Max', 6000),
+    ('GigaChat', 3000),
+    ('gpt-4o', 8000),
+    ('gpt-4.1', 8000),
+    ('gpt-4', 4000),
+    ('gpt-3.5', 3000),
+)
+DEFAULT_TOKEN_BUDGET = 3000
+
+HEAD_ROWS = 3
+OUTLIER_ROWS = 5
+OUTLIER_Z = 3.0
+# Колонка для стратифицированной выборки: не больше стольких категорий
+STRATA_MAX = 20
+TOP_VALUES_IN_PROMPT = 5
+CELL_MAX_CHARS = 60
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding('cl100k_base')
+except Exception:  # tiktoken необязателен: без него считаем по символам
+    _encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Оценивает число токенов текста. С tiktoken — точно для cl100k, иначе эвристика:
+    латиница и цифры около 4 символов на токен, кириллица около 2.
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii // 2 + 1
+
+
+def token_budget(model: str) -> int:
+    """Бюджет токенов на таблицу для модели; LLM_PROMPT_TOKENS задаёт значение для неизвестных моделей."""
+    for prefix, budget in MODEL_TOKEN_BUDGETS:
+        if model.startswith(prefix):
+            return budget
+    try:
+        return int(os.getenv("LLM_PROMPT_TOKENS", str(DEFAULT_TOKEN_BUDGET)))
+    except ValueError:
+        return DEFAULT_TOKEN_BUDGET
+
+
+def _fmt(value) -> str:
+    if value is None:
+        return '—'
+    if isinstance(value, float):
+        # Крупные значения без экспоненты: 999999 понятнее, чем 1e+06
+        return f"{value:.0f}" if 1e4 <= abs(value) < 1e15 else f"{value:.4g}"
+    return str(value)
+
+
+def _cell(value) -> str:
+    text = _fmt(value)
+    return text if len(text) <= CELL_MAX_CHARS else text[:CELL_MAX_CHARS - 1] + '…'
+
+
+def _column_lines(analysis: dict) -> List[str]:
+    lines = []
+    for column, stats in analysis.get('numeric_columns', {}).items():
+        lines.append(
+            f"- {column}: число; min={_fmt(stats.get('min'))}, max={_fmt(stats.get('max'))}, "
+            f"mean={_fmt(stats.get('mean'))}, median={_fmt(stats.get('median'))}, "
+            f"std={_fmt(stats.get('std'))}, пропусков={stats.get('null_count', 0)}"
+        )
+    for column, stats in analysis.get('string_columns', {}).items():
+        top_values = stats.get('top_values', [])
+        if top_values and top_values[0]['count'] == 1:
+            # Частоты идентификаторов (VIN, id) ничего не говорят модели
+            top = 'все значения различны'
+        else:
+            top = 'частые: ' + (', '.join(f"{_cell(item['value'])} ({item['count']})"
+                                          for item in top_values[:TOP_VALUES_IN_PROMPT]) or '—')
+        lines.append(
+            f"- {column}: текст; уникальных={stats.get('unique_values_count', 0)}; "
+            f"{top}; пропусков={stats.get('null_count', 0)}"
+        )
+    return lines
+
+
+def _csv_cell(value) -> str:
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return ''
+    text = _cell(value)
+    if any(ch in text for ch in ',"\n'):
+        text = '"' + text.replace('"', '""').replace('\n', ' ') + '"'
+    return text
+
+
+def _outlier_rows(df: pd.DataFrame) -> List[int]:
+    """Строки с самыми большими отклонениями (|z| > OUTLIER_Z) по числовым колонкам."""
+    numeric = df.select_dtypes(include='number')
+    if numeric.empty or len(df) < 3:
+        return []
+    values = numeric.to_numpy(dtype=np.float64, na_value=np.nan)
+    mean = np.nanmean(values, axis=0)
+    std = np.nanstd(values, axis=0)
+    std[~(std > 0)] = np.nan
+    with np.errstate(invalid='ignore'):
+        z = np.nan_to_num(np.abs((values - mean) / std), nan=0.0).max(axis=1)
+    candidates = np.flatnonzero(z > OUTLIER_Z)
+    return candidates[np.argsort(-z[candidates], kind='stable')][:OUTLIER_ROWS].tolist()
+
+
+def _strata_rows(df: pd.DataFrame, analysis: dict) -> List[int]:
+    """По строке на каждую категорию самой малокардинальной текстовой колонки."""
+    strings = analysis.get('string_columns', {})
+    candidates = [(stats.get('unique_values_count', 0), column) for column, stats in strings.items()
+                  if column in df.columns and 1 < stats.get('unique_values_count', 0) <= STRATA_MAX]
+    if not candidates:
+        return []
+    _, column = min(candidates, key=lambda item: item[0])
+    codes, _ = pd.factorize(df[column])
+    _, first = np.unique(codes[codes >= 0], return_index=True)
+    return np.flatnonzero(codes >= 0)[first].tolist()
+
+
+def _spread_rows(n_rows: int, count: int) -> List[int]:
+    """Равномерно распределённые по всей таблице строки."""
+    if n_rows == 0 or count <= 0:
+        return []
+    return np.unique(np.linspace(0, n_rows - 1, num=min(count, n_rows)).round().astype(int)).tolist()
+
+
+def rows_per_prompt(df: pd.DataFrame, budget: int, sample_rows: int = 200) -> int:
+    """
+    Сколько строк df в среднем помещается целиком в промпт на budget токенов
+    (без статистики по колонкам). Оценка по равномерной выборке строк.
+    """
+    if df.empty:
+        return 1
+    sample = df.iloc[_spread_rows(len(df), sample_rows)]
+    lines = [','.join([str(len(df))] + [_csv_cell(v) for v in record])
+             for record in sample.itertuples(index=False, name=None)]
+    per_row = sum(estimate_tokens(line) for line in lines) / len(lines)
+    # Заголовок таблицы, строка имён колонок и подпись выборки
+    overhead = estimate_tokens(','.join(['#'] + [_csv_cell(c) for c in df.columns])) + 40
+    # Больше строк build_table_prompt не рассматривает как кандидатов выборки
+    return int(max(1, min((budget - overhead) / per_row, max(budget // 10, HEAD_ROWS))))
+
+
+def _ordered_unique(groups: Iterable[List[int]]) -> List[int]:
+    seen: Dict[int, None] = {}
+    for group in groups:
+        for idx in group:
+            seen.setdefault(int(idx), None)
+    return list(seen)
+
+
+def _overview(n_rows: int, n_columns: int, analysis: dict, budget: int) -> Tuple[List[str], int]:
+    header = f"Таблица: {n_rows} строк, {n_columns} колонок."
+    used = estimate_tokens(header)
+    parts = [header]
+
+    column_lines = _column_lines(analysis)
+    if column_lines:
+        parts.append("Колонки:")
+        used += estimate_tokens("Колонки:")
+        for i, line in enumerate(column_lines):
+            cost = estimate_tokens(line)
+            if used + cost > budget:
+                parts.append(f"- … ещё {len(column_lines) - i} колонок")
+                break
+            parts.append(line)
+            used += cost
+    return parts, used
+
+
+def table_overview(n_rows: int, n_columns: int, analysis: dict, budget: int) -> str:
+    """Размер таблицы и статистика по колонкам без строк, в пределах budget токенов."""
+    return '\n'.join(_overview(n_rows, n_columns, analysis, budget)[0])
+
+
+def build_table_prompt(df: pd.DataFrame, analysis: dict, budget: int, row_offset: int = 0) -> str:
+    """
+    Строит компактное описание таблицы, укладывающееся в budget токенов.
+
+    Сначала идут размер таблицы и статистика по колонкам (по всему датасету),
+    затем CSV-выборка строк по приоритету: начало таблицы, выбросы, по строке
+    на категорию, затем равномерно по всей таблице — пока хватает бюджета.
+    Выборка детерминирована, поэтому одинаковая таблица даёт одинаковый промпт.
+    row_offset — номер первой строки df в исходной таблице (для фрагментов).
+    """
+    parts, used = _overview(len(df), len(df.columns), analysis, budget)
+
+    if len(df) == 0 or len(df.columns) == 0:
+        return '\n'.join(parts)
+
+    # Равномерных кандидатов берём с запасом: лишнее отсечёт бюджет
+    order = _ordered_unique([
+        range(min(HEAD_ROWS, len(df))),
+        _outlier_rows(df),
+        _strata_rows(df, analysis),
+        _spread_rows(len(df), max(budget // 10, HEAD_ROWS)),
+    ])
+    columns_line = ','.join(['#'] + [_csv_cell(c) for c in df.columns])
+    title = "Выборка строк (CSV, # — номер строки в таблице):"
+    used += estimate_tokens(title) + estimate_tokens(columns_line)
+
+    chosen = []
+    records = df.iloc[order].itertuples(index=False, name=None)
+    for idx, record in zip(order, records):
+        line = ','.join([str(row_offset + idx + 1)] + [_csv_cell(v) for v in record])
+        cost = estimate_tokens(line)
+        if used + cost > budget:
+            break
+        chosen.append((idx, line))
+        used += cost
+
+    if chosen:
+        chosen.sort()
+        parts += [title, columns_line] + [line for _, line in chosen]
+        if len(chosen) < len(df):
+            parts.append(f"(показано {len(chosen)} из {len(df)} строк)")
+    logger.debug("Table prompt: %s rows of %s, ~%s tokens (budget %s)", len(chosen), len(df), used, budget)
+    return '\n'.join(parts)
+
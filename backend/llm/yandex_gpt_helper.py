@@ -1,17 +1,44 @@
 import os
+import time
 import logging
-import requests
-from typing import Optional
+from dataclasses import replace
+from typing import Iterator, Optional
 import json
 
+from telemetry import record_llm_call
+
+from .clients import get_http_session, yandex_completion_url
+from .resilience import ProviderError, RetryPolicy, call_with_retries, is_retriable_status
+
 logger = logging.getLogger(__name__)
 
 # Этот модуль инкапсулирует работу с YandexGPT.
 
-def get_yandex_response(user_prompt: str, model: str = "yandexgpt-lite", retries=3) -> str:
+def _headers(folder_id: str, iam_token: str) -> dict:
+    return {
+        "Authorization": f"Bearer {iam_token}",
+        "x-folder-id": folder_id
+    }
+
+def _payload(folder_id: str, model: str, user_prompt: str, stream: bool) -> dict:
+    return {
+        "modelUri": f"gpt://{folder_id}/{model}",
+        "completionOptions": {
+            "stream": stream,
+            "temperature": 0.6,
+            "maxTokens": "2000"
+        },
+        "messages": [
+            {"role": "system", "text": "Ты — полезный ассистент-аналитик данных."},
+            {"role": "user", "text": user_prompt}
+        ]
+    }
+
+def get_yandex_response(user_prompt: str, model: str = "yandexgpt-lite", retries: Optional[int] = None) -> str:
     """
     Отправляет запрос к YandexGPT и возвращает ответ.
-    Предусмотрены повторные попытки в случае ошибки.
+    Повторы с экспоненциальной задержкой, дедлайн и circuit breaker — в call_with_retries;
+    retries переопределяет LLM_RETRIES.
     """
     # В тестовом режиме возвращаем заглушку
     if os.getenv("TEST_MODE", "false").lower() == "true":
@@ -26,55 +53,93 @@ def get_yandex_response(user_prompt: str, model: str = "yandexgpt-lite", retries
         logger.error("Не найдены учетные данные Yandex в переменных окружения")
         return "Ошибка конфигурации YandexGPT. Обратитесь к администратору."
     
-    headers = {
-        "Authorization": f"Bearer {iam_token}",
-        "x-folder-id": folder_id
-    }
-    
-    data = {
-        "modelUri": f"gpt://{folder_id}/{model}",
-        "completionOptions": {
-            "stream": False,
-            "temperature": 0.6,
-            "maxTokens": "2000"
-        },
-        "messages": [
-            {"role": "system", "text": "Ты — полезный ассистент-аналитик данных."},
-            {"role": "user", "text": user_prompt}
-        ]
-    }
+    headers = _headers(folder_id, iam_token)
+    data = _payload(folder_id, model, user_prompt, stream=False)
     
-    logger.debug(f"Подготовлен запрос к YandexGPT:")
-    logger.debug(f"Headers: {json.dumps({k: v[:10] + '...' if k == 'Authorization' else v for k, v in headers.items()})}")
-    logger.debug(f"Data: {json.dumps(data)}")
+    # json.dumps всего промпта дорог — только если DEBUG действительно включён
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Подготовлен запрос к YandexGPT:")
+        logger.debug(f"Headers: {json.dumps({k: v[:10] + '...' if k == 'Authorization' else v for k, v in headers.items()})}")
+        logger.debug(f"Data: {json.dumps(data)}")
     
-    for attempt in range(retries):
-        try:
-            logger.debug(f"Попытка {attempt + 1} отправки запроса к YandexGPT")
-            response = requests.post(
-                "https://llm.api.cloud.yandex.net/foundationModels/v1/completion",
-                headers=headers,
-                json=data
-            )
-            
-            if response.status_code != 200:
-                error_msg = f"Ошибка API YandexGPT: {response.status_code} - {response.text}"
-                logger.error(error_msg)
-                if "folder ID" in response.text:
-                    error_response = response.json()
-                    logger.error(f"Детали ошибки: {json.dumps(error_response)}")
-                    if 'error' in error_response and 'message' in error_response['error']:
-                        return f"Ошибка конфигурации YandexGPT: {error_response['error']['message']}"
-                    return f"Ошибка конфигурации YandexGPT: неверный ID каталога. Текущий ID: {folder_id}"
+    # Общая keep-alive сессия: без нового TLS-рукопожатия на каждый запрос
+    session = get_http_session("yandex")
+    policy = RetryPolicy.from_env()
+    if retries is not None:
+        policy = replace(policy, attempts=retries)
+    started = time.perf_counter()
+
+    def attempt(timeout: float) -> dict:
+        response = session.post(
+            yandex_completion_url(),
+            headers=headers,
+            json=data,
+            timeout=(min(policy.connect_timeout, timeout), timeout)
+        )
+        if response.status_code != 200:
+            logger.error(f"Ошибка API YandexGPT: {response.status_code} - {response.text}")
+            if "folder ID" in response.text:
+                error_response = response.json()
+                logger.error(f"Детали ошибки: {json.dumps(error_response)}")
+                if 'error' in error_response and 'message' in error_response['error']:
+                    message = f"Ошибка конфигурации YandexGPT: {error_response['error']['message']}"
+                else:
+                    message = f"Ошибка конфигурации YandexGPT: неверный ID каталога. Текущий ID: {folder_id}"
+                raise ProviderError(message, retriable=False, status=response.status_code)
+            raise ProviderError(f"Ошибка API YandexGPT: {response.status_code}",
+                                is_retriable_status(response.status_code), response.status_code)
+        return response.json()
+
+    try:
+        result, attempts = call_with_retries('yandex', attempt, policy)
+    except ProviderError as e:
+        record_llm_call('yandex', started, 'error', e.attempts)
+        if str(e).startswith("Ошибка конфигурации"):
+            return str(e)
+        return f"Не удалось получить ответ от YandexGPT: {str(e).rstrip('.')}. Попробуйте снова."
+
+    logger.debug("Успешно получен ответ от YandexGPT")
+    usage = result['result'].get('usage', {})
+    record_llm_call('yandex', started, 'ok', attempts,
+                    usage.get('inputTextTokens'), usage.get('completionTokens'))
+    return result['result']['alternatives'][0]['message']['text']
+
+
+def stream_yandex_response(user_prompt: str, model: str = "yandexgpt-lite") -> Iterator[str]:
+    """
+    Потоково получает ответ YandexGPT и отдаёт его фрагментами текста.
+
+    В режиме stream API присылает строки JSON, в каждой — весь текст на текущий момент,
+    поэтому наружу отдаём только прибавившуюся часть. При ошибке бросает исключение;
+    закрытие генератора закрывает HTTP-соединение.
+    """
+    if os.getenv("TEST_MODE", "false").lower() == "true":
+        yield "Тестовый режим: Здесь будет ответ от YandexGPT. Для реальной работы укажите YANDEX_FOLDER_ID и YANDEX_API_KEY в .env"
+        return
+
+    folder_id = os.getenv("YANDEX_FOLDER_ID")
+    iam_token = os.getenv("YANDEX_API_KEY")
+    if not folder_id or not iam_token:
+        raise RuntimeError("Ошибка конфигурации YandexGPT. Обратитесь к администратору.")
+
+    policy = RetryPolicy.from_env()
+    # Таймаут чтения ограничивает паузу между фрагментами, а не весь поток
+    response = get_http_session("yandex").post(
+        yandex_completion_url(),
+        headers=_headers(folder_id, iam_token),
+        json=_payload(folder_id, model, user_prompt, stream=True),
+        stream=True,
+        timeout=(policy.connect_timeout, policy.timeout)
+    )
+    with response:
+        if response.status_code != 200:
+            logger.error(f"Ошибка API YandexGPT: {response.status_code} - {response.text}")
+            raise RuntimeError(f"Ошибка API YandexGPT: {response.status_code}")
+        sent = 0
+        for line in response.iter_lines():
+            if not line:
                 continue
-                
-            result = response.json()
-            logger.debug("Успешно получен ответ от YandexGPT")
-            return result['result']['alternatives'][0]['message']['text']
-            
-        except Exception as e:
-            logger.error(f"Ошибка при работе с YandexGPT (попытка {attempt + 1}): {str(e)}")
-            if attempt + 1 == retries:
-                return "Не удалось получить ответ от YandexGPT. Попробуйте снова."
-    
-    return "Не удалось получить ответ от YandexGPT после всех попыток."
\ No newline at end of file
+            text = json.loads(line)['result']['alternatives'][0]['message']['text']
+            if len(text) > sent:
+                yield text[sent:]
+                sent = len(text)
@@ -1,20 +1,24 @@
-from flask import Flask, request, send_file, jsonify
-from weasyprint import HTML, CSS
+from flask import Blueprint, Flask, Request, Response, request, send_file, jsonify, stream_with_context
 from io import BytesIO
 import pandas as pd
-import pdfplumber
 import tempfile
 import os
+import math
 import json
-from typing import List, Optional
+import importlib
+from contextlib import closing
+from typing import List, Optional, Tuple
 from dotenv import load_dotenv
 from pathlib import Path
 from flask_cors import CORS
 import logging
+import time
 from werkzeug.utils import secure_filename
 
-# Настраиваем логирование
-logging.basicConfig(level=logging.DEBUG)
+# Настраиваем логирование: DEBUG заметно замедляет горячие пути, поэтому по умолчанию INFO
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+# pdfminer на уровне DEBUG пишет запись на каждый объект страницы — разбор PDF замедляется втрое
+logging.getLogger('pdfminer').setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 # Загружаем переменные окружения как можно раньше, из КОРНЯ проекта (единый .env)
@@ -22,125 +26,118 @@ _root_env_path = Path(__file__).resolve().parents[1] / '.env'
 load_dotenv(dotenv_path=_root_env_path)
 
 # Импортируем LLM-обработчик после загрузки .env, чтобы учитывался TEST_MODE и ключи
-from llm.main_processor import get_analysis
+from llm.main_processor import configured_providers, get_analysis, response_cache, stream_analysis
+from llm.batch import create_batch_analyzer_from_env, validate_targets
+from llm.mapreduce import create_map_reduce_analyzer_from_env
+from llm.resilience import breaker_states
+from llm.table_prompt import build_table_prompt, token_budget
+from jobs import FileResult, JobContext, concurrency_from_env, create_job_queue_from_env
+from processing.cache import CachedDataset, compute_dataset_id, compute_file_dataset_id, create_dataset_cache_from_env
+from processing.analysis import perform_basic_analysis
+from processing.excel import EXCEL_EXTENSIONS, create_workbook_store_from_env, list_sheets, read_excel_chunked, sheet_dataset_id
+from processing.pdf import create_pdf_extractor_from_env
+from processing.report import build_report_html, create_report_renderer_from_env
+from processing.serialize import ARROW_MIMETYPE, apply_defaults, arrow_ipc, columnar_json, compress, dumps, json_body, records_json
+from processing.imputation import NUMERIC_STRATEGIES, missing_mask, suggest_fill_values
+from processing.ingest import ChunkConsumer, CsvSource, read_csv_chunked
+from processing.query import QueryError, QueryResult, query_dataset
+from processing.stats import DatasetStats
+from processing.timeseries import TimeSeriesError, timeseries
+from processing.uploads import create_upload_store_from_env
+from telemetry import (PROMETHEUS_MIMETYPE, REGISTRY, SamplingProfiler, profiler_enabled, record_ingest,
+                       record_request, server_timing_header, span, start_request_timing)
 
-app = Flask(__name__)
+# Маршруты API; приложение собирает create_app()
+api = Blueprint('api', __name__)
 
-# Настраиваем максимальный размер файла (100 МБ)
-app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100 MB
+# Кэш распарсенных датасетов: пагинация и повторные загрузки не разбирают файл заново
+dataset_cache = create_dataset_cache_from_env()
 
-# Настраиваем CORS более специфично
-CORS(app, resources={
-    r"/api/*": {
-        "origins": ["http://localhost:3000"],
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type"]
-    }
-})
+# Загруженные книги Excel: переключение листа без повторной загрузки файла
+workbook_store = create_workbook_store_from_env()
 
-def perform_basic_analysis(df: pd.DataFrame) -> dict:
-    """Выполняет базовый анализ данных DataFrame."""
-    logger.debug(f"Starting basic analysis. DataFrame shape: {df.shape}")
-    logger.debug(f"DataFrame columns: {df.columns.tolist()}")
-    
-    analysis = {
-        'numeric_columns': {},
-        'string_columns': {}
-    }
-    
-    for column in df.columns:
-        logger.debug(f"Analyzing column: {column}")
-        if pd.api.types.is_numeric_dtype(df[column]):
-            logger.debug(f"Column {column} is numeric")
-            # Обрабатываем NaN значения для числовых колонок
-            column_data = df[column].dropna()
-            if len(column_data) > 0:
-                analysis['numeric_columns'][column] = {
-                    'sum': float(column_data.sum()),
-                    'mean': float(column_data.mean()),
-                    'min': float(column_data.min()),
-                    'max': float(column_data.max())
-                }
-            else:
-                analysis['numeric_columns'][column] = {
-                    'sum': 0.0,
-                    'mean': 0.0,
-                    'min': 0.0,
-                    'max': 0.0
-                }
-            logger.debug(f"Numeric analysis for {column}: {analysis['numeric_columns'][column]}")
-        else:
-            logger.debug(f"Column {column} is string")
-            # Обрабатываем NaN значения для строковых колонок
-            unique_values = df[column].dropna().unique().tolist()[:10]
-            analysis['string_columns'][column] = {
-                'unique_values_count': int(df[column].nunique()),
-                'unique_values': unique_values
-            }
-            logger.debug(f"String analysis for {column}: {analysis['string_columns'][column]}")
-    
-    return analysis
-
-def process_pdf(file: str) -> pd.DataFrame:
-    """Извлекает таблицу из первой страницы PDF файла."""
-    with pdfplumber.open(file) as pdf:
-        first_page = pdf.pages[0]
-        tables = first_page.extract_tables()
-        if tables and len(tables) > 0:
-            # Берем первую таблицу и создаем список имен столбцов
-            headers = [f"Column_{i}" if cell is None else str(cell) for i, cell in enumerate(tables[0][0])]
-            # Создаем DataFrame с данными и именами столбцов
-            df = pd.DataFrame(tables[0][1:], columns=pd.Index(headers))
-            return df
-    return pd.DataFrame()  # Возвращаем пустой DataFrame если таблица не найдена
-
-def process_excel(file: str) -> pd.DataFrame:
-    """Извлекает данные из Excel файла."""
-    return pd.read_excel(file)
-
-def process_csv(file: str, encoding: str = 'utf-8') -> pd.DataFrame:
-    """Извлекает данные из CSV файла."""
-    logger.debug(f"Processing CSV file with encoding: {encoding}")
-    try:
-        df = pd.read_csv(file, encoding=encoding)
-        logger.debug(f"Successfully read CSV. Shape: {df.shape}")
-        return df
-    except UnicodeDecodeError:
-        logger.debug("UTF-8 encoding failed, trying cp1251")
-        try:
-            df = pd.read_csv(file, encoding='cp1251')
-            logger.debug(f"Successfully read CSV with cp1251. Shape: {df.shape}")
-            return df
-        except:
-            logger.error("Failed to read CSV with both encodings")
-            raise ValueError("Не удалось определить кодировку файла")
+# Возобновляемые загрузки больших файлов частями (/api/uploads)
+upload_store = create_upload_store_from_env()
+
+# Форматы, которые принимает загрузка
+UPLOAD_EXTENSIONS = ('.csv', '.xlsx', '.xls', '.pdf')
+# Файл из multipart-формы до этого размера остаётся в памяти: CSV разбирается без записи на диск
+UPLOAD_MEMORY_BYTES = int(float(os.getenv("UPLOAD_MEMORY_MB", "8")) * 1024 * 1024)
+
+# Разбор PDF: страницы параллельно в пуле процессов, уже разобранные берутся из кэша
+pdf_extractor = create_pdf_extractor_from_env()
+
+# Рендер PDF отчётов: в пуле процессов, готовые PDF кэшируются по хэшу HTML
+report_renderer = create_report_renderer_from_env()
+
+# Общий пул для параллельного анализа на нескольких LLM
+batch_analyzer = create_batch_analyzer_from_env()
+
+# Map-reduce анализ больших таблиц: фрагменты анализируются параллельно в ограниченном пуле
+map_reduce_analyzer = create_map_reduce_analyzer_from_env()
+
+# Режимы /api/analyze: сводка таблицы в одном промпте или все строки по фрагментам (map-reduce)
+ANALYSIS_MODES = ('single', 'map_reduce')
+# Состояния circuit breaker провайдеров LLM как значения метрики
+BREAKER_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+# Фоновые задачи: долгий анализ, разбор больших файлов и рендер отчётов не держат запрос
+job_queue = create_job_queue_from_env()
+
+def process_pdf(file: str, file_hash: Optional[str] = None) -> pd.DataFrame:
+    """Извлекает таблицу из PDF файла: со всех страниц, со склейкой продолжений таблицы."""
+    return pdf_extractor.extract(file, file_hash or compute_file_dataset_id(file, '.pdf'))
+
+def process_excel(file: str, sheet: Optional[str] = None) -> pd.DataFrame:
+    """Извлекает данные из листа Excel файла (по умолчанию первого)."""
+    return read_excel_chunked(file, sheet)
+
+def process_csv(file: str, encoding: Optional[str] = None) -> pd.DataFrame:
+    """Извлекает данные из CSV файла за один потоковый проход."""
+    logger.debug("Processing CSV file with encoding: %s", encoding or 'auto')
+    return read_csv_chunked(file, encoding=encoding)
 
 def process_large_csv(file_path: str, file_size: int) -> pd.DataFrame:
-    """Обрабатывает большой CSV файл с ограничением по размеру."""
-    logger.debug(f"Processing large CSV file: {file_path}, size: {file_size}")
+    """Обрабатывает большой CSV файл целиком, читая его чанками."""
+    logger.debug("Processing large CSV file: %s, size: %s", file_path, file_size)
     
     try:
-        # Если файл меньше 10 МБ, читаем его полностью
-        if file_size < 10 * 1024 * 1024:  # 10 MB
-            return process_csv(file_path)
-            
-        # Для больших файлов читаем только первые 1000 строк
-        df = pd.read_csv(file_path, nrows=1000)
-        logger.debug(f"Read first 1000 rows. Shape: {df.shape}")
-        return df
-        
+        return read_csv_chunked(file_path)
     except Exception as e:
         logger.error(f"Error processing large CSV: {e}")
         raise ValueError(f"Ошибка обработки CSV файла: {str(e)}")
 
-@app.errorhandler(413)
+@api.app_errorhandler(413)
 def too_large(e):
     """Обработчик ошибки превышения размера файла"""
     return jsonify({
-        'error': 'Файл слишком большой. Максимальный размер: 100 МБ'
+        'error': 'Файл слишком большой. Максимальный размер: 100 МБ, файлы больше загружайте частями через /api/uploads'
     }), 413
 
-@app.route('/api/test', methods=['GET'])
+# Заголовок Server-Timing с длительностью этапов запроса (parse, serialize, llm, ...)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() == "true"
+
+@api.before_app_request
+def _start_timing():
+    request.environ['analyzer.started'] = time.perf_counter()
+    if SERVER_TIMING:
+        start_request_timing()
+
+@api.after_app_request
+def _record_request(response: Response) -> Response:
+    """Длительность и счётчик запросов; при SERVER_TIMING=true — заголовок Server-Timing."""
+    started = request.environ.get('analyzer.started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    record_request(endpoint, request.method, response.status_code, elapsed)
+    timing = server_timing_header(elapsed)
+    if timing:
+        response.headers['Server-Timing'] = timing
+    return response
+
+@api.route('/api/test', methods=['GET'])
 def test_endpoint():
     """Простой тестовый endpoint"""
     return jsonify({
@@ -150,7 +147,228 @@ def test_endpoint():
         'version': '1.0'
     })
 
-@app.route('/api/upload', methods=['POST'])
+@api.route('/api/health/live', methods=['GET'])
+def liveness():
+    """Liveness-проба: процесс отвечает на запросы. Зависимости не проверяются — их сбой не повод перезапускать процесс."""
+    return jsonify({'status': 'ok'})
+
+@api.route('/api/health/ready', methods=['GET'])
+def readiness():
+    """
+    Readiness-проба: воркер запущен (start_worker) и хранилища доступны. Настроенные
+    провайдеры LLM только перечисляются: без них сервер по-прежнему разбирает файлы.
+    """
+    checks = {
+        'worker': job_queue.running,
+        'job_store': job_queue.ping(),
+        'dataset_spill_dir': dataset_cache.spill_dir is None or os.access(dataset_cache.spill_dir, os.W_OK),
+        'workbook_store': os.access(workbook_store.directory, os.W_OK),
+    }
+    ready = all(checks.values())
+    return jsonify({
+        'status': 'ready' if ready else 'not ready',
+        'checks': checks,
+        'providers': configured_providers(),
+        'pid': os.getpid(),
+    }), 200 if ready else 503
+
+def _parse_file(path: CsvSource, file_extension: str, stats: DatasetStats, file_hash: Optional[str] = None,
+                sheet: Optional[str] = None, on_chunk: Optional[ChunkConsumer] = None) -> pd.DataFrame:
+    """
+    Разбирает загруженный файл в DataFrame по его расширению, накапливая статистику.
+    on_chunk вызывается на каждом прочитанном чанке CSV/Excel (прогресс фоновой задачи).
+    CSV можно передать потоком, остальные форматы — только путём к файлу.
+    """
+    consumers = [stats.update] + ([on_chunk] if on_chunk else [])
+    if file_extension.endswith('.csv'):
+        # CSV и Excel анализируются по мере чтения чанков
+        return read_csv_chunked(path, consumers=consumers)
+    elif file_extension.endswith(EXCEL_EXTENSIONS):
+        return read_excel_chunked(path, sheet, consumers=consumers)
+    elif file_extension.endswith('.pdf'):
+        df = process_pdf(path, file_hash)
+    else:
+        raise ValueError('Unsupported file format')
+    stats.update(df)
+    return df
+
+def _page_params() -> tuple:
+    """Читает параметры пагинации из query-строки."""
+    page = request.args.get('page', 1, type=int)
+    page_size = request.args.get('page_size', 1000, type=int)
+    
+    # Ограничиваем размер страницы
+    page_size = min(page_size, 5000)  # Максимум 5000 строк на страницу
+    return max(page, 1), max(page_size, 1)
+
+def _is_async() -> bool:
+    """Запрос просит выполнить работу фоновой задачей: ?async=true или "async": true в JSON."""
+    if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+        return True
+    data = request.get_json(silent=True)
+    return isinstance(data, dict) and data.get('async') is True
+
+def _job_accepted(job_id: str) -> tuple:
+    """Ответ 202 с состоянием только что поставленной задачи."""
+    return jsonify(job_queue.get(job_id)), 202, {'Location': f'/api/jobs/{job_id}'}
+
+def _page_response(entry: CachedDataset, page: int, page_size: int, extra: Optional[dict] = None,
+                   result: Optional[QueryResult] = None) -> Response:
+    """
+    Формирует ответ со страницей данных из закэшированного датасета или, если передан
+    result, из результата запроса к нему (тогда без базового анализа всего датасета и без
+    значений по умолчанию вместо пропусков).
+
+    Формат выбирается по ?format=records|columnar (по умолчанию записи) или по
+    Accept: application/vnd.apache.arrow.stream; тело сжимается по Accept-Encoding.
+    """
+    dataset_page = result is None
+    analysis = entry.analysis if dataset_page else None
+    columns = entry.df.columns.tolist() if dataset_page else result.columns
+    
+    # Вычисляем общее количество строк
+    total_rows = len(entry.df) if dataset_page else len(result)
+    total_pages = (total_rows + page_size - 1) // page_size
+    
+    logger.debug("Total rows: %s, Total pages: %s, Page: %s, Page size: %s", total_rows, total_pages, page, page_size)
+    
+    # Применяем пагинацию
+    start_idx = (page - 1) * page_size
+    end_idx = start_idx + page_size
+    df_page = entry.df.iloc[start_idx:end_idx] if dataset_page else result.rows(start_idx, end_idx)
+
+    meta = {
+        'dataset_id': entry.dataset_id,
+        'columns': columns,
+        'total_rows': total_rows,
+        'current_page': page,
+        'page_size': page_size,
+        'total_pages': total_pages,
+        **({'basic_analysis': analysis} if analysis is not None else {}),
+        **(extra or {})
+    }
+
+    arrow = request.accept_mimetypes.best == ARROW_MIMETYPE
+    response_format = request.args.get('format', 'records')
+    with span('serialize'):
+        if dataset_page:
+            # Страница датасета: пропуски заменяются значениями по умолчанию по колонкам, без цикла
+            # по записям, а записи дополняются полями RECORD_FIELDS. Результат запроса отдаётся как
+            # есть: пропуск, найденный фильтром is_null, остаётся null, лишних колонок нет
+            df_page = apply_defaults(df_page, add_missing=not arrow and response_format != 'columnar')
+        if arrow:
+            body, mimetype = arrow_ipc(df_page, meta), ARROW_MIMETYPE
+        elif response_format == 'columnar':
+            meta['format'] = 'columnar'
+            body, mimetype = json_body(meta, columnar_json(df_page)), 'application/json'
+        else:
+            body, mimetype = json_body(meta, records_json(df_page)), 'application/json'
+    return _compressed_response(body, mimetype)
+
+def _compressed_response(body: bytes, mimetype: str) -> Response:
+    """Ответ с телом, сжатым по Accept-Encoding запроса."""
+    with span('compress'):
+        body, encoding = compress(body, lambda name: request.accept_encodings[name])
+    response = Response(body, mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+def _source_size(source: CsvSource) -> int:
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    size = source.seek(0, os.SEEK_END)
+    source.seek(0)
+    return size
+
+def _load_dataset(dataset_id: str, path: CsvSource, file_extension: str, filename: str,
+                  sheet: Optional[str] = None, on_chunk: Optional[ChunkConsumer] = None) -> Optional[CachedDataset]:
+    """Берёт датасет из кэша или разбирает файл и кладёт результат в кэш; None, если данных в файле нет."""
+    entry = dataset_cache.get(dataset_id)
+    if entry is not None:
+        logger.debug("Dataset %s served from cache", dataset_id)
+        return entry
+
+    stats = DatasetStats()
+    with span('parse'):
+        df = _parse_file(path, file_extension, stats, dataset_id, sheet, on_chunk)
+    file_format = 'excel' if file_extension.endswith(EXCEL_EXTENSIONS) else os.path.splitext(file_extension)[1].lstrip('.')
+    record_ingest(file_format, _source_size(path), len(df))
+    if df.empty:
+        return None
+
+    # Базовый анализ для всех данных собран накопителями во время разбора
+    with span('analysis'):
+        analysis = stats.to_analysis(df)
+    return dataset_cache.put(dataset_id, df, analysis, filename, stats)
+
+def _ingest_upload(path: CsvSource, file_extension: str, filename: str, sheet: Optional[str] = None,
+                   on_chunk: Optional[ChunkConsumer] = None,
+                   dataset_id: Optional[str] = None) -> Tuple[Optional[CachedDataset], dict]:
+    """
+    Разбирает загруженный файл (CSV — путь или поток) в датасет. Для Excel книга сохраняется
+    на сервере, а вторым значением возвращается {file_id, sheets, sheet}; LookupError — если
+    листа нет. dataset_id — хэш файла, если он уже посчитан при приёме частей.
+    """
+    # Повторная загрузка того же файла (например, следующая страница) берётся из кэша
+    extension = os.path.splitext(file_extension)[1]
+    if dataset_id is None:
+        with span('hash'):
+            if isinstance(path, str):
+                dataset_id = compute_file_dataset_id(path, extension)
+            else:
+                path.seek(0)
+                dataset_id = compute_dataset_id(path, extension)
+                path.seek(0)
+
+    if not file_extension.endswith(EXCEL_EXTENSIONS):
+        return _load_dataset(dataset_id, path, file_extension, filename, on_chunk=on_chunk), {}
+
+    # Книга сохраняется на сервере: другие листы открываются без повторной загрузки
+    workbook_path = workbook_store.put(dataset_id, path, extension)
+    sheets = list_sheets(workbook_path)
+    sheet = sheet or sheets[0]
+    if sheet not in sheets:
+        raise LookupError(f'Лист "{sheet}" не найден в файле')
+    workbook = {'file_id': dataset_id, 'sheets': sheets, 'sheet': sheet}
+    entry = _load_dataset(sheet_dataset_id(dataset_id, sheet), workbook_path, file_extension, filename, sheet, on_chunk)
+    return entry, workbook
+
+def _discard_upload_file(payload: dict) -> None:
+    """Удаляет файл задачи загрузки: после разбора, при отмене в очереди или после падения процесса."""
+    if payload.get('path'):
+        try:
+            os.remove(payload['path'])
+        except FileNotFoundError:
+            pass
+
+def _upload_job(job: JobContext, payload: dict) -> dict:
+    """Фоновый разбор загруженного файла; строки потом читаются через /api/datasets/<id>/rows."""
+    rows_read = 0
+
+    def on_chunk(chunk: pd.DataFrame) -> None:
+        nonlocal rows_read
+        rows_read += len(chunk)
+        job.progress(message=f'Прочитано строк: {rows_read}')
+
+    try:
+        job.progress(0.0, 'Разбор файла')
+        entry, workbook = _ingest_upload(payload['path'], payload['file_extension'], payload['filename'],
+                                         payload.get('sheet'), on_chunk, payload.get('dataset_id'))
+    finally:
+        _discard_upload_file(payload)
+    if entry is None:
+        raise ValueError('Не удалось извлечь данные из файла')
+    return {
+        'dataset_id': entry.dataset_id,
+        'columns': entry.df.columns.tolist(),
+        'total_rows': len(entry.df),
+        'basic_analysis': entry.analysis,
+        **workbook
+    }
+
+@api.route('/api/upload', methods=['POST'])
 def upload_file():
     temp_file_name = None
     try:
@@ -166,90 +384,44 @@ def upload_file():
             return jsonify({'error': 'No file selected'}), 400
             
         file_extension = file.filename.lower()
-        if not (file_extension.endswith('.csv') or file_extension.endswith('.xlsx') or file_extension.endswith('.xls') or file_extension.endswith('.pdf')):
+        if not file_extension.endswith(UPLOAD_EXTENSIONS):
             return jsonify({'error': 'Only CSV, Excel, and PDF files are allowed'}), 400
 
         # Получаем параметры пагинации
-        page = request.args.get('page', 1, type=int)
-        page_size = request.args.get('page_size', 1000, type=int)
-        
-        # Ограничиваем размер страницы
-        page_size = min(page_size, 5000)  # Максимум 5000 строк на страницу
-
-        # Сохраняем файл во временную директорию
+        page, page_size = _page_params()
         filename = secure_filename(file.filename) if file.filename else 'uploaded_file.csv'
-        temp_file_name = os.path.join(tempfile.gettempdir(), filename)
-        file.save(temp_file_name)
-        
-        # Определяем тип файла и обрабатываем соответственно
-        file_extension = file.filename.lower()
-        
-        if file_extension.endswith('.csv'):
-            df = process_csv(temp_file_name)
-        elif file_extension.endswith(('.xlsx', '.xls')):
-            df = process_excel(temp_file_name)
-        elif file_extension.endswith('.pdf'):
-            df = process_pdf(temp_file_name)
-        else:
-            return jsonify({'error': 'Unsupported file format'}), 400
-            
-        if df.empty:
+        sheet = request.args.get('sheet') or request.form.get('sheet')
+
+        if _is_async():
+            # Файл передаётся задаче под уникальным именем; задача удалит его сама
+            fd, job_file_name = tempfile.mkstemp(prefix='upload-', suffix=os.path.splitext(filename)[1])
+            os.close(fd)
+            file.save(job_file_name)
+            return _job_accepted(job_queue.submit('upload', {
+                'path': job_file_name, 'file_extension': file_extension, 'filename': filename, 'sheet': sheet
+            }))
+
+        # CSV разбирается прямо из потока запроса: небольшой файл Werkzeug держит в памяти
+        # (UploadRequest), большой — во временном файле, копия на диск не нужна
+        source: CsvSource = file.stream
+        if not file_extension.endswith('.csv'):
+            # Excel и PDF читаются по пути; уникальное имя — одноимённые загрузки не пересекаются
+            fd, temp_file_name = tempfile.mkstemp(prefix='upload-', suffix=os.path.splitext(filename)[1])
+            os.close(fd)
+            with span('save'):
+                file.save(temp_file_name)
+            source = temp_file_name
+
+        try:
+            entry, workbook = _ingest_upload(source, file_extension, filename, sheet)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if entry is None:
             return jsonify({'error': 'Не удалось извлечь данные из файла'}), 400
-        
-        # Вычисляем общее количество строк
-        total_rows = len(df)
-        total_pages = (total_rows + page_size - 1) // page_size
-        
-        logger.debug(f"Total rows: {total_rows}, Total pages: {total_pages}")
-        logger.debug(f"Page: {page}, Page size: {page_size}")
-        
-        # Применяем пагинацию
-        start_idx = (page - 1) * page_size
-        end_idx = start_idx + page_size
-        df_page = df.iloc[start_idx:end_idx]
-        
-        # Преобразуем DataFrame в список словарей
-        records = df_page.to_dict('records')
-        
-        # Проверяем целостность данных и заменяем NaN на null
-        required_fields = ['year', 'make', 'model', 'trim', 'body', 'transmission', 'vin', 'state', 'condition', 'odometer', 'color', 'interior', 'seller', 'mmr', 'sellingprice', 'saledate']
-        
-        for record in records:
-            for field in required_fields:
-                if field not in record or pd.isna(record[field]):
-                    if field == 'condition':
-                        record[field] = 0.0
-                    elif field in ['year', 'odometer', 'mmr', 'sellingprice']:
-                        record[field] = 0
-                    else:
-                        record[field] = None
-                elif pd.isna(record[field]):
-                    # Заменяем NaN на null для JSON совместимости
-                    if field == 'condition':
-                        record[field] = 0.0
-                    elif field in ['year', 'odometer', 'mmr', 'sellingprice']:
-                        record[field] = 0
-                    else:
-                        record[field] = None
-
-        # Выполняем базовый анализ для всех данных
-        basic_analysis = perform_basic_analysis(df)
-
-        # Формируем ответ
-        response = {
-            'table_data': records,
-            'columns': df.columns.tolist(),
-            'total_rows': total_rows,
-            'current_page': page,
-            'page_size': page_size,
-            'total_pages': total_pages,
-            'basic_analysis': basic_analysis
-        }
 
-        logger.debug(f"Sending response with {len(records)} records")
-        logger.debug(f"Response keys: {list(response.keys())}")
-        
-        return jsonify(response)
+        logger.debug("Sending page %s of dataset %s", page, entry.dataset_id)
+        return _page_response(entry, page, page_size, workbook)
 
     except Exception as e:
         logger.error(f"Error processing file: {str(e)}")
@@ -262,49 +434,529 @@ def upload_file():
             except Exception as e:
                 logger.error(f"Error removing temp file: {str(e)}")
 
-@app.route('/api/analyze', methods=['POST'])
+@api.route('/api/uploads', methods=['POST'])
+def upload_init():
+    """Начинает загрузку файла частями: {filename, size, chunk_size?} → upload_id, размер и число частей."""
+    try:
+        data = request.get_json()
+        if not data or not data.get('filename') or not isinstance(data.get('size'), int):
+            return jsonify({'error': 'Missing required fields'}), 400
+        if not data['filename'].lower().endswith(UPLOAD_EXTENSIONS):
+            return jsonify({'error': 'Only CSV, Excel, and PDF files are allowed'}), 400
+        try:
+            status = upload_store.create(data['filename'], data['size'], data.get('chunk_size'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(status), 201, {'Location': f"/api/uploads/{status['upload_id']}"}
+    except Exception as e:
+        logger.exception("Error starting upload")
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id: str):
+    """Состояние загрузки: после обрыва клиент досылает части из missing."""
+    try:
+        return jsonify(upload_store.status(upload_id))
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+
+@api.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def upload_discard(upload_id: str):
+    """Прерывает загрузку и удаляет принятые части."""
+    try:
+        upload_store.discard(upload_id)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    return jsonify({'upload_id': upload_id, 'status': 'discarded'})
+
+@api.route('/api/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id: str, index: int):
+    """Принимает часть index (тело запроса — её байты); повтор части безопасен."""
+    try:
+        try:
+            with span('save'):
+                result = upload_store.write_chunk(upload_id, index, request.stream,
+                                                  request.headers.get('X-Chunk-SHA256'))
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(result)
+    except Exception as e:
+        logger.exception("Error receiving upload chunk")
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def upload_complete(upload_id: str):
+    """
+    Завершает загрузку и разбирает собранный файл без копирования: ответ как у /api/upload
+    (страница page или фоновая задача при async). 409 — приняты не все части.
+    """
+    path = None
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            status = upload_store.status(upload_id)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+        if status['missing']:
+            return jsonify({'error': 'Получены не все части файла', **status}), 409
+
+        with span('hash'):
+            path, original_name, dataset_id = upload_store.finish(upload_id)
+        file_extension = original_name.lower()
+        filename = secure_filename(original_name) or 'uploaded_file.csv'
+        sheet = request.args.get('sheet') or data.get('sheet')
+
+        if _is_async():
+            # Собранный файл переходит задаче; она удалит его сама
+            job_path, path = path, None
+            return _job_accepted(job_queue.submit('upload', {
+                'path': job_path, 'file_extension': file_extension, 'filename': filename, 'sheet': sheet,
+                'dataset_id': dataset_id
+            }))
+
+        page, page_size = _page_params()
+        try:
+            entry, workbook = _ingest_upload(path, file_extension, filename, sheet, dataset_id=dataset_id)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 400
+        if entry is None:
+            return jsonify({'error': 'Не удалось извлечь данные из файла'}), 400
+        return _page_response(entry, page, page_size, workbook)
+
+    except Exception as e:
+        logger.exception("Error completing upload")
+        return jsonify({'error': str(e)}), 500
+
+    finally:
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except Exception as e:
+                logger.error(f"Error removing temp file: {str(e)}")
+
+@api.route('/api/workbooks/<file_id>/sheets', methods=['GET'])
+def workbook_sheets(file_id: str):
+    """Список листов загруженной книги Excel."""
+    try:
+        workbook_path = workbook_store.get(file_id)
+        if workbook_path is None:
+            return jsonify({'error': 'Файл не найден или устарел. Загрузите файл заново'}), 404
+        return jsonify({'file_id': file_id, 'sheets': list_sheets(workbook_path)})
+    except Exception as e:
+        logger.exception("Error listing workbook sheets")
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/workbooks/<file_id>/sheets/<path:sheet>/rows', methods=['GET'])
+def workbook_sheet_rows(file_id: str, sheet: str):
+    """Страница строк выбранного листа; разобранные листы берутся из кэша датасетов."""
+    try:
+        workbook_path = workbook_store.get(file_id)
+        if workbook_path is None:
+            return jsonify({'error': 'Файл не найден или устарел. Загрузите файл заново'}), 404
+        sheets = list_sheets(workbook_path)
+        if sheet not in sheets:
+            return jsonify({'error': f'Лист "{sheet}" не найден в файле'}), 404
+
+        page, page_size = _page_params()
+        entry = _load_dataset(sheet_dataset_id(file_id, sheet), workbook_path, workbook_path.lower(),
+                              os.path.basename(workbook_path), sheet)
+        if entry is None:
+            return jsonify({'error': 'Не удалось извлечь данные из листа'}), 400
+
+        return _page_response(entry, page, page_size, {'file_id': file_id, 'sheets': sheets, 'sheet': sheet})
+    except Exception as e:
+        logger.exception("Error reading workbook sheet")
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/datasets/<dataset_id>/rows', methods=['GET'])
+def dataset_rows(dataset_id: str):
+    """Отдаёт страницу строк ранее загруженного датасета без повторного разбора файла."""
+    try:
+        entry = dataset_cache.get(dataset_id)
+        if entry is None:
+            return jsonify({'error': 'Датасет не найден или устарел. Загрузите файл заново'}), 404
+        page, page_size = _page_params()
+        return _page_response(entry, page, page_size)
+    except Exception as e:
+        logger.exception("Error reading dataset rows")
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/datasets/<dataset_id>/append', methods=['POST'])
+def dataset_append(dataset_id: str):
+    """
+    Дописывает строки к датасету и обновляет анализ только по новым строкам. Результат —
+    новый датасет со своим dataset_id; исходный (с хэшем загруженного файла) не меняется.
+    """
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get('rows'), list):
+            return jsonify({'error': 'Missing required fields'}), 400
+
+        entry = dataset_cache.append(dataset_id, pd.DataFrame(data['rows']))
+        if entry is None:
+            return jsonify({'error': 'Датасет не найден или устарел. Загрузите файл заново'}), 404
+
+        return jsonify({
+            'dataset_id': entry.dataset_id,
+            'parent_dataset_id': dataset_id,
+            'appended_rows': len(data['rows']),
+            'total_rows': len(entry.df),
+            'basic_analysis': entry.analysis
+        })
+    except Exception as e:
+        logger.exception("Error appending rows")
+        return jsonify({'error': str(e)}), 500
+
+def _query_dataset(entry: CachedDataset, query: Optional[dict]) -> QueryResult:
+    """Запрос к датасету; память индексов и кэша результатов учитывается в кэше датасетов."""
+    return query_dataset(entry, query, lambda nbytes: dataset_cache.charge(entry, nbytes))
+
+@api.route('/api/datasets/<dataset_id>/query', methods=['POST'])
+def dataset_query(dataset_id: str):
+    """
+    Фильтры, сортировка, группировка и top-N по датасету на сервере. Результат
+    отдаётся страницами (page, page_size) в тех же форматах, что и /rows.
+    """
+    try:
+        query = request.get_json(silent=True) or {}
+        entry = dataset_cache.get(dataset_id)
+        if entry is None:
+            return jsonify({'error': 'Датасет не найден или устарел. Загрузите файл заново'}), 404
+        with span('query'):
+            try:
+                result = _query_dataset(entry, query)
+            except QueryError as e:
+                return jsonify({'error': str(e)}), 400
+        page, page_size = _page_params()
+        return _page_response(entry, page, page_size, {'dataset_rows': len(entry.df)}, result=result)
+    except Exception as e:
+        logger.exception("Error querying dataset")
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/datasets/<dataset_id>/timeseries', methods=['POST'])
+def dataset_timeseries(dataset_id: str):
+    """
+    Временной ряд по датасету для графика: агрегаты по интервалам (resample) и
+    скользящему окну (rolling), каждый ряд прорежен LTTB до points точек.
+    """
+    try:
+        body = request.get_json(silent=True) or {}
+        entry = dataset_cache.get(dataset_id)
+        if entry is None:
+            return jsonify({'error': 'Датасет не найден или устарел. Загрузите файл заново'}), 404
+        with span('timeseries'):
+            try:
+                result = timeseries(entry, body)
+            except TimeSeriesError as e:
+                return jsonify({'error': str(e)}), 400
+        return _compressed_response(dumps({'dataset_id': dataset_id, **result}), 'application/json')
+    except Exception as e:
+        logger.exception("Error building time series")
+        return jsonify({'error': str(e)}), 500
+
+def _has_table(data: Optional[dict]) -> bool:
+    """В запросе есть таблица: строки table_data или ссылка на датасет dataset_id."""
+    return bool(data) and ('table_data' in data or 'dataset_id' in data)
+
+def _request_table(data: dict) -> Tuple[pd.DataFrame, Optional[dict]]:
+    """
+    Таблица, по которой работает запрос: датасет на сервере (dataset_id и необязательный
+    query) или присланные строки table_data. Вторым значением — готовый базовый анализ,
+    если это весь датасет. LookupError — датасета нет в кэше, QueryError — ошибка в query.
+    """
+    if 'dataset_id' not in data:
+        return pd.DataFrame(data['table_data']), None
+    entry = dataset_cache.get(data['dataset_id'])
+    if entry is None:
+        raise LookupError('Датасет не найден или устарел. Загрузите файл заново')
+    if not data.get('query'):
+        return entry.df, entry.analysis
+    with span('query'):
+        return _query_dataset(entry, data['query']).rows(), None
+
+def _table_string(table: Tuple[pd.DataFrame, Optional[dict]], models: List[str]) -> str:
+    """
+    Преобразует таблицу в сводку для промпта: статистика по колонкам и выборка строк.
+    Для нескольких моделей берётся самый строгий бюджет, чтобы промпт был общим (и кэшировался один раз).
+    """
+    df, analysis = table
+    with span('prompt'):
+        budget = min(token_budget(model) for model in models)
+        return build_table_prompt(df, analysis if analysis is not None else perform_basic_analysis(df), budget)
+
+def _run_analysis(provider: str, model: str, table: Tuple[pd.DataFrame, Optional[dict]], bypass_cache: bool = False,
+                  job: Optional[JobContext] = None, mode: str = 'single') -> dict:
+    """Анализ таблицы одной моделью; job — контекст фоновой задачи для прогресса."""
+    if job:
+        job.progress(0.1, 'Подготовка данных')
+    if mode == 'map_reduce':
+        df, analysis = table
+        with span('llm'):
+            result = map_reduce_analyzer.run(df, analysis if analysis is not None else perform_basic_analysis(df),
+                                             provider, model, not bypass_cache, job.progress if job else None)
+        logger.debug("Map-reduce analysis completed for %s:%s: %s", provider, model, result)
+        return {
+            'model': f"{provider}:{model}",
+            'analysis': result.pop('analysis'),
+            'map_reduce': result,
+            'timestamp': pd.Timestamp.now().isoformat()
+        }
+    table_string = _table_string(table, [model])
+    if job:
+        job.progress(0.2, f'Запрос к {provider}:{model}')
+
+    # Получаем анализ от выбранной LLM (повторный запрос по той же таблице отдаётся из кэша)
+    with span('llm'):
+        analysis = get_analysis(provider, model, table_string, use_cache=not bypass_cache)
+    logger.debug(f"Analysis completed for {provider}:{model}")
+    return {
+        'model': f"{provider}:{model}",
+        'analysis': analysis,
+        'timestamp': pd.Timestamp.now().isoformat()
+    }
+
+def _analyze_job(job: JobContext, payload: dict) -> dict:
+    return _run_analysis(payload['provider'], payload['model'], _request_table(payload),
+                         bool(payload.get('bypass_cache')), job, payload.get('mode', 'single'))
+
+@api.route('/api/analyze', methods=['POST'])
 def analyze():
     try:
         data = request.get_json()
-        if not data or 'provider' not in data or 'model' not in data or 'table_data' not in data:
+        if not data or 'provider' not in data or 'model' not in data or not _has_table(data):
             return jsonify({'error': 'Missing required fields'}), 400
+        mode = data.get('mode', 'single')
+        if mode not in ANALYSIS_MODES:
+            return jsonify({'error': f'Unknown mode: {mode}'}), 400
         
+        if _is_async():
+            # Для датасета на сервере в задачу попадает только ссылка и запрос, а не строки
+            return _job_accepted(job_queue.submit('analyze', {
+                key: data[key] for key in ('provider', 'model', 'table_data', 'dataset_id', 'query', 'bypass_cache', 'mode')
+                if key in data
+            }))
+
         provider = data['provider']
         model = data['model']
-        table_data = data['table_data']
         
         logger.debug(f"Received analysis request - Provider: {provider}, Model: {model}")
-        
-        # Преобразуем данные в строковый формат
-        df = pd.DataFrame(table_data)
-        table_string = df.to_string(index=False, max_rows=100)
-        
-        # Получаем анализ от выбранной LLM
-        analysis = get_analysis(provider, model, table_string)
-        
-        logger.debug(f"Analysis completed for {provider}:{model}")
+        try:
+            table = _request_table(data)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+        except QueryError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Возвращаем ответ в формате, ожидаемом фронтендом
-        return jsonify({
-            'model': f"{provider}:{model}",
-            'analysis': analysis,
-            'timestamp': pd.Timestamp.now().isoformat()
-        })
+        return jsonify(_run_analysis(provider, model, table, data.get('bypass_cache', False), mode=mode))
 
     except Exception as e:
         logger.exception("Error during analysis")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/report', methods=['POST'])
+def _sse(payload: dict) -> str:
+    """Одно событие Server-Sent Events."""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+@api.route('/api/analyze/stream', methods=['POST'])
+def analyze_stream():
+    """
+    Потоковый анализ: текст отчёта отдаётся событиями SSE по мере генерации.
+    Если клиент отключился, сервер закрывает генератор, а вместе с ним и поток к провайдеру.
+    """
+    try:
+        data = request.get_json()
+        if not data or 'provider' not in data or 'model' not in data or not _has_table(data):
+            return jsonify({'error': 'Missing required fields'}), 400
+
+        provider = data['provider']
+        model = data['model']
+        try:
+            table = _request_table(data)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+        except QueryError as e:
+            return jsonify({'error': str(e)}), 400
+        table_string = _table_string(table, [model])
+        use_cache = not data.get('bypass_cache', False)
+        logger.debug("Received streaming analysis request - Provider: %s, Model: %s", provider, model)
+
+        def generate():
+            try:
+                with closing(stream_analysis(provider, model, table_string, use_cache)) as chunks:
+                    for chunk in chunks:
+                        yield _sse({'type': 'delta', 'text': chunk})
+                yield _sse({'type': 'done', 'model': f"{provider}:{model}",
+                            'timestamp': pd.Timestamp.now().isoformat()})
+            except GeneratorExit:
+                logger.debug("Client disconnected, streaming analysis for %s:%s cancelled", provider, model)
+                raise
+            except Exception as e:
+                logger.exception("Error during streaming analysis")
+                yield _sse({'type': 'error', 'error': str(e)})
+
+        return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    except Exception as e:
+        logger.exception("Error during streaming analysis")
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """Анализ одной таблицы сразу несколькими провайдерами/моделями; результаты отдаются NDJSON по мере готовности."""
+    try:
+        data = request.get_json()
+        if not data or 'targets' not in data or not _has_table(data):
+            return jsonify({'error': 'Missing required fields'}), 400
+        error = validate_targets(data['targets'])
+        if error:
+            return jsonify({'error': error}), 400
+
+        targets = data['targets']
+        timeout = data.get('timeout')
+        if timeout is not None:
+            try:
+                timeout = float(timeout)
+            except (TypeError, ValueError):
+                timeout = None
+            if timeout is None or not 0 < timeout < math.inf:
+                return jsonify({'error': 'timeout must be a positive number of seconds'}), 400
+        try:
+            table = _request_table(data)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+        except QueryError as e:
+            return jsonify({'error': str(e)}), 400
+        table_string = _table_string(table, [target['model'] for target in targets])
+        use_cache = not data.get('bypass_cache', False)
+        logger.debug("Received batch analysis request for %s targets", len(targets))
+
+        def generate():
+            for result in batch_analyzer.run(table_string, targets, timeout, use_cache):
+                yield json.dumps(result, ensure_ascii=False) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    except Exception as e:
+        logger.exception("Error during batch analysis")
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Счётчики кэшей: ответов LLM и распарсенных датасетов."""
+    return jsonify({
+        'llm_responses': response_cache.stats(),
+        'reports': report_renderer.cache.stats(),
+        'datasets': {
+            'entries': len(dataset_cache),
+            'total_bytes': dataset_cache.total_bytes,
+            'hits': dataset_cache.hits,
+            'misses': dataset_cache.misses
+        }
+    })
+
+def _render_report(data: dict) -> bytes:
+    """
+    Создаёт PDF из присланного HTML или, если передан dataset_id, из шаблона
+    по закэшированному датасету и ответам моделей. LookupError — датасета нет в кэше.
+    """
+    if data.get('report_html'):
+        with span('render'):
+            return report_renderer.render(data['report_html'])
+
+    entry = dataset_cache.get(data['dataset_id'])
+    if entry is None:
+        raise LookupError('Датасет не найден или устарел. Загрузите файл заново')
+    analyses = data.get('analyses')
+    if analyses is None:
+        analyses = [{'model': data.get('model'), 'analysis': data.get('analysis', '')}]
+    with span('render'):
+        return report_renderer.render(build_report_html(entry, analyses, data.get('title')), shared_css=True)
+
+def _report_job(job: JobContext, payload: dict) -> FileResult:
+    job.progress(0.1, 'Рендер PDF')
+    pdf = _render_report(payload)
+    if not pdf:
+        raise ValueError('Failed to generate PDF')
+    return FileResult(pdf, 'application/pdf', 'analysis-report.pdf')
+
+def _ratio(hits: float, misses: float) -> float:
+    return hits / (hits + misses) if hits + misses else 0.0
+
+def _component_metrics():
+    """Счётчики кэшей и очереди задач в момент экспорта метрик."""
+    llm = response_cache.stats()
+    reports = report_renderer.cache.stats()
+    page_cache = pdf_extractor.page_cache
+    caches = {
+        'llm_memory': (llm['memory_hits'], 0),
+        'llm_disk': (llm['disk_hits'], 0),
+        'llm': (llm['memory_hits'] + llm['disk_hits'], llm['misses']),
+        'datasets': (dataset_cache.hits, dataset_cache.misses),
+        'reports': (reports['hits'], reports['misses']),
+        'pdf_pages': (page_cache.hits, page_cache.misses),
+    }
+    yield ('analyzer_cache_hits_total', 'counter', 'Cache hits by cache',
+           [({'cache': name}, hits) for name, (hits, _) in caches.items()])
+    yield ('analyzer_cache_misses_total', 'counter', 'Cache misses by cache',
+           [({'cache': name}, misses) for name, (_, misses) in caches.items() if not name.startswith('llm_')])
+    yield ('analyzer_cache_hit_ratio', 'gauge', 'Cache hit ratio since start',
+           [({'cache': name}, _ratio(hits, misses)) for name, (hits, misses) in caches.items()
+            if not name.startswith('llm_')])
+    yield ('analyzer_cache_bytes', 'gauge', 'Bytes held in memory by cache',
+           [({'cache': 'datasets'}, dataset_cache.total_bytes), ({'cache': 'reports'}, reports['total_bytes'])])
+    jobs = job_queue.stats()['types']
+    yield ('analyzer_jobs_running', 'gauge', 'Background jobs running by type',
+           [({'type': name}, state['running']) for name, state in jobs.items()])
+    yield ('analyzer_jobs_queued', 'gauge', 'Background jobs waiting by type',
+           [({'type': name}, state['queued']) for name, state in jobs.items()])
+    yield ('analyzer_llm_circuit_state', 'gauge', 'LLM circuit breaker state: 0 closed, 1 half open, 2 open',
+           [({'provider': name}, BREAKER_STATES[state]) for name, state in breaker_states().items()])
+
+REGISTRY.collector(_component_metrics)
+
+@api.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Метрики в текстовом формате Prometheus."""
+    return Response(REGISTRY.expose(), content_type=PROMETHEUS_MIMETYPE)
+
+@api.route('/api/profile', methods=['GET'])
+def profile():
+    """
+    Выборочный профиль всех потоков сервера за seconds секунд в «свёрнутом» формате
+    (flamegraph.pl, speedscope). Доступен только при PROFILER_ENABLED=true.
+    """
+    if not profiler_enabled():
+        return jsonify({'error': 'Profiler is disabled'}), 404
+    seconds = request.args.get('seconds', 10.0, type=float)
+    interval = request.args.get('interval', 0.01, type=float)
+    folded = SamplingProfiler(interval).run(seconds)
+    if folded is None:
+        return jsonify({'error': 'Профилирование уже запущено'}), 409
+    return Response(folded, mimetype='text/plain')
+
+@api.route('/api/report', methods=['POST'])
 def generate_report():
     try:
         data = request.get_json()
-        if not data or 'report_html' not in data:
+        if not data or ('report_html' not in data and 'dataset_id' not in data):
             return jsonify({'error': 'Missing report HTML'}), 400
+        if 'report_html' not in data and not isinstance(data.get('analyses', []), list):
+            return jsonify({'error': 'analyses must be a list'}), 400
+
+        if _is_async():
+            return _job_accepted(job_queue.submit('report', {
+                key: data[key] for key in ('report_html', 'dataset_id', 'analyses', 'analysis', 'model', 'title')
+                if key in data
+            }))
 
-        # Создаем PDF из HTML
-        html = HTML(string=data['report_html'])
-        pdf = html.write_pdf()
+        try:
+            pdf = _render_report(data)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
 
         # Отправляем PDF
         if pdf:
@@ -321,40 +973,128 @@ def generate_report():
         logger.exception("Error generating report")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/fill-missing-ai', methods=['POST'])
+@api.route('/api/jobs', methods=['GET'])
+def jobs_stats():
+    """Загрузка очереди фоновых задач по типам."""
+    return jsonify(job_queue.stats())
+
+@api.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id: str):
+    """Статус, прогресс и результат фоновой задачи."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Задача не найдена или её результат устарел'}), 404
+    return jsonify(job)
+
+@api.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id: str):
+    """Файл-результат задачи (PDF отчёта); JSON-результаты приходят в статусе задачи."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Задача не найдена или её результат устарел'}), 404
+    result_file = job_queue.result_file(job_id)
+    if result_file is None:
+        return jsonify({'error': 'У задачи нет готового файла-результата', 'status': job['status']}), 409
+    path, mimetype, filename = result_file
+    return send_file(path, mimetype=mimetype, as_attachment=True, download_name=filename)
+
+@api.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def job_cancel(job_id: str):
+    """Отмена задачи: ждущая отменяется сразу, выполняющаяся — при следующей проверке."""
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Задача не найдена или её результат устарел'}), 404
+    return jsonify(job)
+
+@api.route('/api/fill-missing-ai', methods=['POST'])
 def fill_missing_ai():
     try:
         data = request.get_json()
-        if not data or 'table_data' not in data or 'columns' not in data or 'missing_info' not in data:
+        if not _has_table(data) or ('dataset_id' not in data and ('columns' not in data or 'missing_info' not in data)):
             return jsonify({'error': 'Missing required fields'}), 400
-        table_data = data['table_data']
-        columns = data['columns']
-        missing_info = data['missing_info']
-        df = pd.DataFrame(table_data)
-        recommendations = {}
-        for col in missing_info:
-            recs = []
-            for idx, row in df[df[col].isna() | (df[col] == '')].iterrows():
-                mask = pd.Series([True] * len(df))
-                matched_fields = []
-                for c in columns:
-                    if c != col and pd.notna(row[c]) and row[c] != '':
-                        mask = mask & (df[c] == row[c])
-                        matched_fields.append(c)
-                candidates = df[mask & df[col].notna() & (df[col] != '')]
-                if not candidates.empty:
-                    value = candidates[col].mode().iloc[0]
-                    explanation = f"В похожих строках с такими же {', '.join(f'{c}={row[c]}' for c in matched_fields)} чаще всего встречается '{value}'."
-                    recs.append({'row_idx': int(idx), 'suggested': value, 'confidence': 1.0, 'explanation': explanation})
-                else:
-                    value = df[col].mode().iloc[0] if not df[col].mode().empty else None
-                    explanation = "Нет похожих строк, поэтому выбрано самое частое значение по всей колонке." if value is not None else "Нет данных для подсказки."
-                    recs.append({'row_idx': int(idx), 'suggested': value, 'confidence': 0.5, 'explanation': explanation})
-            recommendations[col] = recs
+        try:
+            df, _ = _request_table(data)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+        except QueryError as e:
+            return jsonify({'error': str(e)}), 400
+        # Для датасета на сервере колонки и список колонок с пропусками можно не передавать;
+        # row_idx в ответе — номер строки в датасете, в том числе для результата query
+        columns = data.get('columns') or df.columns.tolist()
+        missing_info = data.get('missing_info')
+        if missing_info is None:
+            missing_info = [column for column in columns if missing_mask(df[column]).any()]
+        # Для числовых колонок можно выбрать медиану или ближайших соседей вместо моды
+        numeric_strategy = data.get('numeric_strategy', 'mode')
+        if numeric_strategy not in NUMERIC_STRATEGIES:
+            return jsonify({'error': f'Unknown numeric_strategy: {numeric_strategy}'}), 400
+        recommendations = suggest_fill_values(df, columns, missing_info, numeric_strategy)
         return jsonify({'recommendations': recommendations})
     except Exception as e:
         logger.exception('Error in fill-missing-ai')
         return jsonify({'error': str(e)}), 500
 
+job_queue.register('upload', _upload_job, concurrency_from_env('upload', 2), cleanup=_discard_upload_file)
+job_queue.register('analyze', _analyze_job, concurrency_from_env('analyze', 4))
+job_queue.register('report', _report_job, concurrency_from_env('report', 1))
+
+def warm_up() -> None:
+    """
+    Импортирует модули, которые иначе грузятся при первом обращении (SDK провайдеров,
+    разбор PDF, шаблоны отчётов). В мастере gunicorn с preload_app воркеры получают
+    их через fork уже загруженными и делят страницы памяти.
+    """
+    for module in ('requests', 'openai', 'gigachat', 'gigachat.models', 'pdfplumber', 'jinja2'):
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            logger.debug("Warm-up: %s is not available: %s", module, e)
+
+def start_worker() -> None:
+    """Запускает фоновую работу процесса: очередь задач. В prefork-сервере вызывается в каждом воркере после fork."""
+    job_queue.recover()
+
+def stop_worker() -> None:
+    """Останавливает фоновую работу процесса; проба готовности начинает отвечать 503."""
+    job_queue.shutdown()
+    pdf_extractor.shutdown()
+    report_renderer.shutdown()
+
+class UploadRequest(Request):
+    """Запрос, в котором небольшие файлы формы не пишутся во временный файл (см. UPLOAD_MEMORY_BYTES)."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= UPLOAD_MEMORY_BYTES:
+            return BytesIO()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+def create_app() -> Flask:
+    """
+    Создаёт Flask-приложение. Компоненты (кэши, пулы, очередь задач) общие для процесса
+    и создаются при импорте модуля без потоков и соединений, поэтому модуль можно
+    импортировать в мастере prefork-сервера до fork; фоновую работу запускает start_worker().
+    """
+    app = Flask(__name__)
+    app.request_class = UploadRequest
+
+    # Настраиваем максимальный размер файла (100 МБ)
+    app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100 MB
+
+    # Настраиваем CORS более специфично
+    CORS(app, resources={
+        r"/api/*": {
+            "origins": ["http://localhost:3000"],
+            "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+            "allow_headers": ["Content-Type", "X-Chunk-SHA256"]
+        }
+    })
+
+    app.register_blueprint(api)
+    return app
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Отладочный сервер. С перезагрузчиком модуль выполняется и в наблюдающем процессе —
+    # задачи запускаем только в процессе, который обслуживает запросы
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_worker()
+    create_app().run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,3 @@
+from .cache import DatasetCache, CachedDataset, compute_dataset_id, create_dataset_cache_from_env
+
+__all__ = ['DatasetCache', 'CachedDataset', 'compute_dataset_id', 'create_dataset_cache_from_env']
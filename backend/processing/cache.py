@@ -0,0 +1,302 @@
+# Серверный кэш распарсенных датасетов: пагинация не должна заново разбирать файл
+import os
+import copy
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO, Dict, Optional
+
+import pandas as pd
+
+from .ingest import concat_frames
+from .stats import DatasetStats
+
+if TYPE_CHECKING:
+    from .query import DatasetIndex
+    from .timeseries import TimeSeriesIndex
+
+logger = logging.getLogger(__name__)
+
+_HASH_CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+
+def compute_dataset_id(stream: BinaryIO, extension: str = '') -> str:
+    """
+    Считает идентификатор датасета по содержимому файла.
+    Расширение участвует в хэше: одинаковые байты в .csv и .xlsx разбираются по-разному.
+    """
+    hasher = hashlib.sha256(extension.lower().encode('utf-8'))
+    for chunk in iter(lambda: stream.read(_HASH_CHUNK_SIZE), b''):
+        hasher.update(chunk)
+    return hasher.hexdigest()[:32]
+
+
+def compute_file_dataset_id(path: str, extension: str = '') -> str:
+    """Считает идентификатор датасета для файла на диске."""
+    with open(path, 'rb') as f:
+        return compute_dataset_id(f, extension)
+
+
+def derived_dataset_id(parent_id: str, rows: pd.DataFrame) -> str:
+    """
+    Идентификатор датасета, полученного дописыванием строк rows к parent_id. Хэш
+    файла остаётся за самим файлом: повторная загрузка того же файла даёт исходный датасет.
+    """
+    hasher = hashlib.sha256(parent_id.encode('utf-8'))
+    hasher.update(rows.to_json(orient='split', index=False, date_format='iso').encode('utf-8'))
+    return hasher.hexdigest()[:32]
+
+
+def frame_nbytes(df: pd.DataFrame) -> int:
+    """Оценивает объём памяти DataFrame в байтах (с учётом строк)."""
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+@dataclass
+class CachedDataset:
+    """Распарсенный датасет и его базовый анализ."""
+    dataset_id: str
+    df: pd.DataFrame
+    analysis: dict
+    filename: str = ''
+    # Память датасета вместе с индексами запросов и их кэшем результатов (DatasetCache.charge)
+    nbytes: int = 0
+    # Накопители статистики для дозаписи строк; после восстановления со spill-диска отсутствуют
+    stats: Optional[DatasetStats] = None
+    created_at: float = field(default_factory=time.time)
+    last_access: float = field(default_factory=time.time)
+    # Индексы колонок для запросов (processing.query); строятся при первом запросе
+    query_index: Optional['DatasetIndex'] = field(default=None, repr=False)
+    # Колонка времени и индексы по времени (processing.timeseries); строятся при первом запросе ряда
+    time_column: Optional[str] = None
+    timeseries_index: Dict[str, 'TimeSeriesIndex'] = field(default_factory=dict, repr=False)
+
+
+class DatasetCache:
+    """
+    Ограниченный по памяти LRU-кэш датасетов с TTL.
+
+    При вытеснении датасет может сбрасываться в локальную директорию (Parquet),
+    откуда поднимается обратно при следующем обращении. С write_through датасет
+    пишется туда сразу при сохранении: несколько воркеров сервера с общей
+    директорией находят датасеты, загруженные через соседей.
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: float, spill_dir: Optional[str] = None,
+                 write_through: bool = False):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self.write_through = write_through and self.spill_dir is not None
+        if self.spill_dir:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+        self._entries: 'OrderedDict[str, CachedDataset]' = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+        # Дозапись строк читает датасет и пишет производный; вытеснение и чтение её не ждут
+        self._append_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, dataset_id: str) -> bool:
+        return self.get(dataset_id) is not None
+
+    def get(self, dataset_id: str) -> Optional[CachedDataset]:
+        """Возвращает датасет из памяти или со spill-диска; None если его нет или он устарел."""
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(dataset_id)
+            if entry is not None:
+                self._entries.move_to_end(dataset_id)
+                entry.last_access = time.time()
+                self.hits += 1
+                if self.write_through:
+                    # Обращение через этот воркер продлевает TTL копии на диске для соседей
+                    self._touch_spilled(dataset_id)
+                return entry
+
+            entry = self._load_spilled(dataset_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._insert(entry)
+            return entry
+
+    def put(self, dataset_id: str, df: pd.DataFrame, analysis: dict, filename: str = '',
+            stats: Optional[DatasetStats] = None) -> CachedDataset:
+        """Кладёт датасет в кэш, при необходимости вытесняя давно не использованные."""
+        entry = CachedDataset(
+            dataset_id=dataset_id,
+            df=df,
+            analysis=analysis,
+            filename=filename,
+            nbytes=frame_nbytes(df),
+            stats=stats,
+        )
+        if self.write_through:
+            self._spill(entry)
+        with self._lock:
+            self._drop(dataset_id)
+            self._insert(entry)
+        return entry
+
+    def append(self, dataset_id: str, rows: pd.DataFrame) -> Optional[CachedDataset]:
+        """
+        Дописывает строки к датасету: результат — новый датасет со своим идентификатором,
+        исходный не меняется. Колонки, которых нет в датасете, отбрасываются; статистика
+        обновляется только по новым строкам, на копии накопителей исходного датасета.
+        None — исходного датасета нет в кэше.
+        """
+        with self._append_lock:
+            entry = self.get(dataset_id)
+            if entry is None:
+                return None
+            rows = rows.reindex(columns=entry.df.columns)
+            stats = copy.deepcopy(entry.stats) if entry.stats is not None else DatasetStats.from_frame(entry.df)
+            stats.update(rows)
+            df = concat_frames([entry.df, rows])
+            return self.put(derived_dataset_id(dataset_id, rows), df, stats.to_analysis(df), entry.filename, stats)
+
+    def charge(self, entry: CachedDataset, nbytes: int) -> None:
+        """
+        Добавляет к размеру датасета память построенных по нему структур (nbytes может быть
+        отрицательным), чтобы её видело вытеснение. Датасет, уже вытесненный из памяти,
+        общий объём кэша не меняет.
+        """
+        with self._lock:
+            entry.nbytes += nbytes
+            if self._entries.get(entry.dataset_id) is entry:
+                self._total_bytes += nbytes
+                self._evict()
+
+    def remove(self, dataset_id: str) -> None:
+        """Удаляет датасет из памяти и со spill-диска."""
+        with self._lock:
+            self._drop(dataset_id)
+            self._remove_spilled(dataset_id)
+
+    def _insert(self, entry: CachedDataset) -> None:
+        self._entries[entry.dataset_id] = entry
+        self._total_bytes += entry.nbytes
+        self._evict()
+
+    def _drop(self, dataset_id: str) -> Optional[CachedDataset]:
+        entry = self._entries.pop(dataset_id, None)
+        if entry is not None:
+            self._total_bytes -= entry.nbytes
+        return entry
+
+    def _evict(self) -> None:
+        # Последний вставленный датасет не вытесняем, даже если он один больше лимита
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            dataset_id, entry = next(iter(self._entries.items()))
+            self._drop(dataset_id)
+            if not self.write_through:
+                self._spill(entry)
+            logger.debug("Dataset %s evicted from memory cache", dataset_id)
+
+    def _expire(self) -> None:
+        deadline = time.time() - self.ttl_seconds
+        expired = [key for key, entry in self._entries.items() if entry.last_access < deadline]
+        for dataset_id in expired:
+            self._drop(dataset_id)
+            # Общую копию на диске соседние воркеры могли использовать позже
+            if not self.write_through or self._spilled_before(dataset_id, deadline):
+                self._remove_spilled(dataset_id)
+            logger.debug("Dataset %s expired", dataset_id)
+
+    # --- spill на диск ---
+
+    def _spill_paths(self, dataset_id: str):
+        assert self.spill_dir is not None
+        return self.spill_dir / f"{dataset_id}.parquet", self.spill_dir / f"{dataset_id}.json"
+
+    def _spill(self, entry: CachedDataset) -> None:
+        if not self.spill_dir:
+            return
+        data_path, meta_path = self._spill_paths(entry.dataset_id)
+        # Пишем во временные файлы и переименовываем: соседний воркер не прочтёт недописанный
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        data_tmp, meta_tmp = data_path.with_name(data_path.name + suffix), meta_path.with_name(meta_path.name + suffix)
+        try:
+            entry.df.to_parquet(data_tmp, index=False)
+            meta = {'analysis': entry.analysis, 'filename': entry.filename, 'created_at': entry.created_at}
+            meta_tmp.write_text(json.dumps(meta, ensure_ascii=False, default=str), encoding='utf-8')
+            os.replace(data_tmp, data_path)
+            os.replace(meta_tmp, meta_path)
+        except Exception as e:
+            for path in (data_tmp, meta_tmp):
+                path.unlink(missing_ok=True)
+            # Parquet требует pyarrow и строковых имён колонок — без них просто не сохраняем
+            logger.warning("Не удалось сохранить датасет %s на диск: %s", entry.dataset_id, e)
+            self._remove_spilled(entry.dataset_id)
+
+    def _load_spilled(self, dataset_id: str) -> Optional[CachedDataset]:
+        if not self.spill_dir:
+            return None
+        data_path, meta_path = self._spill_paths(dataset_id)
+        if not data_path.exists() or not meta_path.exists():
+            return None
+        if time.time() - os.path.getmtime(meta_path) > self.ttl_seconds:
+            self._remove_spilled(dataset_id)
+            return None
+        try:
+            df = pd.read_parquet(data_path)
+            meta = json.loads(meta_path.read_text(encoding='utf-8'))
+        except Exception as e:
+            logger.warning("Не удалось прочитать датасет %s с диска: %s", dataset_id, e)
+            self._remove_spilled(dataset_id)
+            return None
+        logger.debug("Dataset %s restored from spill directory", dataset_id)
+        return CachedDataset(
+            dataset_id=dataset_id,
+            df=df,
+            analysis=meta.get('analysis', {}),
+            filename=meta.get('filename', ''),
+            nbytes=frame_nbytes(df),
+            created_at=meta.get('created_at', time.time()),
+        )
+
+    def _touch_spilled(self, dataset_id: str) -> None:
+        try:
+            os.utime(self._spill_paths(dataset_id)[1])
+        except OSError:
+            pass
+
+    def _spilled_before(self, dataset_id: str, deadline: float) -> bool:
+        try:
+            return os.path.getmtime(self._spill_paths(dataset_id)[1]) < deadline
+        except OSError:
+            return True
+
+    def _remove_spilled(self, dataset_id: str) -> None:
+        if not self.spill_dir:
+            return
+        for path in self._spill_paths(dataset_id):
+            try:
+                path.unlink(missing_ok=True)
+            except OSError as e:
+                logger.error("Error removing spilled dataset file %s: %s", path, e)
+
+
+def create_dataset_cache_from_env() -> DatasetCache:
+    """Создаёт кэш датасетов по переменным окружения DATASET_CACHE_*."""
+    max_mb = float(os.getenv("DATASET_CACHE_MAX_MB", "512"))
+    ttl = float(os.getenv("DATASET_CACHE_TTL", "3600"))
+    spill_dir = os.getenv("DATASET_CACHE_SPILL_DIR") or None
+    write_through = os.getenv("DATASET_CACHE_WRITE_THROUGH", "false").lower() == "true"
+    return DatasetCache(max_bytes=int(max_mb * 1024 * 1024), ttl_seconds=ttl, spill_dir=spill_dir,
+                        write_through=write_through)
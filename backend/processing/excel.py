@@ -0,0 +1,232 @@
+# Потоковое чтение Excel: построчный проход по выбранному листу без загрузки всей книги
+import os
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .ingest import CATEGORY_MAX_RATIO, CHUNK_ROWS, TEXT_DTYPE, ChunkConsumer, concat_frames, downcast_numeric
+
+logger = logging.getLogger(__name__)
+
+try:
+    # Читатель на Rust: в разы быстрее openpyxl и читает и .xlsx, и .xls
+    from python_calamine import CalamineWorkbook
+except ImportError:  # необязательная зависимость
+    CalamineWorkbook = None
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+
+
+def excel_engine() -> str:
+    """Движок чтения Excel: calamine, если установлен, иначе openpyxl."""
+    return 'calamine' if CalamineWorkbook is not None else 'openpyxl'
+
+
+def list_sheets(path: str) -> List[str]:
+    """Имена листов книги в порядке следования."""
+    if CalamineWorkbook is not None:
+        workbook = CalamineWorkbook.from_path(path)
+        try:
+            return list(workbook.sheet_names)
+        finally:
+            workbook.close()
+    if path.lower().endswith('.xls'):
+        return list(pd.ExcelFile(path).sheet_names)
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True)
+    try:
+        return list(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+
+def sheet_dataset_id(file_id: str, sheet: str) -> str:
+    """Идентификатор датасета отдельного листа книги."""
+    return hashlib.sha256(f"{file_id}\0{sheet}".encode('utf-8')).hexdigest()[:32]
+
+
+def _iter_rows(path: str, sheet: str) -> Iterator[list]:
+    if CalamineWorkbook is not None:
+        workbook = CalamineWorkbook.from_path(path)
+        try:
+            # calamine отдаёт пустые ячейки как '' — приводим к None, как openpyxl
+            for row in workbook.get_sheet_by_name(sheet).iter_rows():
+                yield [None if value == '' else value for value in row]
+        finally:
+            workbook.close()
+        return
+
+    from openpyxl import load_workbook
+
+    # read_only: строки читаются из XML по мере обхода, книга целиком в память не грузится
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for row in workbook[sheet].iter_rows(values_only=True):
+            yield list(row)
+    finally:
+        workbook.close()
+
+
+def _header(row: list) -> list:
+    """Заголовок как у pd.read_excel: пустые имена — 'Unnamed: i', повторы — 'name.1'."""
+    names = []
+    seen = {}
+    for i, value in enumerate(row):
+        name = f"Unnamed: {i}" if value is None else value
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _column(values: tuple, as_category: Optional[bool]) -> pd.Series:
+    """
+    Колонка чанка из значений ячеек. Текст переводится в category (если значений
+    мало) или str через factorize — это на порядок быстрее вывода типов по объектам.
+    as_category=None — решить по доле уникальных значений.
+    """
+    values = np.array(values, dtype=object)
+    if pd.api.types.infer_dtype(values, skipna=True) == 'string':
+        codes, uniques = pd.factorize(values)
+        if as_category is None:
+            as_category = len(uniques) <= CATEGORY_MAX_RATIO * np.count_nonzero(codes >= 0)
+        if as_category:
+            return pd.Series(pd.Categorical.from_codes(codes, categories=pd.Index(uniques, dtype=TEXT_DTYPE)))
+        return pd.Series(values, dtype=object).astype(TEXT_DTYPE)
+    series = pd.Series(values, dtype=object).infer_objects()
+    # Excel хранит все числа как float: целые значения возвращаем в int, как pd.read_excel
+    if pd.api.types.is_float_dtype(series) and series.notna().all() and (series % 1 == 0).all():
+        series = series.astype('int64')
+    return series
+
+
+def _frame(rows: List[list], columns: list, categories: Dict[int, bool]) -> pd.DataFrame:
+    """Собирает чанк по колонкам; categories запоминает выбор category/str по первому чанку."""
+    data = {}
+    for i, values in enumerate(zip(*rows)):
+        series = _column(values, categories.get(i))
+        categories.setdefault(i, isinstance(series.dtype, pd.CategoricalDtype))
+        data[i] = series
+    df = pd.DataFrame(data)
+    df.columns = pd.Index(columns, dtype=object) if columns else df.columns
+    return df
+
+
+def read_excel_chunked(path: str, sheet: Optional[str] = None,
+                       consumers: Iterable[ChunkConsumer] = (),
+                       chunksize: int = CHUNK_ROWS) -> pd.DataFrame:
+    """
+    Читает лист Excel за один построчный проход.
+
+    Первая строка — заголовок, полностью пустые строки пропускаются. Каждые
+    chunksize строк собираются в DataFrame и передаются потребителям (накопителям
+    статистики), как при чтении CSV; низкокардинальные текстовые колонки первого
+    чанка становятся category. Без calamine .xls читается через pd.read_excel.
+    """
+    sheet = sheet or list_sheets(path)[0]
+    consumers = list(consumers)
+
+    if CalamineWorkbook is None and path.lower().endswith('.xls'):
+        df = pd.read_excel(path, sheet_name=sheet)
+        for consume in consumers:
+            consume(df)
+        return df
+
+    columns = None
+    rows: List[list] = []
+    chunks: List[pd.DataFrame] = []
+    categories: Dict[int, bool] = {}
+
+    def flush():
+        chunk = _frame(rows, columns, categories)
+        for consume in consumers:
+            consume(chunk)
+        chunks.append(chunk)
+        rows.clear()
+
+    for row in _iter_rows(path, sheet):
+        if all(value is None for value in row):
+            continue
+        if columns is None:
+            columns = _header(row)
+            continue
+        if len(row) != len(columns):
+            row = (row + [None] * len(columns))[:len(columns)]
+        rows.append(row)
+        if len(rows) >= chunksize:
+            flush()
+    if rows:
+        flush()
+
+    if not chunks:
+        return pd.DataFrame(columns=columns or [])
+    df = downcast_numeric(concat_frames(chunks))
+    logger.debug("Excel sheet %r read with %s in %s chunks. Shape: %s", sheet, excel_engine(), len(chunks), df.shape)
+    return df
+
+
+class WorkbookStore:
+    """
+    Хранилище загруженных книг Excel по хэшу файла: переключение листа не требует
+    повторной загрузки файла. Книги старше TTL удаляются.
+    """
+
+    def __init__(self, directory: str, ttl_seconds: float):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+
+    def _paths(self, file_id: str) -> List[Path]:
+        return [self.directory / f"{file_id}{ext}" for ext in EXCEL_EXTENSIONS]
+
+    def put(self, file_id: str, source_path: str, extension: str) -> str:
+        """Копирует книгу в хранилище и возвращает путь к ней."""
+        target = self.directory / f"{file_id}{extension.lower()}"
+        with self._lock:
+            self._purge()
+            if not target.exists():
+                shutil.copyfile(source_path, target)
+            else:
+                os.utime(target)
+        return str(target)
+
+    def get(self, file_id: str) -> Optional[str]:
+        """Путь к сохранённой книге или None, если её нет или она устарела."""
+        with self._lock:
+            self._purge()
+            for path in self._paths(file_id):
+                if path.exists():
+                    os.utime(path)
+                    return str(path)
+        return None
+
+    def _purge(self) -> None:
+        deadline = time.time() - self.ttl_seconds
+        for path in self.directory.iterdir():
+            try:
+                if path.suffix in EXCEL_EXTENSIONS and path.stat().st_mtime < deadline:
+                    path.unlink()
+            except OSError as e:
+                logger.error("Error removing stored workbook %s: %s", path, e)
+
+
+def create_workbook_store_from_env() -> WorkbookStore:
+    """Создаёт хранилище книг по переменным окружения EXCEL_STORE_*."""
+    default_dir = os.path.join(tempfile.gettempdir(), 'multi-llm-analyzer', 'workbooks')
+    return WorkbookStore(
+        directory=os.getenv("EXCEL_STORE_DIR") or default_dir,
+        ttl_seconds=float(os.getenv("EXCEL_STORE_TTL", os.getenv("DATASET_CACHE_TTL", "3600"))),
+    )
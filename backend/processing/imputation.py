@@ -0,0 +1,273 @@
+# Подсказки для заполнения пропусков: моды по группам похожих строк вместо перебора строк
+import logging
+import warnings
+from typing import Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .analysis import _to_python
+
+logger = logging.getLogger(__name__)
+
+NUMERIC_STRATEGIES = ('mode', 'median', 'knn')
+# Сколько ближайших строк берётся для числовых колонок в режиме knn
+KNN_NEIGHBOURS = 5
+# Размер блока строк с пропусками при расчёте расстояний (ограничивает память матрицы расстояний)
+KNN_BLOCK_ROWS = 256
+
+
+def missing_mask(series: pd.Series) -> pd.Series:
+    """Пропуск — это NaN/None или пустая строка."""
+    return series.isna() | (series == '')
+
+
+def _compact(key: np.ndarray, cardinality: int) -> np.ndarray:
+    """Перенумеровывает ключи, если следующее умножение на cardinality может переполнить int64."""
+    if len(key) and int(key.max()) >= (1 << 62) // max(cardinality, 1):
+        key = np.unique(key, return_inverse=True)[1].astype(np.int64)
+    return key
+
+
+def _as_number(value, integral: bool):
+    if value is None or pd.isna(value):
+        return None
+    return int(round(value)) if integral else float(value)
+
+
+class _EncodedFrame:
+    """Колонки DataFrame в виде целочисленных кодов (-1 — пропуск) для быстрых группировок в numpy."""
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.codes: Dict[str, np.ndarray] = {}
+        self.uniques: Dict[str, np.ndarray] = {}
+        self.values: Dict[str, np.ndarray] = {}
+        for column in df.columns:
+            series = df[column]
+            cleaned = series.where(~missing_mask(series))
+            try:
+                # Отсортированные коды: при равных частотах побеждает наименьшее значение, как у mode()
+                codes, uniques = pd.factorize(cleaned, sort=True)
+            except TypeError:
+                codes, uniques = pd.factorize(cleaned, sort=False)
+            self.codes[column] = codes.astype(np.int64)
+            self.uniques[column] = np.asarray(uniques, dtype=object)
+            self.values[column] = series.to_numpy(dtype=object)
+        self._keys: Dict[tuple, np.ndarray] = {}
+
+    def present(self, column: str) -> np.ndarray:
+        return self.codes[column] >= 0
+
+    def group_key(self, subset: Sequence[str]) -> np.ndarray:
+        """Номер комбинации значений subset для каждой строки."""
+        subset = tuple(subset)
+        if subset not in self._keys:
+            key = np.zeros(len(self.df), dtype=np.int64)
+            for column in subset:
+                cardinality = len(self.uniques[column]) + 1
+                key = _compact(key, cardinality) * cardinality + (self.codes[column] + 1)
+            self._keys[subset] = key
+        return self._keys[subset]
+
+
+class _ColumnImputer:
+    """Подбор значений для одной колонки: группировка по ключам с откатом к их подмножествам."""
+
+    def __init__(self, encoded: _EncodedFrame, column: str, keys: List[str],
+                 cardinality: Dict[str, int], strategy: str):
+        self.encoded = encoded
+        self.df = encoded.df
+        self.column = column
+        self.keys = keys
+        self.cardinality = cardinality
+        self.donor_mask = encoded.present(column)
+        self.targets = pd.to_numeric(self.df[column].where(self.donor_mask), errors='coerce').to_numpy(dtype='float64')
+        self.numeric = strategy != 'mode' and self._donors_numeric()
+        self.strategy = strategy if self.numeric else 'mode'
+        self.integral = self.numeric and bool((self.targets[self.donor_mask] % 1 == 0).all())
+        self._tables: Dict[tuple, tuple] = {}
+        self.recommendations: Dict[int, dict] = {}
+
+    def _donors_numeric(self) -> bool:
+        donors = self.targets[self.donor_mask]
+        return len(donors) > 0 and not np.isnan(donors).any()
+
+    def _table(self, subset: List[str]) -> tuple:
+        """Отсортированные ключи групп и значение (код моды или медиана) для каждой группы."""
+        key = tuple(subset)
+        if key in self._tables:
+            return self._tables[key]
+        valid = self.donor_mask.copy()
+        for column in subset:
+            valid &= self.encoded.present(column)
+        group = self.encoded.group_key(subset)[valid]
+
+        if self.strategy == 'median':
+            values = self.targets[valid]
+            order = np.lexsort((values, group))
+            group, values = group[order], values[order]
+            starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+            sizes = np.diff(np.r_[starts, len(group)])
+            table = (group[starts], (values[starts + (sizes - 1) // 2] + values[starts + sizes // 2]) / 2)
+        else:
+            values = self.encoded.codes[self.column][valid]
+            n_values = len(self.encoded.uniques[self.column])
+            # Ключи групп перенумеровываются подряд, чтобы пара (группа, значение) поместилась в int64
+            group_keys, group_ids = np.unique(group, return_inverse=True)
+            pairs, counts = np.unique(group_ids.ravel() * n_values + values, return_counts=True)
+            group, values = group_keys[pairs // n_values], pairs % n_values
+            # Внутри группы: сначала самое частое значение, при равенстве — с меньшим кодом
+            order = np.lexsort((values, -counts, group))
+            group, values = group[order], values[order]
+            first = np.r_[True, group[1:] != group[:-1]] if len(group) else np.zeros(0, dtype=bool)
+            table = (group[first], values[first])
+        self._tables[key] = table
+        return table
+
+    def _lookup(self, positions: np.ndarray, subset: List[str]) -> tuple:
+        """Находит группу каждой строки в таблице значений: маска найденных и их значения."""
+        table_keys, table_values = self._table(subset)
+        if len(table_keys) == 0:
+            return np.zeros(len(positions), dtype=bool), table_values
+        row_keys = self.encoded.group_key(subset)[positions]
+        slots = np.minimum(np.searchsorted(table_keys, row_keys), len(table_keys) - 1)
+        found = table_keys[slots] == row_keys
+        return found, table_values[slots[found]]
+
+    def _fallback_subsets(self, used: List[str]) -> List[List[str]]:
+        # Сначала все заполненные поля строки, затем по одному отбрасываем самые «уникальные» (vin и т.п.)
+        ordered = sorted(used, key=lambda c: self.cardinality[c])
+        return [ordered[:size] for size in range(len(ordered), 0, -1)]
+
+    def _suggested(self, value):
+        if self.strategy == 'median':
+            return _as_number(value, self.integral)
+        value = _to_python(self.encoded.uniques[self.column][value])
+        return _as_number(value, self.integral) if self.numeric else value
+
+    def _explanation(self, position: int, subset: List[str], value, partial: bool) -> str:
+        fields = ', '.join(f'{c}={self.encoded.values[c][position]}' for c in subset)
+        if self.strategy == 'median':
+            text = f"В похожих строках с такими же {fields} медиана равна '{value}'."
+        else:
+            text = f"В похожих строках с такими же {fields} чаще всего встречается '{value}'."
+        return text + (' Совпадение только по части полей.' if partial else '')
+
+    def _record(self, position: int, value, confidence: float, explanation: str) -> None:
+        self.recommendations[position] = {
+            'row_idx': int(self.df.index[position]),
+            'suggested': value,
+            'confidence': confidence,
+            'explanation': explanation,
+        }
+
+    def _fill_by_groups(self, positions: np.ndarray, used: List[str]) -> np.ndarray:
+        """Заполняет строки с одинаковым набором заполненных полей; возвращает оставшиеся без подсказки."""
+        remaining = positions
+        for level, subset in enumerate(self._fallback_subsets(used)):
+            if len(remaining) == 0:
+                break
+            found, values = self._lookup(remaining, subset)
+            confidence = 1.0 if level == 0 else round(0.5 + 0.5 * len(subset) / len(used), 2)
+            for position, value in zip(remaining[found], values):
+                value = self._suggested(value)
+                self._record(position, value, confidence,
+                             self._explanation(position, subset, value, partial=level > 0))
+            remaining = remaining[~found]
+        return remaining
+
+    def _fill_by_neighbours(self, positions: np.ndarray, features: List[str]) -> None:
+        """Медиана значения по ближайшим строкам в пространстве стандартизованных числовых признаков."""
+        matrix = self.df[features].apply(pd.to_numeric, errors='coerce').to_numpy(dtype='float64')
+        donor_positions = np.flatnonzero(self.donor_mask)
+        with warnings.catch_warnings():
+            # Полностью пустой признак даёт NaN — он обнуляется ниже
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mean = np.nanmean(matrix[donor_positions], axis=0)
+            std = np.nanstd(matrix[donor_positions], axis=0)
+        std[~(std > 0)] = 1.0
+        # Пропуски признаков — это среднее, то есть 0 после стандартизации
+        matrix = np.nan_to_num((matrix - mean) / std)
+
+        donors = matrix[donor_positions]
+        donor_norms = (donors ** 2).sum(axis=1)
+        targets = self.targets[donor_positions]
+        k = min(KNN_NEIGHBOURS, len(donors))
+
+        for start in range(0, len(positions), KNN_BLOCK_ROWS):
+            block_positions = positions[start:start + KNN_BLOCK_ROWS]
+            distances = donor_norms[None, :] - 2 * matrix[block_positions] @ donors.T
+            nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            for position, value in zip(block_positions, np.median(targets[nearest], axis=1)):
+                value = _as_number(value, self.integral)
+                self._record(position, value, 0.7,
+                             f"Медиана по {k} ближайшим строкам с похожими {', '.join(features)}: '{value}'.")
+
+    def _fill_by_column(self, positions: np.ndarray) -> None:
+        if self.strategy == 'median':
+            value = _as_number(np.median(self.targets[self.donor_mask]), self.integral) if self.donor_mask.any() else None
+            text = "Нет похожих строк, поэтому выбрана медиана по всей колонке."
+        else:
+            counts = np.bincount(self.encoded.codes[self.column][self.donor_mask],
+                                 minlength=len(self.encoded.uniques[self.column]))
+            value = self._suggested(int(np.argmax(counts))) if counts.sum() else None
+            text = "Нет похожих строк, поэтому выбрано самое частое значение по всей колонке."
+        explanation = text if value is not None else "Нет данных для подсказки."
+        for position in positions:
+            self._record(position, value, 0.5, explanation)
+
+    def run(self) -> List[dict]:
+        positions = np.flatnonzero(~self.donor_mask)
+        if len(positions) == 0:
+            return []
+
+        if self.strategy == 'knn' and self.donor_mask.any():
+            features = [k for k in self.keys if pd.api.types.is_numeric_dtype(self.df[k])]
+            if features:
+                self._fill_by_neighbours(positions, features)
+                return [self.recommendations[p] for p in positions]
+
+        remaining = [positions]
+        if self.keys and self.donor_mask.any():
+            # Строки группируются по набору заполненных ключевых полей: для каждого набора свои группировки
+            patterns = np.column_stack([self.encoded.present(k)[positions] for k in self.keys])
+            unique_patterns, inverse = np.unique(patterns, axis=0, return_inverse=True)
+            remaining = []
+            for number, pattern in enumerate(unique_patterns):
+                group = positions[inverse.ravel() == number]
+                used = [k for k, is_present in zip(self.keys, pattern) if is_present]
+                remaining.append(self._fill_by_groups(group, used) if used else group)
+        for part in remaining:
+            self._fill_by_column(part)
+        return [self.recommendations[p] for p in positions]
+
+
+def suggest_fill_values(df: pd.DataFrame, columns: Sequence[str], missing_info: Sequence[str],
+                        numeric_strategy: str = 'mode') -> Dict[str, List[dict]]:
+    """
+    Подбирает значения для пропусков по похожим строкам.
+
+    Колонки один раз кодируются целыми числами. Для каждой колонки с пропусками
+    строки с одинаковым набором заполненных полей обрабатываются вместе: мода
+    (или медиана) по группам считается одним проходом numpy и сопоставляется
+    строкам с пропусками через searchsorted. Если совпадений нет, ключи
+    отбрасываются по одному, начиная с самых уникальных, а в конце берётся мода
+    по всей колонке. numeric_strategy: 'mode', 'median' или 'knn' для числовых колонок.
+    """
+    if numeric_strategy not in NUMERIC_STRATEGIES:
+        raise ValueError(f"Неизвестная стратегия заполнения: {numeric_strategy}")
+    columns = [c for c in columns if c in df.columns]
+    encoded = _EncodedFrame(df)
+    cardinality = {c: len(encoded.uniques[c]) for c in columns}
+
+    recommendations = {}
+    for column in missing_info:
+        if column not in df.columns:
+            recommendations[column] = []
+            continue
+        keys = [c for c in columns if c != column]
+        imputer = _ColumnImputer(encoded, column, keys, cardinality, numeric_strategy)
+        recommendations[column] = imputer.run()
+        logger.debug("Imputation for %s: %s suggestions", column, len(recommendations[column]))
+    return recommendations
@@ -0,0 +1,240 @@
+# Потоковое чтение CSV: один проход по файлу чанками с ограниченным пиком памяти
+import csv
+import logging
+from dataclasses import dataclass, field
+from typing import BinaryIO, Callable, Iterable, List, Optional, Union
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from .timeseries import detect_datetime_format
+
+logger = logging.getLogger(__name__)
+
+# Размер образца для определения кодировки и разделителя
+SAMPLE_BYTES = 256 * 1024
+# Количество строк образца для вывода типов колонок
+SAMPLE_ROWS = 10000
+# Размер чанка при потоковом чтении
+CHUNK_ROWS = 100000
+# Строковая колонка становится категориальной, если доля уникальных значений в образце ниже порога
+CATEGORY_MAX_RATIO = 0.5
+
+# Тип текстовых колонок, который выводит read_csv: str в pandas 3, object в pandas 2
+# (там astype('str') превратил бы пропуски в строку 'None')
+TEXT_DTYPE = pd.Series(['']).dtype
+
+_ENCODINGS = ('utf-8', 'cp1251')
+_DELIMITERS = ',;\t|'
+
+ChunkConsumer = Callable[[pd.DataFrame], None]
+# Путь к файлу или двоичный поток с seek (небольшой файл из запроса, не записанный на диск)
+CsvSource = Union[str, BinaryIO]
+
+
+@dataclass
+class CsvFormat:
+    """Параметры CSV, определённые по образцу файла."""
+    encoding: str = 'utf-8'
+    delimiter: str = ','
+    category_columns: List[str] = field(default_factory=list)
+    # Имена колонок файла без заголовка (column_1, column_2, ...); None — первая строка и есть заголовок
+    names: Optional[List[str]] = None
+
+
+def detect_encoding(sample: bytes) -> str:
+    """Определяет кодировку по образцу: UTF-8, иначе cp1251."""
+    for encoding in _ENCODINGS:
+        # Образец мог оборваться посреди многобайтового символа — отрезаем хвост
+        for cut in range(4):
+            try:
+                sample[:len(sample) - cut].decode(encoding)
+                return encoding
+            except UnicodeDecodeError:
+                continue
+    raise ValueError("Не удалось определить кодировку файла")
+
+
+def detect_delimiter(text: str) -> str:
+    """Определяет разделитель по образцу текста, по умолчанию запятая."""
+    lines = text.splitlines()[:50]
+    if not lines:
+        return ','
+    try:
+        return csv.Sniffer().sniff('\n'.join(lines), delimiters=_DELIMITERS).delimiter
+    except csv.Error:
+        return ','
+
+
+def _read_sample(source: CsvSource) -> bytes:
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return f.read(SAMPLE_BYTES)
+    sample = source.read(SAMPLE_BYTES)
+    source.seek(0)
+    return sample
+
+
+def has_header(sample_df: pd.DataFrame) -> bool:
+    """
+    Есть ли у CSV заголовок, по образцу, прочитанному с первой строкой в роли заголовка.
+    Заголовка нет, если в каждой колонке с числами или датами её «имя» — тоже число или
+    дата того же формата (журналы измерений вида "21.07.2023 02:55","147","80").
+    Таблица из одного текста считается таблицей с заголовком, как и раньше.
+    """
+    typed = False
+    for name in sample_df.columns:
+        series = sample_df[name]
+        if series.dropna().empty:
+            continue
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            typed = True
+            if pd.isna(pd.to_numeric(str(name), errors='coerce')):
+                return True
+            continue
+        fmt = detect_datetime_format(series)
+        if fmt is not None:
+            typed = True
+            if pd.isna(pd.to_datetime(pd.Series([str(name)]), format=fmt, errors='coerce', utc=True).iloc[0]):
+                return True
+    return not typed
+
+
+def sniff_csv_format(source: CsvSource, encoding: Optional[str] = None) -> CsvFormat:
+    """Читает образец файла и определяет кодировку, разделитель, заголовок и категориальные колонки."""
+    sample = _read_sample(source)
+    detected = encoding is None
+    encoding = encoding or detect_encoding(sample)
+    text = sample.decode(encoding, errors='ignore')
+    csv_format = CsvFormat(encoding=encoding, delimiter=detect_delimiter(text))
+
+    try:
+        sample_df = pd.read_csv(source, encoding=encoding, sep=csv_format.delimiter, nrows=SAMPLE_ROWS)
+    except UnicodeDecodeError:
+        # Строки образца длиннее байтового образца, и дальше в них уже не UTF-8
+        if not detected or encoding != _ENCODINGS[0]:
+            raise
+        if not isinstance(source, str):
+            source.seek(0)
+        return sniff_csv_format(source, _ENCODINGS[1])
+    except pd.errors.EmptyDataError:
+        return csv_format
+    finally:
+        if not isinstance(source, str):
+            source.seek(0)
+
+    if not has_header(sample_df):
+        csv_format.names = [f'column_{i + 1}' for i in range(len(sample_df.columns))]
+    for position, column in enumerate(sample_df.columns):
+        series = sample_df[column]
+        if pd.api.types.is_numeric_dtype(series) or series.dropna().empty:
+            continue
+        if series.nunique() <= CATEGORY_MAX_RATIO * series.notna().sum():
+            csv_format.category_columns.append(csv_format.names[position] if csv_format.names else column)
+    return csv_format
+
+
+def downcast_numeric(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Уменьшает целочисленные колонки до минимального подходящего типа.
+    Float не трогаем: float32 исказил бы значения в JSON-ответе.
+    """
+    for column in df.columns:
+        if pd.api.types.is_integer_dtype(df[column]) and not pd.api.types.is_bool_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast='integer')
+    return df
+
+
+def concat_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Склеивает чанки одного датасета, сохраняя категориальные колонки первого чанка.
+    У чанков разные наборы категорий: объединяем их, иначе concat откатится к object.
+    """
+    if len(frames) == 1:
+        return frames[0]
+    first = frames[0]
+    category_columns = [c for c in first.columns if isinstance(first[c].dtype, pd.CategoricalDtype)]
+    merged = {}
+    for column in category_columns:
+        categories_dtype = first[column].cat.categories.dtype
+        parts = [frame[column] if isinstance(frame[column].dtype, pd.CategoricalDtype)
+                 else frame[column].astype(categories_dtype).astype('category') for frame in frames]
+        merged[column] = union_categoricals(parts, ignore_order=True)
+    df = pd.concat([frame.drop(columns=category_columns) for frame in frames], ignore_index=True)
+    for column, values in merged.items():
+        df[column] = values
+    return df[first.columns]
+
+
+def _read_chunks(source: CsvSource, csv_format: CsvFormat, chunksize: int, consumers: List[ChunkConsumer],
+                 chunks: List[pd.DataFrame], consumed: List[pd.DataFrame] = ()) -> None:
+    """
+    Читает CSV чанками в chunks, передавая каждый потребителям. consumed — чанки,
+    уже переданные им при прошлом проходе в другой кодировке: повторно они не
+    передаются и должны прочитаться так же, иначе в файле смешаны кодировки.
+    """
+    reader = pd.read_csv(
+        source,
+        encoding=csv_format.encoding,
+        sep=csv_format.delimiter,
+        header=None if csv_format.names else 'infer',
+        names=csv_format.names,
+        dtype={column: 'category' for column in csv_format.category_columns},
+        chunksize=chunksize,
+        memory_map=isinstance(source, str),
+    )
+    with reader:
+        for chunk in reader:
+            index = len(chunks)
+            if index < len(consumed):
+                if not chunk.equals(consumed[index]):
+                    raise ValueError("В файле смешаны кодировки UTF-8 и cp1251")
+            else:
+                for consume in consumers:
+                    consume(chunk)
+            chunks.append(chunk)
+
+
+def read_csv_chunked(source: CsvSource, encoding: Optional[str] = None,
+                     consumers: Iterable[ChunkConsumer] = (),
+                     chunksize: int = CHUNK_ROWS) -> pd.DataFrame:
+    """
+    Читает CSV за один потоковый проход.
+
+    Кодировка и разделитель определяются по образцу, низкокардинальные строковые
+    колонки сразу читаются как category. Каждый чанк передаётся потребителям
+    (например, накопителям статистики) до склейки. source — путь (файл читается
+    через отображение в память) или поток с seek. Файл, который перестаёт быть
+    UTF-8 после образца, перечитывается в cp1251.
+    """
+    csv_format = sniff_csv_format(source, encoding)
+    logger.debug("CSV format: encoding=%s, delimiter=%r, header=%s, categories=%s", csv_format.encoding,
+                 csv_format.delimiter, csv_format.names is None, csv_format.category_columns)
+
+    consumers = list(consumers)
+    chunks: List[pd.DataFrame] = []
+    try:
+        try:
+            _read_chunks(source, csv_format, chunksize, consumers, chunks)
+        except UnicodeDecodeError:
+            # Образец — UTF-8, а дальше в файле cp1251 (латинский заголовок и первые строки,
+            # русский текст ниже): весь проход повторяется в cp1251, байты не заменяются
+            if csv_format.encoding != _ENCODINGS[0]:
+                raise ValueError("Не удалось определить кодировку файла")
+            logger.info("CSV is not UTF-8 past the sample, re-reading as %s", _ENCODINGS[1])
+            if not isinstance(source, str):
+                source.seek(0)
+            consumed, chunks = chunks, []
+            csv_format.encoding = _ENCODINGS[1]
+            try:
+                _read_chunks(source, csv_format, chunksize, consumers, chunks, consumed)
+            except UnicodeDecodeError:
+                raise ValueError("Не удалось определить кодировку файла")
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame()
+
+    if not chunks:
+        return pd.DataFrame()
+    df = downcast_numeric(concat_frames(chunks))
+    logger.debug("CSV read in %s chunks. Shape: %s", len(chunks), df.shape)
+    return df
@@ -0,0 +1,229 @@
+# Извлечение таблиц из PDF по всем страницам: пакеты страниц в пуле процессов и кэш страниц
+import os
+import json
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Таблица страницы — список строк, строка — список ячеек (None для пустых)
+Table = List[List[Optional[str]]]
+
+# Меньше страниц разбираем в текущем процессе: запуск пакета в пуле дороже
+PAGE_BATCH = 8
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _extract_pages(path: str, page_numbers: List[int]) -> Dict[int, List[Table]]:
+    """Разбирает страницы одного пакета. Выполняется в процессе пула, поэтому только picklable-данные."""
+    import pdfplumber
+
+    result = {}
+    with pdfplumber.open(path) as pdf:
+        for number in page_numbers:
+            page = pdf.pages[number]
+            result[number] = page.extract_tables()
+            # pdfplumber держит разобранные объекты страницы до закрытия документа
+            page.close()
+    return result
+
+
+class PageCache:
+    """
+    Кэш таблиц страниц по (хэш файла, номер страницы): LRU в памяти
+    и, если задана директория, JSON-файлы на диске.
+    """
+
+    def __init__(self, max_pages: int, cache_dir: Optional[str] = None):
+        self.max_pages = max_pages
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._pages: 'OrderedDict[Tuple[str, int], List[Table]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, file_hash: str, number: int) -> Path:
+        assert self.cache_dir is not None
+        return self.cache_dir / f"{file_hash}-{number}.json"
+
+    def get(self, file_hash: str, number: int) -> Optional[List[Table]]:
+        key = (file_hash, number)
+        with self._lock:
+            tables = self._pages.get(key)
+            if tables is not None:
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return tables
+        if self.cache_dir:
+            path = self._path(file_hash, number)
+            try:
+                tables = json.loads(path.read_text(encoding='utf-8'))
+            except FileNotFoundError:
+                tables = None
+            except (OSError, ValueError) as e:
+                logger.warning("Не удалось прочитать кэш страницы %s: %s", path, e)
+                tables = None
+            if tables is not None:
+                with self._lock:
+                    self.hits += 1
+                    self._remember(key, tables)
+                return tables
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, file_hash: str, number: int, tables: List[Table]) -> None:
+        with self._lock:
+            self._remember((file_hash, number), tables)
+        if self.cache_dir:
+            try:
+                self._path(file_hash, number).write_text(json.dumps(tables, ensure_ascii=False), encoding='utf-8')
+            except OSError as e:
+                logger.warning("Не удалось сохранить кэш страницы %s/%s: %s", file_hash, number, e)
+
+    def _remember(self, key: Tuple[str, int], tables: List[Table]) -> None:
+        self._pages[key] = tables
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+
+
+def _normalize_row(row: List[Optional[str]]) -> Tuple[str, ...]:
+    return tuple(' '.join(str(cell).split()).lower() if cell is not None else '' for cell in row)
+
+
+def stitch_tables(pages: List[List[Table]]) -> List[Table]:
+    """
+    Склеивает таблицы, продолжающиеся на следующих страницах.
+
+    Таблица считается продолжением текущей, если её первая строка повторяет
+    заголовок (повтор отбрасывается), либо если это первая таблица страницы,
+    у неё столько же колонок, а текущая таблица была последней на предыдущей странице.
+    """
+    stitched: List[Table] = []
+    current: Optional[Table] = None
+    current_header: Tuple[str, ...] = ()
+    current_on_last = False  # текущая таблица закончилась последней на своей странице
+
+    for tables in pages:
+        tables = [table for table in tables if table]
+        for position, table in enumerate(tables):
+            first_on_page = position == 0
+            if current is not None and _normalize_row(table[0]) == current_header:
+                current.extend(table[1:])
+            elif (current is not None and first_on_page and current_on_last
+                  and len(table[0]) == len(current[0])):
+                current.extend(table)
+            else:
+                current = [list(row) for row in table]
+                current_header = _normalize_row(table[0])
+                stitched.append(current)
+            current_on_last = position == len(tables) - 1
+        if not tables:
+            current_on_last = False
+    return stitched
+
+
+def table_to_frame(table: Table) -> pd.DataFrame:
+    """Первая строка таблицы становится заголовком, пустые имена — Column_i."""
+    headers = [f"Column_{i}" if cell is None else str(cell) for i, cell in enumerate(table[0])]
+    width = len(headers)
+    # Строки продолжения могут быть шире или уже заголовка — выравниваем
+    rows = [(row + [None] * width)[:width] for row in table[1:]]
+    return pd.DataFrame(rows, columns=pd.Index(headers))
+
+
+class PdfExtractor:
+    """
+    Извлекает таблицы со всех страниц PDF.
+
+    pdfplumber тратит процессорное время на Python-коде и держит GIL, поэтому
+    страницы разбираются пакетами в пуле процессов. Уже разобранные страницы
+    берутся из PageCache по хэшу файла.
+    """
+
+    def __init__(self, workers: int, page_batch: int, page_cache: PageCache):
+        self.workers = max(workers, 1)
+        self.page_batch = max(page_batch, 1)
+        self.page_cache = page_cache
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn, а не fork: сервер многопоточный, а fork копирует только текущий поток
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def extract_pages(self, path: str, file_hash: str) -> List[List[Table]]:
+        """Возвращает таблицы каждой страницы по порядку."""
+        import pdfplumber
+
+        with pdfplumber.open(path) as pdf:
+            page_count = len(pdf.pages)
+
+        pages: Dict[int, List[Table]] = {}
+        missing = []
+        for number in range(page_count):
+            tables = self.page_cache.get(file_hash, number)
+            if tables is None:
+                missing.append(number)
+            else:
+                pages[number] = tables
+        logger.debug("PDF %s: %s pages, %s from cache", file_hash, page_count, page_count - len(missing))
+
+        batches = [missing[i:i + self.page_batch] for i in range(0, len(missing), self.page_batch)]
+        if self.workers == 1 or len(batches) <= 1:
+            parsed = [_extract_pages(path, batch) for batch in batches]
+        else:
+            parsed = list(self._pool().map(_extract_pages, [path] * len(batches), batches))
+        for batch_result in parsed:
+            for number, tables in batch_result.items():
+                self.page_cache.put(file_hash, number, tables)
+                pages[number] = tables
+
+        return [pages[number] for number in range(page_count)]
+
+    def extract(self, path: str, file_hash: str) -> pd.DataFrame:
+        """Склеивает таблицы всех страниц и возвращает самую большую как DataFrame."""
+        tables = stitch_tables(self.extract_pages(path, file_hash))
+        if not tables:
+            return pd.DataFrame()
+        largest = max(tables, key=len)
+        logger.debug("PDF %s: %s tables after stitching, largest has %s rows", file_hash, len(tables), len(largest) - 1)
+        return table_to_frame(largest)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+
+
+def create_pdf_extractor_from_env() -> PdfExtractor:
+    """Создаёт извлекатель таблиц PDF по переменным окружения PDF_*."""
+    return PdfExtractor(
+        workers=_env_int("PDF_WORKERS", os.cpu_count() or 1),
+        page_batch=_env_int("PDF_PAGE_BATCH", PAGE_BATCH),
+        page_cache=PageCache(
+            max_pages=_env_int("PDF_PAGE_CACHE_MAX_PAGES", 5000),
+            cache_dir=os.getenv("PDF_PAGE_CACHE_DIR") or None,
+        ),
+    )
@@ -0,0 +1,439 @@
+# Запросы к датасету на сервере: фильтры, сортировка, группировка и top-N без передачи строк клиенту
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_datetime64_any_dtype, is_numeric_dtype
+
+from .cache import frame_nbytes
+
+logger = logging.getLogger(__name__)
+
+FILTER_OPS = ('eq', 'ne', 'lt', 'le', 'gt', 'ge', 'between', 'in', 'not_in',
+              'contains', 'startswith', 'is_null', 'not_null')
+AGGREGATES = ('count', 'size', 'sum', 'mean', 'min', 'max', 'median', 'nunique')
+# Сколько последних результатов запросов хранится у датасета (листание страниц одного запроса);
+# у строк хранятся только позиции, поэтому результат без limit — 4 байта на строку датасета
+RESULT_CACHE_SIZE = 16
+
+
+class QueryError(ValueError):
+    """Некорректный запрос: неизвестная колонка, операция или значение."""
+
+
+def _sorted_dictionary(codes: np.ndarray, uniques) -> Tuple[np.ndarray, pd.Index]:
+    """Переставляет словарь по возрастанию значений, чтобы коды были плотными рангами."""
+    uniques = pd.Index(uniques)
+    try:
+        permutation = np.argsort(uniques.to_numpy(), kind='stable')
+    except TypeError:
+        # Смешанные типы в колонке (числа и строки) сравниваем как строки
+        permutation = np.argsort(uniques.astype(str).to_numpy(), kind='stable')
+    if (permutation == np.arange(len(permutation))).all():
+        return codes, uniques
+    remap = np.empty(len(permutation) + 1, dtype=codes.dtype)
+    remap[permutation] = np.arange(len(permutation), dtype=codes.dtype)
+    remap[-1] = -1
+    return remap[codes], uniques[permutation]
+
+
+class ColumnIndex:
+    """
+    Индексы одной колонки: словарь значений (отсортированные уникальные значения и
+    код каждой строки — он же плотный ранг, -1 — пропуск) и порядок строк по
+    возрастанию значения. Строятся один раз при первом запросе к колонке; фильтр
+    по значению или диапазону дальше берёт срез порядка без прохода по колонке.
+    """
+
+    def __init__(self, series: pd.Series):
+        dtype = series.dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+        else:
+            codes, uniques = pd.factorize(series, sort=False)
+        codes, self.uniques = _sorted_dictionary(np.asarray(codes, dtype=np.int32), uniques)
+        self.codes = codes
+        self.numeric = is_numeric_dtype(dtype) and not is_bool_dtype(dtype)
+        self.datetime = is_datetime64_any_dtype(dtype)
+
+        # Стабильная сортировка кодов: строки с равными значениями идут в исходном порядке,
+        # пропуски (код -1) оказываются в начале и отрезаются
+        order = np.argsort(codes, kind='stable').astype(np.int32)
+        null_count = int((codes < 0).sum())
+        self.nulls = order[:null_count]
+        self.order = order[null_count:]
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.uniques))
+        # Строки со значением uniques[i] — order[offsets[i]:offsets[i + 1]]
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+        self._descending: Optional[np.ndarray] = None
+
+    @property
+    def nbytes(self) -> int:
+        descending = self._descending.nbytes if self._descending is not None else 0
+        return int(self.codes.nbytes + self.order.nbytes + self.nulls.nbytes + self.offsets.nbytes + descending)
+
+    def descending(self) -> np.ndarray:
+        """Порядок строк по убыванию значения; равные значения — в исходном порядке."""
+        if self._descending is None:
+            reversed_codes = (len(self.uniques) - 1) - self.codes[self.order]
+            self._descending = self.order[np.argsort(reversed_codes, kind='stable')]
+        return self._descending
+
+    def coerce(self, value: Any) -> Any:
+        """Приводит значение из запроса к типу колонки."""
+        if value is None:
+            raise QueryError('Use is_null/not_null to filter missing values')
+        try:
+            if self.datetime:
+                return pd.Timestamp(value)
+            if self.numeric:
+                return float(value)
+        except (TypeError, ValueError):
+            raise QueryError(f'Value {value!r} does not match the column type')
+        return value
+
+    def code_range(self, op: str, value: Any) -> Tuple[int, int]:
+        """Диапазон кодов [lo, hi), удовлетворяющих сравнению с value."""
+        if op == 'between':
+            if not isinstance(value, (list, tuple)) or len(value) != 2:
+                raise QueryError('between expects [low, high]')
+            return self._bound(value[0], 'left'), self._bound(value[1], 'right')
+        left, right = self._bound(value, 'left'), self._bound(value, 'right')
+        return {
+            'eq': (left, right),
+            'lt': (0, left),
+            'le': (0, right),
+            'gt': (right, len(self.uniques)),
+            'ge': (left, len(self.uniques)),
+        }[op]
+
+    def _bound(self, value: Any, side: str) -> int:
+        try:
+            return int(self.uniques.searchsorted(self.coerce(value), side=side))
+        except TypeError:
+            raise QueryError(f'Value {value!r} is not comparable with the column values')
+
+    def rows(self, lo: int, hi: int) -> np.ndarray:
+        """Позиции строк с кодами из [lo, hi) — срез отсортированного порядка."""
+        if hi <= lo:
+            return self.order[:0]
+        return self.order[self.offsets[lo]:self.offsets[hi]]
+
+    def value_codes(self, values: List[Any]) -> np.ndarray:
+        """Коды перечисленных значений; отсутствующие в колонке пропускаются."""
+        indexer = self.uniques.get_indexer(pd.Index([self.coerce(value) for value in values]).unique())
+        return indexer[indexer >= 0]
+
+    def matching_codes(self, op: str, value: Any) -> np.ndarray:
+        """Коды значений, текст которых содержит value или начинается с него (без учёта регистра)."""
+        if self.numeric or self.datetime:
+            raise QueryError(f'{op} is only supported for text columns')
+        text = self.uniques.astype(str).str.lower()
+        needle = str(value).lower()
+        matched = text.str.contains(needle, regex=False) if op == 'contains' else text.str.startswith(needle)
+        return np.flatnonzero(np.asarray(matched, dtype=bool))
+
+    def labels(self, codes: np.ndarray) -> pd.Series:
+        """Значения по кодам; код len(uniques) и -1 — пропуск."""
+        values = pd.Series(self.uniques.take(np.clip(codes, 0, max(len(self.uniques) - 1, 0)))
+                           if len(self.uniques) else [None] * len(codes))
+        return values.where((codes >= 0) & (codes < len(self.uniques)), None)
+
+
+class QueryResult:
+    """
+    Результат запроса. Для строк хранятся только их позиции в датасете, а строки
+    страницы берутся из датасета при ответе; для группировки — таблица групп.
+    """
+
+    def __init__(self, df: pd.DataFrame, positions: Optional[np.ndarray] = None,
+                 columns: Optional[List[str]] = None, groups: Optional[pd.DataFrame] = None):
+        self._df = df
+        self.positions = positions
+        self.groups = groups
+        self.columns: List[str] = groups.columns.tolist() if groups is not None else list(columns or [])
+
+    def __len__(self) -> int:
+        return len(self.groups) if self.groups is not None else len(self.positions)
+
+    @property
+    def nbytes(self) -> int:
+        return frame_nbytes(self.groups) if self.groups is not None else int(self.positions.nbytes)
+
+    def rows(self, start: int = 0, stop: Optional[int] = None) -> pd.DataFrame:
+        """Строки результата [start, stop); у строк сохраняется индекс датасета (номер строки)."""
+        if self.groups is not None:
+            return self.groups.iloc[start:stop]
+        return self._df.iloc[self.positions[start:stop]][self.columns]
+
+
+class DatasetIndex:
+    """
+    Индексы колонок датасета и кэш результатов последних запросов.
+
+    Индекс колонки строится при первом обращении к ней и живёт, пока датасет в кэше:
+    новые строки (append) создают новую запись кэша, а с ней и новый индекс.
+    on_resize получает изменение памяти индексов и кэша результатов в байтах —
+    так её учитывает кэш датасетов.
+    """
+
+    def __init__(self, df: pd.DataFrame, on_resize: Optional[Callable[[int], None]] = None):
+        self.df = df
+        self._columns: Dict[str, ColumnIndex] = {}
+        self._results: 'OrderedDict[str, QueryResult]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._on_resize = on_resize
+        self._charged = 0
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return self._nbytes()
+
+    def _nbytes(self) -> int:
+        return (sum(index.nbytes for index in self._columns.values())
+                + sum(result.nbytes for result in self._results.values()))
+
+    def _account(self) -> None:
+        """Сообщает on_resize, на сколько изменилась память с прошлого раза."""
+        with self._lock:
+            nbytes = self._nbytes()
+            delta, self._charged = nbytes - self._charged, nbytes
+        if delta and self._on_resize is not None:
+            self._on_resize(delta)
+
+    def column(self, name: str) -> ColumnIndex:
+        if name not in self.df.columns:
+            raise QueryError(f'Unknown column: {name}')
+        with self._lock:
+            index = self._columns.get(name)
+        if index is None:
+            # Строим вне блокировки: запросы по другим колонкам не ждут; дубликат при гонке безвреден
+            index = ColumnIndex(self.df[name])
+            with self._lock:
+                index = self._columns.setdefault(name, index)
+        return index
+
+    def query(self, query: Optional[dict]) -> QueryResult:
+        """Выполняет запрос и возвращает результат: позиции строк или группы с агрегатами."""
+        query = query or {}
+        if not isinstance(query, dict):
+            raise QueryError('Query must be an object')
+        key = json.dumps(query, sort_keys=True, ensure_ascii=False, default=str)
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                return result
+        try:
+            result = self._execute(query)
+            with self._lock:
+                self._results[key] = result
+                while len(self._results) > RESULT_CACHE_SIZE:
+                    self._results.popitem(last=False)
+        finally:
+            # Индексы колонок могли построиться и до ошибки в запросе
+            self._account()
+        return result
+
+    def _execute(self, query: dict) -> QueryResult:
+        unknown = set(query) - {'filters', 'sort', 'group_by', 'aggregates', 'columns', 'limit', 'offset'}
+        if unknown:
+            raise QueryError(f'Unknown query fields: {", ".join(sorted(unknown))}')
+        columns = query.get('columns')
+        if columns is not None and not isinstance(columns, list):
+            raise QueryError('columns must be a list')
+        positions = self._filter(query.get('filters') or [])
+        sort = [_sort_key(item) for item in _as_list(query.get('sort'))]
+        group_by = _as_list(query.get('group_by'))
+        aggregates = _as_list(query.get('aggregates'))
+
+        if group_by or aggregates:
+            result = self._aggregate(positions, group_by, aggregates)
+            if sort:
+                for column, _ in sort:
+                    if column not in result.columns:
+                        raise QueryError(f'Unknown sort column: {column}')
+                result = result.sort_values([column for column, _ in sort],
+                                            ascending=[not descending for _, descending in sort],
+                                            kind='stable', na_position='last', ignore_index=True)
+            # columns выбирает колонки результата: ключи group_by и имена агрегатов
+            columns = _projection(columns, result.columns)
+            return QueryResult(self.df, groups=_slice(result[columns], query))
+
+        columns = _projection(columns, self.df.columns)
+        positions = _slice(self._sort(positions, sort), query)
+        if positions.base is not None:
+            # Срез top-N не должен удерживать в кэше массив всех отобранных строк
+            positions = positions.copy()
+        # Строки не копируются: страница берётся из датасета по позициям при ответе
+        return QueryResult(self.df, positions, columns)
+
+    def _filter(self, filters: List[dict]) -> Optional[np.ndarray]:
+        """Позиции строк, прошедших все фильтры, по возрастанию; None — фильтров нет."""
+        if not isinstance(filters, list):
+            raise QueryError('filters must be a list')
+        mask: Optional[np.ndarray] = None
+        for item in filters:
+            if not isinstance(item, dict) or 'column' not in item or 'op' not in item:
+                raise QueryError('Each filter needs column and op')
+            op = item['op']
+            if op not in FILTER_OPS:
+                raise QueryError(f'Unknown filter op: {op}')
+            rows = self._filter_rows(self.column(item['column']), op, item.get('value'))
+            matched = np.zeros(len(self.df), dtype=bool)
+            matched[rows] = True
+            if op in ('ne', 'not_in'):
+                # Пропуск не равен и не равен никакому значению: как в SQL, он проходит только is_null
+                matched = ~matched
+                matched[self.column(item['column']).nulls] = False
+            mask = matched if mask is None else mask & matched
+        return None if mask is None else np.flatnonzero(mask).astype(np.int32)
+
+    @staticmethod
+    def _filter_rows(index: ColumnIndex, op: str, value: Any) -> np.ndarray:
+        if op == 'is_null':
+            return index.nulls
+        if op == 'not_null':
+            return index.order
+        if op in ('contains', 'startswith'):
+            return np.flatnonzero(np.isin(index.codes, index.matching_codes(op, value)))
+        if op in ('in', 'not_in', 'ne'):
+            values = [value] if op == 'ne' else value
+            if not isinstance(values, list):
+                raise QueryError(f'{op} expects a list of values')
+            codes = index.value_codes(values)
+            return np.concatenate([index.rows(code, code + 1) for code in codes]) if len(codes) else index.order[:0]
+        return index.rows(*index.code_range(op, value))
+
+    def _sort(self, positions: Optional[np.ndarray], sort: List[Tuple[str, bool]]) -> np.ndarray:
+        """Упорядочивает строки; пропуски всегда в конце, при равенстве — исходный порядок."""
+        if not sort:
+            return positions if positions is not None else np.arange(len(self.df), dtype=np.int32)
+        if len(sort) == 1:
+            # Одна колонка: готовый порядок индекса, отфильтрованный маской, без сортировки
+            index = self.column(sort[0][0])
+            ordered = np.concatenate((index.descending() if sort[0][1] else index.order, index.nulls))
+            if positions is None:
+                return ordered
+            selected = np.zeros(len(self.df), dtype=bool)
+            selected[positions] = True
+            return ordered[selected[ordered]]
+
+        if positions is None:
+            positions = np.arange(len(self.df), dtype=np.int32)
+        keys = []
+        for column, descending in sort:
+            index = self.column(column)
+            codes = index.codes[positions].astype(np.int64)
+            size = len(index.uniques)
+            keys.append(np.where(codes < 0, size, (size - 1 - codes) if descending else codes))
+        # lexsort сравнивает по последнему ключу первым и сортирует устойчиво
+        return positions[np.lexsort(keys[::-1])]
+
+    def _aggregate(self, positions: Optional[np.ndarray], group_by: List[str], aggregates: List[dict]) -> pd.DataFrame:
+        if positions is None:
+            positions = np.arange(len(self.df), dtype=np.int32)
+        specs = [_aggregate_spec(item) for item in aggregates] or [('*', 'size', 'count')]
+        frame = {}
+        keys = []
+        for i, column in enumerate(group_by):
+            index = self.column(column)
+            codes = index.codes[positions]
+            # Группа пропусков получает код после всех значений и сортируется последней
+            frame[f'__key{i}'] = np.where(codes < 0, len(index.uniques), codes)
+            keys.append(f'__key{i}')
+        named = {}
+        for j, (column, func, alias) in enumerate(specs):
+            if column != '*':
+                if column not in self.df.columns:
+                    raise QueryError(f'Unknown column: {column}')
+                frame[f'__value{j}'] = self.df[column].iloc[positions].reset_index(drop=True)
+            elif func not in ('size', 'count'):
+                raise QueryError(f'{func} needs a column')
+            named[alias] = (f'__value{j}' if column != '*' else None, 'size' if column == '*' else func)
+        data = pd.DataFrame(frame, index=pd.RangeIndex(len(positions)))
+
+        try:
+            if keys:
+                grouped = data.groupby(keys, sort=True)
+                parts = {alias: grouped.size() if source is None else grouped[source].agg(func)
+                         for alias, (source, func) in named.items()}
+                result = pd.DataFrame(parts).reset_index()
+            else:
+                result = pd.DataFrame({alias: [len(data) if source is None else data[source].agg(func)]
+                                       for alias, (source, func) in named.items()})
+        except (TypeError, ValueError) as e:
+            raise QueryError(f'Aggregation failed: {e}')
+
+        for i, column in enumerate(group_by):
+            result[f'__key{i}'] = self.column(column).labels(result[f'__key{i}'].to_numpy())
+        return result.rename(columns={f'__key{i}': column for i, column in enumerate(group_by)})
+
+
+def _as_list(value: Any) -> list:
+    if not value:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _sort_key(item: Any) -> Tuple[str, bool]:
+    if isinstance(item, str):
+        return item, False
+    if not isinstance(item, dict) or 'column' not in item:
+        raise QueryError('Each sort item needs column')
+    return item['column'], bool(item.get('descending', False))
+
+
+def _aggregate_spec(item: Any) -> Tuple[str, str, str]:
+    if not isinstance(item, dict) or 'func' not in item:
+        raise QueryError('Each aggregate needs func')
+    func = item['func']
+    if func not in AGGREGATES:
+        raise QueryError(f'Unknown aggregate: {func}')
+    column = item.get('column') or '*'
+    return column, func, item.get('as') or (func if column == '*' else f'{column}_{func}')
+
+
+def _projection(columns: Optional[list], available: pd.Index) -> list:
+    """Колонки ответа из поля columns запроса; пустое поле — все колонки."""
+    if not columns:
+        return list(available)
+    missing = [column for column in columns if column not in available]
+    if missing:
+        raise QueryError(f'Unknown columns: {", ".join(map(str, missing))}')
+    return columns
+
+
+def _slice(rows, query: dict):
+    """Смещение и top-N по полям offset и limit запроса."""
+    try:
+        offset = max(int(query.get('offset') or 0), 0)
+        limit = query.get('limit')
+        end = offset + max(int(limit), 0) if limit is not None else None
+    except (TypeError, ValueError):
+        raise QueryError('limit and offset must be integers')
+    return rows[offset:end]
+
+
+def dataset_index(entry, on_resize: Optional[Callable[[int], None]] = None) -> DatasetIndex:
+    """
+    Индекс датасета из кэша; создаётся при первом запросе и хранится в записи кэша.
+    on_resize — см. DatasetIndex; задаётся при создании индекса.
+    """
+    with _index_lock:
+        if entry.query_index is None:
+            entry.query_index = DatasetIndex(entry.df, on_resize)
+        return entry.query_index
+
+
+def query_dataset(entry, query: Optional[dict], on_resize: Optional[Callable[[int], None]] = None) -> QueryResult:
+    """Выполняет запрос к закэшированному датасету."""
+    return dataset_index(entry, on_resize).query(query)
+
+
+_index_lock = threading.Lock()
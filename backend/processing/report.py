@@ -0,0 +1,222 @@
+# Рендер PDF отчётов: общий CSS и шрифты живут в процессах пула, готовые PDF кэшируются по хэшу HTML
+import os
+import hashlib
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import date
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .cache import CachedDataset
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES_DIR = Path(__file__).resolve().parent / 'templates'
+REPORT_CSS = TEMPLATES_DIR / 'report.css'
+
+# Сколько первых строк датасета попадает в отчёт, собранный по шаблону
+SAMPLE_ROWS = 20
+
+# Состояние процесса рендера: общий CSS разбирается и шрифты настраиваются один раз на процесс
+_font_config = None
+_stylesheets = None
+_init_lock = threading.Lock()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _init_renderer() -> None:
+    """Инициализатор процесса пула: конфигурация шрифтов и разобранный общий CSS."""
+    global _font_config, _stylesheets
+    from weasyprint import CSS
+    from weasyprint.text.fonts import FontConfiguration
+
+    with _init_lock:
+        if _font_config is None:
+            _font_config = FontConfiguration()
+            _stylesheets = [CSS(filename=str(REPORT_CSS), font_config=_font_config)]
+
+
+def _render_pdf(html: str, shared_css: bool) -> bytes:
+    """Рендерит HTML в PDF. Выполняется в процессе пула, поэтому только picklable-данные."""
+    from weasyprint import HTML
+
+    if _font_config is None:
+        _init_renderer()
+    return HTML(string=html).write_pdf(stylesheets=_stylesheets if shared_css else None,
+                                       font_config=_font_config)
+
+
+def _number(value) -> str:
+    """Число для таблиц отчёта: разделитель тысяч, не больше двух знаков после запятой."""
+    if value is None:
+        return '—'
+    if isinstance(value, float) and not value.is_integer():
+        return f"{value:,.2f}".replace(',', ' ')
+    try:
+        return f"{int(value):,}".replace(',', ' ')
+    except (TypeError, ValueError):
+        return str(value)
+
+
+_environment = None
+
+
+def _template_environment():
+    global _environment
+    if _environment is None:
+        from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+        _environment = Environment(loader=FileSystemLoader(str(TEMPLATES_DIR)), autoescape=select_autoescape(['html']))
+        _environment.filters['number'] = _number
+    return _environment
+
+
+def build_report_html(entry: CachedDataset, analyses: List[dict], title: Optional[str] = None) -> str:
+    """
+    Собирает HTML отчёта по закэшированному датасету и ответам моделей.
+    analyses — список {model, analysis}; дата в отчёте без времени, чтобы одинаковые отчёты брались из кэша.
+    """
+    df = entry.df
+    sample = df.head(SAMPLE_ROWS).astype(object).where(df.head(SAMPLE_ROWS).notna(), None)
+    return _template_environment().get_template('report.html').render(
+        title=title or 'Отчёт по анализу данных',
+        filename=entry.filename,
+        generated=date.today().strftime('%d.%m.%Y'),
+        total_rows=len(df),
+        columns=[str(column) for column in df.columns],
+        numeric_columns=entry.analysis.get('numeric_columns', {}),
+        string_columns=entry.analysis.get('string_columns', {}),
+        analyses=analyses,
+        sample_rows=sample.values.tolist(),
+    )
+
+
+class ReportCache:
+    """LRU-кэш готовых PDF, ограниченный суммарным размером в байтах."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._reports: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            pdf = self._reports.get(key)
+            if pdf is None:
+                self.misses += 1
+                return None
+            self._reports.move_to_end(key)
+            self.hits += 1
+            return pdf
+
+    def put(self, key: str, pdf: bytes) -> None:
+        if len(pdf) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._reports.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= len(previous)
+            self._reports[key] = pdf
+            self.total_bytes += len(pdf)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._reports.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._reports), 'total_bytes': self.total_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+class ReportRenderer:
+    """
+    Рендерит отчёты в пуле процессов, чтобы WeasyPrint не занимал процессор и GIL сервера.
+
+    Каждый процесс пула один раз настраивает шрифты и разбирает общий CSS. Готовые
+    PDF кэшируются по хэшу HTML; одновременные запросы одного и того же отчёта
+    ждут один рендер. workers=0 — рендер в текущем процессе.
+    """
+
+    def __init__(self, workers: int, cache: ReportCache):
+        self.workers = max(workers, 0)
+        self.cache = cache
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._render_lock = threading.Lock()
+        # Правка общего CSS меняет ключи кэша: старые PDF не отдаются
+        self._css_hash = hashlib.sha256(REPORT_CSS.read_bytes()).hexdigest()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn, а не fork: сервер многопоточный, а fork копирует только текущий поток
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_renderer,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _key(self, html: str, shared_css: bool) -> str:
+        hasher = hashlib.sha256(f"{self._css_hash if shared_css else ''}\0".encode('utf-8'))
+        hasher.update(html.encode('utf-8'))
+        return hasher.hexdigest()
+
+    def render(self, html: str, shared_css: bool = False) -> bytes:
+        """PDF из HTML; shared_css подключает общий стиль отчётов (для отчётов по шаблону)."""
+        key = self._key(html, shared_css)
+        pdf = self.cache.get(key)
+        if pdf is not None:
+            logger.debug("Report %s served from cache", key[:12])
+            return pdf
+
+        with self._lock:
+            pending = self._inflight.get(key)
+            if pending is None:
+                pending = self._inflight[key] = Future()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            return pending.result()
+
+        try:
+            if self.workers == 0:
+                with self._render_lock:
+                    pdf = _render_pdf(html, shared_css)
+            else:
+                pdf = self._pool().submit(_render_pdf, html, shared_css).result()
+            self.cache.put(key, pdf)
+            pending.set_result(pdf)
+            logger.debug("Report %s rendered: %s bytes", key[:12], len(pdf))
+            return pdf
+        except Exception as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+
+
+def create_report_renderer_from_env() -> ReportRenderer:
+    """Создаёт рендер отчётов по переменным окружения REPORT_*."""
+    return ReportRenderer(
+        workers=_env_int("REPORT_WORKERS", 1),
+        cache=ReportCache(max_bytes=_env_int("REPORT_CACHE_MAX_MB", 64) * 1024 * 1024),
+    )
@@ -0,0 +1,123 @@
+# Сериализация страниц датасета: записи или колонки в JSON, Arrow IPC, сжатие ответа
+import gzip
+import json
+import logging
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # необязательная зависимость: без неё стандартный json
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # необязательная зависимость: без неё только gzip
+    brotli = None
+
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+
+# Поля, которые фронтенд ожидает в каждой записи (таблица аукционов автомобилей), и значения
+# вместо пропусков; поля без числового значения по умолчанию получают null
+RECORD_FIELDS = ['year', 'make', 'model', 'trim', 'body', 'transmission', 'vin', 'state', 'condition',
+                 'odometer', 'color', 'interior', 'seller', 'mmr', 'sellingprice', 'saledate']
+FIELD_DEFAULTS = {'condition': 0.0, 'year': 0, 'odometer': 0, 'mmr': 0, 'sellingprice': 0}
+
+# Меньшие ответы не сжимаем: выигрыш меньше заголовков
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+def dumps(value) -> bytes:
+    """JSON в байтах: orjson, если установлен (NaN -> null, ключи не только строки)."""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY, default=str)
+    return json.dumps(value, ensure_ascii=False, default=str).encode('utf-8')
+
+
+def apply_defaults(df_page: pd.DataFrame, add_missing: bool = True) -> pd.DataFrame:
+    """
+    Подставляет значения по умолчанию вместо пропусков в полях FIELD_DEFAULTS.
+    add_missing добавляет отсутствующие поля RECORD_FIELDS, как ждёт формат записей.
+    """
+    df_page = df_page.copy(deep=False)
+    for field in RECORD_FIELDS if add_missing else FIELD_DEFAULTS:
+        default = FIELD_DEFAULTS.get(field)
+        if field not in df_page.columns:
+            if add_missing:
+                df_page[field] = default
+        elif default is not None and df_page[field].hasnans:
+            column = df_page[field]
+            if isinstance(column.dtype, pd.CategoricalDtype):
+                column = column.astype(object)
+            df_page[field] = column.fillna(default)
+    return df_page
+
+
+def records_json(df_page: pd.DataFrame) -> bytes:
+    """Страница списком записей; пропуски становятся null."""
+    return df_page.to_json(orient='records', force_ascii=False, double_precision=15,
+                           date_format='iso').encode('utf-8')
+
+
+def _column_json(column: pd.Series) -> bytes:
+    dtype = column.dtype
+    if (orjson is not None and isinstance(dtype, np.dtype) and dtype.kind in 'iufb'):
+        # Числовой массив numpy orjson пишет напрямую, NaN -> null
+        return orjson.dumps(np.ascontiguousarray(column.to_numpy()), option=orjson.OPT_SERIALIZE_NUMPY)
+    if isinstance(dtype, np.dtype) and dtype.kind == 'M':
+        values = column.dt.strftime('%Y-%m-%dT%H:%M:%S')
+    else:
+        values = column.astype(object)
+    return dumps(values.where(column.notna(), None).tolist())
+
+
+def columnar_json(df_page: pd.DataFrame) -> bytes:
+    """Страница колонками: {имя колонки: [значения]} — ключи не повторяются в каждой строке."""
+    parts = [dumps(str(name)) + b':' + _column_json(df_page.iloc[:, i]) for i, name in enumerate(df_page.columns)]
+    return b'{' + b','.join(parts) + b'}'
+
+
+def json_body(meta: dict, table_json: bytes) -> bytes:
+    """Ответ JSON: метаданные страницы и уже сериализованная таблица в поле table_data."""
+    head = dumps(meta)
+    if head == b'{}':
+        return b'{"table_data":' + table_json + b'}'
+    return head[:-1] + b',"table_data":' + table_json + b'}'
+
+
+def arrow_ipc(df_page: pd.DataFrame, meta: dict) -> bytes:
+    """Страница в формате Arrow IPC (stream); метаданные ответа — JSON в метаданных схемы."""
+    import pyarrow as pa
+
+    try:
+        table = pa.Table.from_pandas(df_page, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Колонки со смешанными типами Arrow не примет — передаём их строками, пропуски остаются null
+        mixed = {c: df_page[c].astype('str').where(df_page[c].notna())
+                 for c in df_page.columns if df_page[c].dtype == object}
+        table = pa.Table.from_pandas(df_page.assign(**mixed), preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'meta': dumps(meta)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def compress(body: bytes, accepts: Callable[[str], float]) -> Tuple[bytes, Optional[str]]:
+    """
+    Сжимает тело ответа лучшим из поддерживаемых клиентом способов.
+    accepts(encoding) возвращает вес кодировки из Accept-Encoding (0 — не поддерживается).
+    """
+    if len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    if brotli is not None and accepts('br'):
+        return brotli.compress(body, quality=BROTLI_QUALITY), 'br'
+    if accepts('gzip'):
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), 'gzip'
+    return body, None
@@ -0,0 +1,348 @@
+# Сливаемые накопители статистики: обновляются по чанкам и объединяются между воркерами
+import math
+import logging
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+import pandas as pd
+
+from .analysis import UNIQUE_VALUES_LIMIT, TOP_VALUES_LIMIT, QUANTILES, _empty_numeric_stats, _finite, _to_python
+
+logger = logging.getLogger(__name__)
+
+
+def hash_values(values) -> np.ndarray:
+    """64-битные хэши значений (векторно, через pandas)."""
+    return pd.util.hash_array(np.asarray(values, dtype=object))
+
+
+class HyperLogLog:
+    """
+    Оценка числа уникальных значений с постоянной памятью (2^p байт).
+
+    Пока уникальных хэшей меньше exact_limit, они хранятся точно — для небольших
+    таблиц ответ совпадает с nunique().
+    """
+
+    def __init__(self, p: int = 14, exact_limit: int = 4096):
+        self.p = p
+        self.exact_limit = exact_limit
+        self._exact: Optional[np.ndarray] = np.empty(0, dtype=np.uint64)
+        self._registers: Optional[np.ndarray] = None
+
+    def update_hashes(self, hashes: np.ndarray) -> None:
+        if self._exact is not None:
+            self._exact = np.union1d(self._exact, hashes)
+            if len(self._exact) <= self.exact_limit:
+                return
+            hashes, self._exact = self._exact, None
+            self._registers = np.zeros(1 << self.p, dtype=np.uint8)
+        self._add_to_registers(hashes)
+
+    def _add_to_registers(self, hashes: np.ndarray) -> None:
+        assert self._registers is not None
+        hashes = hashes.astype(np.uint64, copy=False)
+        bits = 64 - self.p
+        index = (hashes >> np.uint64(bits)).astype(np.intp)
+        rest = hashes & np.uint64((1 << bits) - 1)
+        # frexp даёт точную длину в битах: rest < 2^50 представим в float64 без потерь
+        _, bit_length = np.frexp(rest.astype(np.float64))
+        rank = (bits - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self._registers, index, rank)
+
+    def merge(self, other: 'HyperLogLog') -> None:
+        if other._exact is not None:
+            self.update_hashes(other._exact)
+            return
+        assert other._registers is not None
+        if self._exact is not None:
+            exact, self._exact = self._exact, None
+            self._registers = other._registers.copy()
+            self._add_to_registers(exact)
+        else:
+            assert self._registers is not None
+            np.maximum(self._registers, other._registers, out=self._registers)
+
+    def estimate(self) -> int:
+        if self._exact is not None:
+            return int(len(self._exact))
+        assert self._registers is not None
+        m = float(len(self._registers))
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / float(np.sum(np.ldexp(1.0, -self._registers.astype(np.int64))))
+        zeros = int(np.count_nonzero(self._registers == 0))
+        if raw <= 2.5 * m and zeros:
+            # Линейный подсчёт для малых кардинальностей
+            return int(round(m * math.log(m / zeros)))
+        return int(round(raw))
+
+
+class KllSketch:
+    """
+    KLL-скетч для квантилей: иерархия компакторов, память O(k·log(n/k)).
+    Пока данных меньше k, квантили точные.
+    """
+
+    def __init__(self, k: int = 2048, seed: Optional[int] = None):
+        self.k = k
+        self.levels: List[np.ndarray] = [np.empty(0)]
+        self.count = 0
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(int(math.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def update(self, values: np.ndarray) -> None:
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values.astype(np.float64, copy=False)])
+        self._compress()
+
+    def merge(self, other: 'KllSketch') -> None:
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.count += other.count
+        self._compress()
+
+    def _compress(self) -> None:
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # Нечётный элемент остаётся на уровне, из остальных в следующий уходит каждый второй
+                keep = items[:1] if len(items) % 2 else items[:0]
+                pairs = items[len(keep):]
+                offset = int(self._rng.integers(0, 2))
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], pairs[offset::2]])
+            level += 1
+
+    def quantiles(self, qs) -> List[float]:
+        """Квантили в долях [0, 1] с линейной интерполяцией по весам элементов."""
+        values = np.concatenate(self.levels)
+        if len(values) == 0:
+            return [0.0 for _ in qs]
+        weights = np.concatenate([np.full(len(items), 2.0 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        values, weights = values[order], weights[order]
+        if np.all(weights == 1.0):
+            return [float(v) for v in np.quantile(values, qs)]
+        # Позиции элементов — середины их весов на оси рангов
+        cumulative = np.cumsum(weights) - weights / 2
+        total = weights.sum()
+        return [float(np.interp(q * total, cumulative, values)) for q in qs]
+
+
+class NumericAccumulator:
+    """Счётчики, сумма, min/max, среднее и дисперсия по Уэлфорду/Чану, KLL для квантилей."""
+
+    def __init__(self):
+        self.count = 0
+        self.nulls = 0
+        self.total = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sketch = KllSketch()
+
+    def update(self, values: np.ndarray) -> None:
+        mask = np.isnan(values)
+        nulls = int(mask.sum())
+        if nulls:
+            values = values[~mask]
+        self.nulls += nulls
+        n = len(values)
+        if n == 0:
+            return
+        total = float(np.add.reduce(values, dtype='float64'))
+        mean = total / n
+        deviations = values - mean
+        self._combine(n, total, mean, float(np.dot(deviations, deviations)), float(values.min()), float(values.max()))
+        self.sketch.update(values)
+
+    def merge(self, other: 'NumericAccumulator') -> None:
+        self.nulls += other.nulls
+        if other.count:
+            self._combine(other.count, other.total, other.mean, other.m2, other.min, other.max)
+            self.sketch.merge(other.sketch)
+
+    def _combine(self, n: int, total: float, mean: float, m2: float, minimum: float, maximum: float) -> None:
+        # Параллельная формула Чана для объединения средних и M2
+        combined = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / combined
+        self.m2 += m2 + delta * delta * self.count * n / combined
+        self.count = combined
+        self.total += total
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
+
+    def result(self) -> dict:
+        if self.count == 0:
+            stats = _empty_numeric_stats()
+            stats['null_count'] = self.nulls
+            return stats
+        q25, median, q75 = self.sketch.quantiles([q / 100 for q in QUANTILES])
+        return {
+            'sum': _finite(self.total),
+            'mean': _finite(self.mean),
+            'min': _finite(self.min),
+            'max': _finite(self.max),
+            'std': _finite(math.sqrt(self.m2 / (self.count - 1))) if self.count > 1 else 0.0,
+            'q25': _finite(q25),
+            'median': _finite(median),
+            'q75': _finite(q75),
+            'count': self.count,
+            'null_count': self.nulls,
+        }
+
+
+class StringAccumulator:
+    """
+    Уникальные значения (HyperLogLog), первые встреченные значения и частые значения.
+    Частоты хранятся для ограниченного числа кандидатов (Space-Saving), поэтому память постоянна.
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.nulls = 0
+        self.distinct = HyperLogLog()
+        self.first_values: List = []
+        self.counts: Dict = {}
+
+    def update(self, series: pd.Series) -> None:
+        codes, uniques = pd.factorize(series, use_na_sentinel=True)
+        present = codes[codes >= 0]
+        self.nulls += len(codes) - len(present)
+        if len(uniques) == 0:
+            return
+        uniques = np.asarray(uniques, dtype=object)
+        counts = np.bincount(present, minlength=len(uniques))
+        self.distinct.update_hashes(hash_values(uniques))
+        self._remember_first(uniques[:UNIQUE_VALUES_LIMIT])
+        if len(uniques) > self.capacity:
+            # В кандидаты идут только самые частые значения чанка
+            top = np.argpartition(-counts, self.capacity - 1)[:self.capacity]
+            uniques, counts = uniques[top], counts[top]
+        self._add_counts(uniques, counts)
+
+    def merge(self, other: 'StringAccumulator') -> None:
+        self.nulls += other.nulls
+        self.distinct.merge(other.distinct)
+        self._remember_first(other.first_values)
+        self._add_counts(list(other.counts), list(other.counts.values()))
+
+    def _remember_first(self, values) -> None:
+        for value in values:
+            if len(self.first_values) >= UNIQUE_VALUES_LIMIT:
+                break
+            value = _to_python(value)
+            if value not in self.first_values:
+                self.first_values.append(value)
+
+    def _add_counts(self, values, counts) -> None:
+        for value, count in zip(values, counts):
+            value = _to_python(value)
+            self.counts[value] = self.counts.get(value, 0) + int(count)
+        if len(self.counts) > 2 * self.capacity:
+            # Оставляем capacity самых частых кандидатов; погрешность частот не больше вытесненного минимума
+            top = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:self.capacity]
+            self.counts = dict(top)
+
+    def result(self) -> dict:
+        top = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:TOP_VALUES_LIMIT]
+        return {
+            'unique_values_count': self.distinct.estimate(),
+            'unique_values': list(self.first_values),
+            'top_values': [{'value': value, 'count': count} for value, count in top],
+            'null_count': self.nulls,
+        }
+
+
+class DatasetStats:
+    """
+    Статистика датасета из сливаемых накопителей по колонкам.
+
+    update() принимает очередной чанк (при потоковом чтении или дозаписи строк),
+    merge() объединяет статистику, посчитанную разными воркерами.
+    Результат to_analysis() совместим с perform_basic_analysis.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.columns: Dict[str, object] = {}
+        # Числовые колонки, в которые пришёл текст: значения прежних чанков накопитель не хранит,
+        # поэтому статистика таких колонок пересчитывается в to_analysis() по собранному кадру
+        self.stale: Set[str] = set()
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'DatasetStats':
+        stats = cls()
+        stats.update(df)
+        return stats
+
+    def update(self, chunk: pd.DataFrame) -> None:
+        self.rows += len(chunk)
+        for column in chunk.columns:
+            series = chunk[column]
+            accumulator = self.columns.get(column)
+            is_numeric = pd.api.types.is_numeric_dtype(series)
+            if accumulator is None:
+                accumulator = NumericAccumulator() if is_numeric else StringAccumulator()
+                self.columns[column] = accumulator
+            elif isinstance(accumulator, NumericAccumulator) and not is_numeric:
+                if series.isna().all():
+                    # Пустые значения (например, None в дописанных строках) тип колонки не меняют
+                    accumulator.nulls += len(series)
+                    continue
+                # Тип колонки в чанке «поплыл» (текст в числовой колонке CSV): собранный кадр
+                # получит колонку object, и статистика, как в perform_basic_analysis, — строковая
+                if accumulator.count:
+                    self.stale.add(column)
+                nulls, accumulator = accumulator.nulls, StringAccumulator()
+                accumulator.nulls = nulls
+                self.columns[column] = accumulator
+            if isinstance(accumulator, NumericAccumulator):
+                accumulator.update(series.to_numpy(dtype='float64', na_value=np.nan))
+            else:
+                accumulator.update(series)
+
+    def merge(self, other: 'DatasetStats') -> None:
+        self.rows += other.rows
+        self.stale |= other.stale
+        for column, accumulator in other.columns.items():
+            mine = self.columns.get(column)
+            if mine is None:
+                self.columns[column] = accumulator
+            elif type(mine) is type(accumulator):
+                mine.merge(accumulator)
+            else:
+                # Числа в одной части и текст в другой: колонка строковая, пересчёт — в to_analysis()
+                if isinstance(mine, NumericAccumulator):
+                    self.columns[column] = accumulator
+                self.stale.add(column)
+
+    def to_analysis(self, df: Optional[pd.DataFrame] = None) -> dict:
+        """Результат в формате perform_basic_analysis; df — собранный кадр для пересчёта колонок из stale."""
+        if self.stale:
+            if df is None:
+                logger.warning("Columns %s changed type while streaming, their stats miss earlier chunks",
+                               sorted(self.stale))
+            else:
+                for column in self.stale:
+                    rebuilt = DatasetStats.from_frame(df[[column]])
+                    self.columns[column] = rebuilt.columns[column]
+                self.stale.clear()
+        analysis = {'numeric_columns': {}, 'string_columns': {}}
+        for column, accumulator in self.columns.items():
+            key = 'numeric_columns' if isinstance(accumulator, NumericAccumulator) else 'string_columns'
+            analysis[key][column] = accumulator.result()
+        return analysis
@@ -0,0 +1,386 @@
+# Временные ряды: разбор дат, агрегаты по интервалам и скользящему окну, прореживание LTTB для графиков
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_datetime64_any_dtype, is_numeric_dtype
+
+logger = logging.getLogger(__name__)
+
+# Форматы дат в порядке проверки: сначала «день первым» (журналы измерений, выгрузки из Excel)
+DATETIME_FORMATS = (
+    '%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M', '%d.%m.%Y', '%d.%m.%y %H:%M', '%d.%m.%y',
+    '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y', '%d-%m-%Y %H:%M:%S', '%d-%m-%Y %H:%M', '%d-%m-%Y',
+    '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d', 'ISO8601',
+)
+# Колонка считается датами (числами), если разобралась такая доля непустых значений образца
+TYPED_MIN_RATIO = 0.9
+DETECT_SAMPLE = 1000
+
+RESAMPLE_RULES = {'minute': 'min', 'hour': 'h', 'day': 'D', 'week': 'W-MON', 'month': 'MS'}
+AGGREGATES = ('min', 'max', 'mean', 'median', 'sum', 'count')
+DEFAULT_AGGREGATES = ('min', 'max', 'mean')
+# Скользящее окно над уже агрегированным рядом: количество по окну — сумма количеств по интервалам
+_ROLLING_OF_RESAMPLED = {'count': 'sum'}
+DEFAULT_POINTS = 2000
+MAX_POINTS = 20000
+
+# Поля форматов, которые разбираются из байтов строки без strptime: (имя, ширина)
+_FIXED_FIELDS = {'d': ('day', 2), 'm': ('month', 2), 'Y': ('year', 4), 'y': ('year2', 2),
+                 'H': ('hour', 2), 'M': ('minute', 2), 'S': ('second', 2)}
+_NAT = np.datetime64('NaT', 'ns')
+_DATE_PREFIX = r'\s*\d{1,4}[./-]\d{1,2}[./-]\d{1,4}'
+
+
+class TimeSeriesError(ValueError):
+    """Некорректный запрос временного ряда: нет колонки с датами, неизвестная колонка или интервал."""
+
+
+def detect_datetime_format(values: pd.Series) -> Optional[str]:
+    """Формат из DATETIME_FORMATS, по которому разбирается не меньше TYPED_MIN_RATIO образца значений."""
+    sample = values.dropna().head(DETECT_SAMPLE).astype(str)
+    # Дешёвая проверка до перебора форматов: в начале значения — дата из чисел с разделителями
+    if sample.empty or sample.head(50).str.match(_DATE_PREFIX).mean() < TYPED_MIN_RATIO:
+        return None
+    for fmt in DATETIME_FORMATS:
+        parsed = pd.to_datetime(sample, format=fmt, errors='coerce', utc=fmt == 'ISO8601')
+        if parsed.notna().mean() >= TYPED_MIN_RATIO:
+            return fmt
+    return None
+
+
+def _fixed_layout(fmt: str) -> Optional[Tuple[List[Tuple[str, int, int]], List[Tuple[int, int]], int]]:
+    """Раскладка формата из цифровых полей фиксированной ширины: (поля, разделители, длина) или None."""
+    fields, separators, position, i = [], [], 0, 0
+    while i < len(fmt):
+        if fmt[i] == '%':
+            if i + 1 >= len(fmt) or fmt[i + 1] not in _FIXED_FIELDS:
+                return None
+            name, width = _FIXED_FIELDS[fmt[i + 1]]
+            fields.append((name, position, width))
+            position += width
+            i += 2
+        else:
+            if ord(fmt[i]) > 127:
+                return None
+            separators.append((position, ord(fmt[i])))
+            position += 1
+            i += 1
+    return fields, separators, position
+
+
+def _parse_fixed(matrix: np.ndarray, layout) -> Tuple[np.ndarray, np.ndarray]:
+    """Разбирает строки одинаковой длины (матрица байт n×ширина) по раскладке: (datetime64[ns], разобрана ли строка)."""
+    fields, separators, _ = layout
+    ok = np.ones(len(matrix), dtype=bool)
+    for position, byte in separators:
+        ok &= matrix[:, position] == byte
+    # Позиции символов — строками непрерывной матрицы, иначе каждый шаг читает память с шагом в ширину строки.
+    # Байты меньше '0' при беззнаковом вычитании уходят за 9 и не проходят проверку цифры
+    digits = np.ascontiguousarray((matrix - np.uint8(48)).T)
+    parts = {'month': 1, 'day': 1, 'hour': 0, 'minute': 0, 'second': 0}
+    for name, start, width in fields:
+        ok &= (digits[start:start + width] <= 9).all(axis=0)
+        value = digits[start].astype(np.int64)
+        for k in range(start + 1, start + width):
+            value = value * 10 + digits[k]
+        parts[name] = value
+    if 'year2' in parts:
+        # Как strptime: 69–99 — XX век, 00–68 — XXI
+        year2 = parts.pop('year2')
+        parts['year'] = year2 + np.where(year2 >= 69, 1900, 2000)
+    year, month, day = parts.get('year', 1970), parts['month'], parts['day']
+    ok &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+    ok &= (parts['hour'] < 24) & (parts['minute'] < 60) & (parts['second'] < 60)
+    month = np.where(ok, month, 1)
+    months = (np.asarray(year, dtype=np.int64) - 1970) * 12 + month - 1
+    month_start = months.astype('datetime64[M]').astype('datetime64[D]')
+    month_days = ((months + 1).astype('datetime64[M]').astype('datetime64[D]') - month_start).astype(np.int64)
+    ok &= day <= month_days
+    days = (month_start + (np.where(ok, day, 1) - 1)).astype(np.int64)
+    seconds = days * 86400 + parts['hour'] * 3600 + parts['minute'] * 60 + parts['second']
+    return (seconds * 1_000_000_000).view('datetime64[ns]'), ok
+
+
+def parse_datetimes(series: pd.Series, fmt: str) -> np.ndarray:
+    """
+    Разбирает колонку дат по формату в datetime64[ns]; неразобранные значения — NaT.
+    Форматы из цифровых полей фиксированной ширины (02.07.2023 08:57) разбираются
+    векторно из байтов строк, на порядок быстрее strptime; остальное — pandas.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Каждое уникальное значение разбирается один раз
+        parsed = parse_datetimes(pd.Series(series.cat.categories.astype(str)), fmt)
+        codes = series.cat.codes.to_numpy()
+        return np.where(codes >= 0, parsed[np.maximum(codes, 0)], _NAT)
+
+    values = series.to_numpy(dtype=object)
+    result = np.full(len(values), _NAT)
+    pending = ~pd.isna(values)
+    layout = _fixed_layout(fmt)
+    if layout is not None:
+        same_width = np.flatnonzero(pending & (series.str.len().to_numpy(dtype='float64', na_value=-1) == layout[2]))
+        try:
+            raw = ''.join(values[same_width]).encode('ascii')
+        except (UnicodeEncodeError, TypeError):
+            raw = None
+        if raw is not None and len(same_width):
+            matrix = np.frombuffer(raw, dtype=np.uint8).reshape(len(same_width), layout[2])
+            parsed, ok = _parse_fixed(matrix, layout)
+            result[same_width[ok]] = parsed[ok]
+            pending[same_width[ok]] = False
+    rest = np.flatnonzero(pending)
+    if len(rest):
+        parsed = pd.to_datetime(pd.Series(values[rest]).astype(str), format=fmt, errors='coerce', utc=True)
+        result[rest] = parsed.dt.tz_localize(None).to_numpy(dtype='datetime64[ns]')
+    return result
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: индексы threshold точек ряда (x по возрастанию),
+    сохраняющих его форму на графике. Первая и последняя точки остаются, остальные
+    делятся на threshold - 2 корзины; из каждой берётся точка, образующая наибольший
+    треугольник с выбранной точкой предыдущей корзины и средней точкой следующей.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    buckets = threshold - 2
+    edges = np.linspace(1, n - 1, buckets + 1).astype(np.int64)
+    # Средние точки корзин — сразу для всех, через накопленные суммы
+    sum_x = np.concatenate(([0.0], np.cumsum(x)))
+    sum_y = np.concatenate(([0.0], np.cumsum(y)))
+    sizes = edges[1:] - edges[:-1]
+    mean_x = np.append((sum_x[edges[1:]] - sum_x[edges[:-1]]) / sizes, x[-1])
+    mean_y = np.append((sum_y[edges[1:]] - sum_y[edges[:-1]]) / sizes, y[-1])
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for b in range(buckets):
+        lo, hi = edges[b], edges[b + 1]
+        ax, ay = x[a], y[a]
+        # Удвоенная площадь треугольника (a, точка корзины, среднее следующей корзины)
+        area = np.abs((ax - mean_x[b + 1]) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (mean_y[b + 1] - ay))
+        a = lo + int(np.argmax(area))
+        selected[b + 1] = a
+    return selected
+
+
+def _timestamp(value, name: str) -> np.datetime64:
+    try:
+        # Числа — миллисекунды Unix, как время в ответе
+        stamp = pd.Timestamp(value, unit='ms') if isinstance(value, (int, float)) and not isinstance(value, bool) \
+            else pd.Timestamp(value)
+    except (TypeError, ValueError, OverflowError):
+        raise TimeSeriesError(f'Некорректная дата в {name}: {value!r}')
+    if pd.isna(stamp):
+        raise TimeSeriesError(f'Некорректная дата в {name}: {value!r}')
+    if stamp.tzinfo is not None:
+        stamp = stamp.tz_convert(None)
+    return stamp.to_datetime64().astype('datetime64[ns]')
+
+
+def _epoch_ms(times: np.ndarray) -> np.ndarray:
+    return times.astype('datetime64[ms]').astype(np.int64)
+
+
+class TimeSeriesIndex:
+    """
+    Датасет, упорядоченный по колонке времени: время разбирается один раз, строки
+    без даты отбрасываются, порядок строк по времени хранится. Значения числовых
+    колонок в этом порядке берутся лениво; окно по времени — бинарный поиск.
+    """
+
+    def __init__(self, df: pd.DataFrame, time_column: str):
+        self.df = df
+        self.time_column = time_column
+        series = df[time_column]
+        if is_datetime64_any_dtype(series.dtype):
+            self.time_format = None
+            times = series.dt.tz_localize(None).to_numpy(dtype='datetime64[ns]') \
+                if getattr(series.dt, 'tz', None) is not None else series.to_numpy(dtype='datetime64[ns]')
+        else:
+            self.time_format = detect_datetime_format(series)
+            if self.time_format is None:
+                raise TimeSeriesError(f'Колонка "{time_column}" не похожа на дату и время')
+            times = parse_datetimes(series, self.time_format)
+        valid = np.flatnonzero(~np.isnat(times))
+        order = np.argsort(times[valid], kind='stable')
+        self.order = valid[order]
+        self.times = times[self.order]
+        self.dropped_rows = len(df) - len(valid)
+        self._values: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+        logger.debug("Time series index on %s: %s points, %s rows without time, format %s",
+                     time_column, len(self.times), self.dropped_rows, self.time_format)
+
+    def value_columns(self) -> List[str]:
+        """Числовые колонки, кроме колонки времени."""
+        return [c for c in self.df.columns if c != self.time_column
+                and is_numeric_dtype(self.df[c].dtype) and not is_bool_dtype(self.df[c].dtype)]
+
+    def values(self, column: str) -> np.ndarray:
+        """Значения колонки как float64 в порядке времени (нечисловые значения — NaN)."""
+        with self._lock:
+            values = self._values.get(column)
+        if values is None:
+            series = self.df[column]
+            if not is_numeric_dtype(series.dtype):
+                series = pd.to_numeric(series.astype(object), errors='coerce')
+            values = series.to_numpy(dtype='float64', na_value=np.nan)[self.order]
+            with self._lock:
+                self._values[column] = values
+        return values
+
+    def series(self, request: Optional[dict]) -> dict:
+        """
+        Ряды для графика: {columns?, start?, end?, resample?, aggregates?, rolling?, points?}.
+        Без resample и rolling — исходные значения, иначе по ряду на колонку и агрегат.
+        Каждый ряд прорежен LTTB до points точек.
+        """
+        request = request or {}
+        columns = request.get('columns') or self.value_columns()
+        if isinstance(columns, str):
+            columns = [columns]
+        unknown = [c for c in columns if c not in self.df.columns or c == self.time_column]
+        if unknown:
+            raise TimeSeriesError(f"Неизвестные колонки: {', '.join(map(str, unknown))}")
+        if not columns:
+            raise TimeSeriesError('В датасете нет числовых колонок для временного ряда')
+
+        rule = request.get('resample')
+        if rule:
+            rule = RESAMPLE_RULES.get(rule, rule)
+            try:
+                pd.tseries.frequencies.to_offset(rule)
+            except ValueError:
+                raise TimeSeriesError(f"Неизвестный интервал resample: {request.get('resample')!r}")
+        rolling = request.get('rolling')
+        if rolling is not None and not (isinstance(rolling, int) and not isinstance(rolling, bool) and rolling > 0):
+            try:
+                pd.tseries.frequencies.to_offset(rolling)
+            except (TypeError, ValueError):
+                raise TimeSeriesError(f'Окно rolling — число точек или интервал вроде "7D": {rolling!r}')
+        aggregates = request.get('aggregates') or list(DEFAULT_AGGREGATES)
+        if isinstance(aggregates, str):
+            aggregates = [aggregates]
+        bad = [a for a in aggregates if a not in AGGREGATES]
+        if bad:
+            raise TimeSeriesError(f"Неизвестные агрегаты: {', '.join(map(str, bad))}. Доступны: {', '.join(AGGREGATES)}")
+        try:
+            points = int(request.get('points', DEFAULT_POINTS))
+        except (TypeError, ValueError):
+            raise TimeSeriesError('points должно быть числом')
+        points = min(max(points, 3), MAX_POINTS)
+
+        lo, hi = 0, len(self.times)
+        if request.get('start') is not None:
+            lo = int(np.searchsorted(self.times, _timestamp(request['start'], 'start'), side='left'))
+        if request.get('end') is not None:
+            hi = int(np.searchsorted(self.times, _timestamp(request['end'], 'end'), side='right'))
+        hi = max(hi, lo)
+        times = self.times[lo:hi]
+
+        series = []
+        for column in columns:
+            values = self.values(column)[lo:hi]
+            for aggregate, index, data in self._aggregated(times, values, rule, rolling, aggregates):
+                keep = ~np.isnan(data)
+                index, data = index[keep], data[keep]
+                x = (index - index[0]).astype(np.int64) / 1e9 if len(index) else np.empty(0)
+                selected = lttb(x, data, points)
+                series.append({
+                    'column': column,
+                    'aggregate': aggregate,
+                    'total_points': len(data),
+                    'time': _epoch_ms(index[selected]).tolist(),
+                    'values': data[selected].tolist(),
+                })
+
+        return {
+            'time_column': self.time_column,
+            'time_format': self.time_format,
+            'total_points': len(self.times),
+            'dropped_rows': self.dropped_rows,
+            'start': _epoch_ms(self.times[:1])[0].item() if len(self.times) else None,
+            'end': _epoch_ms(self.times[-1:])[0].item() if len(self.times) else None,
+            'window_points': len(times),
+            'resample': request.get('resample'),
+            'rolling': rolling,
+            'points': points,
+            'series': series,
+        }
+
+    @staticmethod
+    def _aggregated(times: np.ndarray, values: np.ndarray, rule: Optional[str], rolling,
+                    aggregates: List[str]):
+        """(агрегат, время, значения) по каждому ряду: интервалы resample, затем скользящее окно."""
+        data = pd.Series(values, index=pd.DatetimeIndex(times))
+        if not rule and rolling is None:
+            yield 'value', times, values
+            return
+        if rule:
+            resampled = data.resample(rule, closed='left', label='left').agg(list(dict.fromkeys(aggregates + ['count'])))
+            # Пустые интервалы (в журнале нет измерений) не рисуем
+            resampled = resampled[resampled['count'] > 0]
+            index = resampled.index.to_numpy(dtype='datetime64[ns]')
+            for aggregate in aggregates:
+                column = resampled[aggregate]
+                if rolling is not None:
+                    column = column.rolling(rolling, min_periods=1).agg(_ROLLING_OF_RESAMPLED.get(aggregate, aggregate))
+                yield aggregate, index, column.to_numpy(dtype='float64', na_value=np.nan)
+            return
+        window = data.rolling(rolling, min_periods=1)
+        for aggregate in aggregates:
+            yield aggregate, times, getattr(window, aggregate)().to_numpy(dtype='float64', na_value=np.nan)
+
+
+def detect_time_column(df: pd.DataFrame) -> Optional[str]:
+    """Первая колонка с датами: тип datetime или текст, который разбирается форматом из DATETIME_FORMATS."""
+    for column in df.columns:
+        dtype = df[column].dtype
+        if is_datetime64_any_dtype(dtype):
+            return column
+        if is_numeric_dtype(dtype) or is_bool_dtype(dtype):
+            continue
+        if detect_datetime_format(df[column]) is not None:
+            return column
+    return None
+
+
+def timeseries_index(entry, time_column: Optional[str] = None) -> TimeSeriesIndex:
+    """
+    Индекс по времени для датасета из кэша (по умолчанию — по первой колонке с датами);
+    строится при первом запросе и хранится в записи кэша.
+    """
+    with _index_lock:
+        if time_column is None:
+            time_column = entry.time_column
+        index = entry.timeseries_index.get(time_column) if time_column is not None else None
+    if index is not None:
+        return index
+    if time_column is None:
+        time_column = detect_time_column(entry.df)
+        if time_column is None:
+            raise TimeSeriesError('В датасете не найдена колонка с датой и временем')
+    elif time_column not in entry.df.columns:
+        raise TimeSeriesError(f'Неизвестная колонка: {time_column}')
+    # Разбор дат — вне блокировки: запросы к другим датасетам его не ждут
+    index = TimeSeriesIndex(entry.df, time_column)
+    with _index_lock:
+        if entry.time_column is None:
+            entry.time_column = time_column
+        return entry.timeseries_index.setdefault(time_column, index)
+
+
+def timeseries(entry, request: Optional[dict]) -> dict:
+    """Ряды для графика по датасету из кэша (см. TimeSeriesIndex.series)."""
+    request = request or {}
+    return timeseries_index(entry, request.get('time_column')).series(request)
+
+
+_index_lock = threading.Lock()
@@ -0,0 +1,219 @@
+# Возобновляемая загрузка больших файлов частями: init → PUT частей → complete
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from .cache import compute_dataset_id
+
+logger = logging.getLogger(__name__)
+
+# Блок чтения тела запроса и файла при хэшировании: память не зависит от размера части
+_BLOCK_SIZE = 1024 * 1024
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+class UploadStore:
+    """
+    Незавершённые загрузки на диске: каталог на загрузку с файлом данных нужного
+    размера, в который части пишутся по своим смещениям, и отметками о принятых
+    частях с их SHA-256. Части можно слать в любом порядке, параллельно и повторно;
+    после обрыва клиент узнаёт недостающие из status() и досылает только их.
+
+    Части, пришедшие по порядку, сразу добавляются в SHA-256 всего файла (он же —
+    идентификатор датасета), поэтому finish() дочитывает с диска только то, что
+    пришло не по порядку или через другой воркер. Каталог общий для воркеров
+    сервера; загрузки, в которые ничего не писали дольше TTL, удаляются.
+    """
+
+    def __init__(self, directory: str, ttl_seconds: float, max_bytes: int, chunk_size: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        # upload_id -> (хэш всего файла по принятому префиксу, длина префикса); только в этом процессе
+        self._hashers: Dict[str, Tuple['hashlib._Hash', int]] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, upload_id: str) -> Path:
+        # upload_id приходит из URL: только hex uuid, иначе путь мог бы выйти за каталог
+        if len(upload_id) != 32 or not all(c in '0123456789abcdef' for c in upload_id):
+            raise LookupError('Загрузка не найдена')
+        return self.directory / upload_id
+
+    def _meta(self, upload_id: str) -> dict:
+        try:
+            with open(self._path(upload_id) / 'meta.json', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, NotADirectoryError):
+            raise LookupError('Загрузка не найдена или устарела')
+
+    def create(self, filename: str, size: int, chunk_size: Optional[int] = None) -> dict:
+        """Начинает загрузку файла из size байт; ValueError — размер вне допустимого."""
+        if size <= 0 or size > self.max_bytes:
+            raise ValueError(f'Размер файла должен быть от 1 байта до {self.max_bytes // (1024 * 1024)} МБ')
+        chunk_size = min(max(chunk_size or self.chunk_size, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+        upload_id = uuid.uuid4().hex
+        path = self.directory / upload_id
+        self._purge()
+        path.mkdir()
+        (path / 'chunks').mkdir()
+        with open(path / 'data', 'wb') as f:
+            f.truncate(size)
+        meta = {'upload_id': upload_id, 'filename': filename, 'size': size, 'chunk_size': chunk_size,
+                'chunks': -(-size // chunk_size), 'created_at': time.time()}
+        with open(path / 'meta.json', 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        extension = os.path.splitext(filename.lower())[1]
+        with self._lock:
+            self._hashers[upload_id] = (hashlib.sha256(extension.encode('utf-8')), 0)
+        return self.status(upload_id)
+
+    def status(self, upload_id: str) -> dict:
+        """Параметры загрузки и номера недостающих частей; LookupError — загрузки нет."""
+        meta = self._meta(upload_id)
+        received = self._received(upload_id)
+        return {**meta, 'received': len(received),
+                'missing': [i for i in range(meta['chunks']) if i not in received]}
+
+    def _received(self, upload_id: str) -> Dict[int, str]:
+        received = {}
+        for marker in (self._path(upload_id) / 'chunks').iterdir():
+            if marker.suffix == '':
+                received[int(marker.name)] = marker.read_text()
+        return received
+
+    def write_chunk(self, upload_id: str, index: int, stream: BinaryIO,
+                    expected_sha256: Optional[str] = None) -> dict:
+        """
+        Пишет часть index из потока на её место в файле, считая её SHA-256 по ходу чтения.
+        LookupError — загрузки нет; ValueError — неверный номер, длина или контрольная сумма.
+        """
+        meta = self._meta(upload_id)
+        path = self._path(upload_id)
+        if not 0 <= index < meta['chunks']:
+            raise ValueError(f"Номер части должен быть от 0 до {meta['chunks'] - 1}")
+        offset = index * meta['chunk_size']
+        length = min(meta['chunk_size'], meta['size'] - offset)
+
+        with self._lock:
+            state = self._hashers.get(upload_id)
+        # Часть продолжает уже захэшированный префикс — хэш файла считается на лету, в копии
+        running = state[0].copy() if state is not None and state[1] == offset else None
+
+        chunk_hasher = hashlib.sha256()
+        written = 0
+        with open(path / 'data', 'r+b') as f:
+            f.seek(offset)
+            for block in iter(lambda: stream.read(_BLOCK_SIZE), b''):
+                written += len(block)
+                if written > length:
+                    break
+                f.write(block)
+                chunk_hasher.update(block)
+                if running is not None:
+                    running.update(block)
+        marker = path / 'chunks' / str(index)
+        digest = chunk_hasher.hexdigest()
+        error = None
+        if written != length:
+            error = f'Часть {index} должна быть длиной {length} байт'
+        elif expected_sha256 and expected_sha256.lower() != digest:
+            error = f'Контрольная сумма части {index} не совпадает'
+        if error:
+            # Место части могло быть перезаписано: она снова считается недостающей
+            marker.unlink(missing_ok=True)
+            with self._lock:
+                state = self._hashers.get(upload_id)
+                if state is not None and state[1] > offset:
+                    del self._hashers[upload_id]
+            raise ValueError(error)
+
+        previous = marker.read_text() if marker.exists() else None
+        temp_marker = path / 'chunks' / f'{index}.{uuid.uuid4().hex[:8]}.tmp'
+        temp_marker.write_text(digest)
+        os.replace(temp_marker, marker)
+        with self._lock:
+            state = self._hashers.get(upload_id)
+            if running is not None and state is not None and state[1] == offset:
+                self._hashers[upload_id] = (running, offset + length)
+            elif previous not in (None, digest) and state is not None and state[1] > offset:
+                # Повтор уже захэшированной части с другим содержимым: хэш пересчитается в finish()
+                del self._hashers[upload_id]
+        return {'upload_id': upload_id, 'index': index, 'sha256': digest, 'chunks': meta['chunks'],
+                'received': len(self._received(upload_id))}
+
+    def finish(self, upload_id: str) -> Tuple[str, str, str]:
+        """
+        Завершает загрузку: возвращает (путь к собранному файлу, имя файла, идентификатор датасета).
+        Файл переходит вызывающему (он удаляет его после разбора), каталог загрузки удаляется.
+        LookupError — загрузки нет; ValueError — приняты не все части.
+        """
+        status = self.status(upload_id)
+        if status['missing']:
+            raise ValueError(f"Не получены части: {', '.join(map(str, status['missing'][:20]))}")
+        path = self._path(upload_id)
+        extension = os.path.splitext(status['filename'].lower())[1]
+        with self._lock:
+            state = self._hashers.pop(upload_id, None)
+        with open(path / 'data', 'rb') as f:
+            if state is None:
+                dataset_id = compute_dataset_id(f, extension)
+            else:
+                # Дочитываем только то, что не захэшировано при приёме частей
+                hasher, hashed = state
+                f.seek(hashed)
+                for block in iter(lambda: f.read(_BLOCK_SIZE), b''):
+                    hasher.update(block)
+                dataset_id = hasher.hexdigest()[:32]
+        logger.debug("Upload %s finished, %s of %s bytes hashed on arrival", upload_id,
+                     state[1] if state else 0, status['size'])
+
+        target = self.directory / f'{upload_id}{extension}'
+        os.replace(path / 'data', target)
+        shutil.rmtree(path, ignore_errors=True)
+        return str(target), status['filename'], dataset_id
+
+    def discard(self, upload_id: str) -> None:
+        """Прерывает загрузку и удаляет принятые части; LookupError — загрузки нет."""
+        path = self._path(upload_id)
+        if not path.exists():
+            raise LookupError('Загрузка не найдена или устарела')
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+        shutil.rmtree(path, ignore_errors=True)
+
+    def _purge(self) -> None:
+        deadline = time.time() - self.ttl_seconds
+        for path in self.directory.iterdir():
+            try:
+                # Активность загрузки — время последней принятой части
+                if path.is_dir() and (path / 'chunks').stat().st_mtime < deadline:
+                    shutil.rmtree(path)
+                    with self._lock:
+                        self._hashers.pop(path.name, None)
+                elif path.is_file() and path.stat().st_mtime < deadline:
+                    # Собранный файл, который не удалил упавший разбор
+                    path.unlink()
+            except OSError as e:
+                logger.error("Error removing stale upload %s: %s", path, e)
+
+
+def create_upload_store_from_env() -> UploadStore:
+    """Создаёт хранилище загрузок по переменным окружения UPLOAD_*."""
+    default_dir = os.path.join(tempfile.gettempdir(), 'multi-llm-analyzer', 'uploads')
+    return UploadStore(
+        directory=os.getenv("UPLOAD_DIR") or default_dir,
+        ttl_seconds=float(os.getenv("UPLOAD_TTL", "86400")),
+        max_bytes=int(float(os.getenv("UPLOAD_MAX_MB", "2048")) * 1024 * 1024),
+        chunk_size=int(float(os.getenv("UPLOAD_CHUNK_MB", "8")) * 1024 * 1024),
+    )
@@ -0,0 +1,5 @@
+from .metrics import PROMETHEUS_MIMETYPE, REGISTRY, record_ingest, record_llm_backup, record_llm_call, record_request, server_timing_header, span, start_request_timing
+from .profiler import SamplingProfiler, profiler_enabled
+
+__all__ = ['PROMETHEUS_MIMETYPE', 'REGISTRY', 'record_ingest', 'record_llm_backup', 'record_llm_call', 'record_request', 'server_timing_header', 'span',
+           'start_request_timing', 'SamplingProfiler', 'profiler_enabled']
@@ -0,0 +1,246 @@
+# Метрики процесса: счётчики, гистограммы и замеры этапов; экспорт в текстовом формате Prometheus
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Границы гистограмм в секундах: этапы обработки — миллисекунды, ответы LLM — десятки секунд
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+LabelValues = Tuple[str, ...]
+# Коллектор вызывается при экспорте: (имя, тип, описание, [(метки, значение)])
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+Collector = Callable[[], Iterable[Sample]]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик с метками."""
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def expose(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+                                 for key, value in values]
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами корзин, суммой и числом наблюдений."""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # По меткам: [счётчики корзин (последняя — +Inf), сумма]
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            state[0][index] += 1
+            state[1][0] += value
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return sum(state[0]) if state else 0
+
+    def expose(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        lines = self._header()
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса и коллекторов, читающих счётчики других компонентов при экспорте."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Collector] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, collect: Collector) -> None:
+        self._collectors.append(collect)
+
+    def expose(self) -> str:
+        """Все метрики в текстовом формате Prometheus."""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.expose())
+        for collect in self._collectors:
+            try:
+                samples = list(collect())
+            except Exception as e:
+                # Сломанный коллектор не должен ронять весь экспорт
+                logger.warning("Metrics collector %s failed: %s", getattr(collect, '__name__', collect), e)
+                continue
+            for name, kind, documentation, values in samples:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in values:
+                    lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    'analyzer_http_requests_total', 'HTTP requests by endpoint, method and status', ['endpoint', 'method', 'status'])
+HTTP_LATENCY = REGISTRY.histogram(
+    'analyzer_http_request_duration_seconds', 'Time to response headers by endpoint', ['endpoint', 'method'])
+STAGE_LATENCY = REGISTRY.histogram(
+    'analyzer_stage_duration_seconds', 'Duration of processing stages (parse, serialize, prompt, llm, render)', ['stage'])
+INGESTED_BYTES = REGISTRY.counter('analyzer_ingested_bytes_total', 'Bytes of uploaded files parsed', ['format'])
+INGESTED_ROWS = REGISTRY.counter('analyzer_ingested_rows_total', 'Rows parsed from uploaded files', ['format'])
+LLM_LATENCY = REGISTRY.histogram(
+    'analyzer_llm_request_duration_seconds', 'Provider call latency including retries', ['provider', 'outcome'],
+    buckets=LLM_BUCKETS)
+LLM_RETRIES = REGISTRY.counter('analyzer_llm_retries_total', 'Provider call attempts after the first', ['provider'])
+LLM_TOKENS = REGISTRY.counter(
+    'analyzer_llm_tokens_total', 'Tokens reported by providers (non-streaming calls)', ['provider', 'kind'])
+LLM_BACKUPS = REGISTRY.counter(
+    'analyzer_llm_backup_requests_total', 'Hedged and failover requests by primary provider and whether their answer was used',
+    ['provider', 'kind', 'outcome'])
+
+# Замеры этапов текущего HTTP-запроса для заголовка Server-Timing; None — заголовок не собирается
+_request_spans: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar('request_spans', default=None)
+
+
+def start_request_timing() -> None:
+    """Начинает сбор этапов запроса для Server-Timing (вызывается в before_request)."""
+    _request_spans.set([])
+
+
+def server_timing_header(total_seconds: float) -> Optional[str]:
+    """Значение заголовка Server-Timing по собранным этапам или None, если сбор не начат."""
+    spans = _request_spans.get()
+    if spans is None:
+        return None
+    _request_spans.set(None)
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in spans]
+    parts.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ', '.join(parts)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Замеряет этап обработки: гистограмма этапов и, внутри HTTP-запроса, Server-Timing."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_LATENCY.observe(elapsed, stage=stage)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+def record_request(endpoint: str, method: str, status: int, seconds: float) -> None:
+    """Учитывает HTTP-запрос: endpoint — шаблон маршрута, а не URL, чтобы число меток было ограничено."""
+    HTTP_LATENCY.observe(seconds, endpoint=endpoint, method=method)
+    HTTP_REQUESTS.inc(endpoint=endpoint, method=method, status=status)
+
+
+def record_ingest(file_format: str, nbytes: int, rows: int) -> None:
+    """Учитывает разобранный загруженный файл: байты и строки по формату."""
+    INGESTED_BYTES.inc(nbytes, format=file_format)
+    INGESTED_ROWS.inc(rows, format=file_format)
+
+
+def record_llm_backup(provider: str, kind: str, used: bool) -> None:
+    """Учитывает запасной запрос (kind: hedge или failover) для основного провайдера provider."""
+    LLM_BACKUPS.inc(provider=provider, kind=kind, outcome='used' if used else 'not_used')
+
+
+def record_llm_call(provider: str, started: float, outcome: str, attempts: int = 1,
+                    prompt_tokens=None, completion_tokens=None) -> None:
+    """
+    Учитывает вызов провайдера: длительность от started (time.perf_counter), исход
+    (ok/error), повторные попытки и токены, если провайдер их сообщил.
+    """
+    LLM_LATENCY.observe(time.perf_counter() - started, provider=provider, outcome=outcome)
+    if attempts > 1:
+        LLM_RETRIES.inc(attempts - 1, provider=provider)
+    for kind, tokens in (('prompt', prompt_tokens), ('completion', completion_tokens)):
+        try:
+            if tokens is not None:
+                LLM_TOKENS.inc(int(tokens), provider=provider, kind=kind)
+        except (TypeError, ValueError):
+            pass
@@ -0,0 +1,67 @@
+# Выборочный профилировщик: периодически снимает стеки всех потоков процесса
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from typing import Optional
+
+# Не даём снять профиль надолго: сэмплер сам потребляет процессор
+MAX_SECONDS = 60.0
+MIN_INTERVAL = 0.001
+
+
+def profiler_enabled() -> bool:
+    """Профилировщик доступен только при PROFILER_ENABLED=true: стеки раскрывают внутренности сервера."""
+    return os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class SamplingProfiler:
+    """
+    Раз в interval секунд снимает стеки всех потоков, кроме своего, и считает
+    одинаковые стеки. Результат — «свёрнутые» стеки (по строке на стек, кадры через ';'
+    от корня к листу, затем число попаданий) для flamegraph.pl или speedscope.
+    Одновременно работает только один сеанс.
+    """
+
+    _session_lock = threading.Lock()
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = max(interval, MIN_INTERVAL)
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+
+    def _sample(self, skip_thread: int) -> None:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == skip_thread:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            self.samples[';'.join(reversed(stack))] += 1
+        self.sample_count += 1
+
+    def run(self, seconds: float) -> Optional[str]:
+        """Снимает профиль в текущем потоке; None, если уже идёт другой сеанс."""
+        if not self._session_lock.acquire(blocking=False):
+            return None
+        try:
+            current = threading.get_ident()
+            deadline = time.monotonic() + min(max(seconds, 0.0), MAX_SECONDS)
+            while time.monotonic() < deadline:
+                self._sample(current)
+                time.sleep(self.interval)
+        finally:
+            self._session_lock.release()
+        return self.folded()
+
+    def folded(self) -> str:
+        return ''.join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
@@ -0,0 +1,10 @@
+# Общие настройки тестов бэкенда: запуск из корня репозитория или из backend (python -m pytest)
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# Нейросети в тестах не вызываются: помощники возвращают заглушки
+os.environ.setdefault('TEST_MODE', 'true')
@@ -0,0 +1,80 @@
+# Тесты запросов к датасету на сервере: POST /api/datasets/<id>/query
+import io
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+import pdf_server
+from processing.cache import DatasetCache
+from processing.query import query_dataset
+
+CARS_CSV = Path(__file__).resolve().parents[2] / 'test_cars-1000.csv'
+
+
+@pytest.fixture(scope='module')
+def client():
+    return pdf_server.create_app().test_client()
+
+
+@pytest.fixture(scope='module')
+def dataset_id(client):
+    response = client.post('/api/upload', data={'file': (io.BytesIO(CARS_CSV.read_bytes()), 'cars.csv')})
+    assert response.status_code == 200
+    return response.get_json()['dataset_id']
+
+
+def _query(client, dataset_id, query, **params):
+    response = client.post(f'/api/datasets/{dataset_id}/query', json=query, query_string=params)
+    return response.status_code, response.get_json()
+
+
+def test_is_null_filter_keeps_nulls(client, dataset_id):
+    expected = int(pd.read_csv(CARS_CSV)['condition'].isna().sum())
+    status, body = _query(client, dataset_id, {'filters': [{'column': 'condition', 'op': 'is_null'}],
+                                               'columns': ['vin', 'condition']}, page_size=1000)
+    assert status == 200
+    assert expected > 0
+    assert body['total_rows'] == expected
+    assert len(body['table_data']) == expected
+    assert all(row['condition'] is None for row in body['table_data'])
+
+
+def test_projection_returns_only_requested_columns(client, dataset_id):
+    status, body = _query(client, dataset_id, {'columns': ['make', 'sellingprice'], 'limit': 5})
+    assert status == 200
+    assert body['columns'] == ['make', 'sellingprice']
+    assert [set(row) for row in body['table_data']] == [{'make', 'sellingprice'}] * 5
+
+
+def test_group_by_rows_are_not_padded(client, dataset_id):
+    status, body = _query(client, dataset_id, {'group_by': ['make'], 'aggregates': [{'func': 'size'}]})
+    assert status == 200
+    assert all(set(row) == {'make', 'size'} for row in body['table_data'])
+
+
+def test_group_by_projection(client, dataset_id):
+    status, body = _query(client, dataset_id, {'group_by': ['make'], 'aggregates': [{'func': 'size'}],
+                                               'columns': ['size']})
+    assert status == 200
+    assert body['columns'] == ['size']
+    status, body = _query(client, dataset_id, {'group_by': ['make'], 'columns': ['model']})
+    assert status == 400
+    assert body['error'] == 'Unknown columns: model'
+
+
+def test_columns_must_be_a_list(client, dataset_id):
+    status, body = _query(client, dataset_id, {'columns': 'make'})
+    assert status == 400
+    assert body['error'] == 'columns must be a list'
+
+
+def test_query_memory_is_charged_to_dataset_cache():
+    cache = DatasetCache(max_bytes=1 << 30, ttl_seconds=3600)
+    entry = cache.put('cars', pd.read_csv(CARS_CSV), {})
+    data_bytes = cache.total_bytes
+    result = query_dataset(entry, {'sort': [{'column': 'sellingprice', 'descending': True}]},
+                           lambda nbytes: cache.charge(entry, nbytes))
+    # Кэш результатов хранит позиции строк, а не копию датасета
+    assert result.positions.nbytes == 4 * len(entry.df)
+    assert entry.nbytes == cache.total_bytes == data_bytes + entry.query_index.nbytes
@@ -0,0 +1,12 @@
+# Точка входа production-сервера: gunicorn -c gunicorn.conf.py (из каталога backend)
+import gc
+
+from pdf_server import create_app, warm_up
+
+# В мастере gunicorn (preload_app) всё тяжёлое загружается один раз до fork
+warm_up()
+app = create_app()
+
+# Загруженные объекты переводятся в постоянное поколение сборщика мусора: он не обходит их
+# в воркерах и не трогает счётчики ссылок, поэтому общие после fork страницы памяти не копируются
+gc.freeze()
@@ -34,6 +34,7 @@ python -c "import flask; print('Flask версия:', flask.__version__)"
 echo.
 echo 5. Запускаем сервер...
 cd backend
+set LOG_LEVEL=DEBUG
 python pdf_server.py
 
 pause